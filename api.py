@@ -1,25 +1,59 @@
-from fastapi import FastAPI, HTTPException
-from asgi_correlation_id import CorrelationIdMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from asgi_correlation_id import CorrelationIdMiddleware, correlation_id
 import structlog
-import subprocess
 
+import config
+import database
+import metrics
 from logging_config import configure_logging
 from database import initialize_database
+from conversion_logic import ConversionSettings, ScanOptions, scan_video_files, set_ffmpeg_executables
+from encoder_capabilities import CapabilityRegistry
+from job_events import EVENT_SNAPSHOT, JobEvent, JobEventBus
+from job_runner import JobRunner, run_db
+from schemas import ConversionRequest, ConversionResponse, Job, JobLogEntry, JobPage, JobStatus
 
-# Configure logging and initialize database before starting the app
+# Configure logging before starting the app
 configure_logging()
-initialize_database()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    set_ffmpeg_executables(config.settings.FFMPEG_PATH, config.settings.FFPROBE_PATH)
+    initialize_database()
+    app.state.job_events = JobEventBus()
+    job_writer = database.JobWriter()
+    app.state.job_runner = JobRunner(config.settings.MAX_CONCURRENT_JOBS, events=app.state.job_events, writer=job_writer)
+    yield
+    await app.state.job_runner.shutdown()
+    # Commit the final state of interrupted jobs before exiting
+    await asyncio.to_thread(job_writer.close)
+
 
 app = FastAPI(
     title="FFMPEG Bulk Converter API",
     description="An API for bulk video conversion using FFMPEG.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(CorrelationIdMiddleware)
 
 log = structlog.get_logger()
 
+# ffmpeg's version and encoders, probed once per TTL instead of on every request
+capabilities = CapabilityRegistry(config.settings.CAPABILITY_TTL_SECONDS)
+
+# Idle event streams send a comment this often so proxies don't close them
+EVENT_STREAM_KEEPALIVE_SECONDS = 15.0
+
 
 @app.get("/")
 def read_root():
@@ -30,22 +64,10 @@ def read_root():
 
 @app.get("/health", tags=["Health"])
 def health_check():
-    """Performs a health check and returns FFmpeg version."""
-    try:
-        # Execute ffmpeg -version command
-        result = subprocess.run(
-            ["ffmpeg", "-version"],
-            capture_output=True,
-            text=True,
-            check=True,
-            creationflags=subprocess.CREATE_NO_WINDOW # Prevent opening a window on Windows
-        )
-        # The version info is typically in the first line of stdout
-        ffmpeg_version = result.stdout.splitlines()[0]
-        log.info("Health check successful", ffmpeg_version=ffmpeg_version)
-        return {"status": "healthy", "ffmpeg_version": ffmpeg_version}
-    except (FileNotFoundError, subprocess.CalledProcessError) as e:
-        log.error("Health check failed: FFmpeg not found or failed to execute", error=str(e))
+    """Performs a health check and returns the FFmpeg version and what it can encode, from the capability cache."""
+    ffmpeg = capabilities.get()
+    if not ffmpeg.available:
+        log.error("Health check failed: FFmpeg not found or failed to execute", error=ffmpeg.error)
         raise HTTPException(
             status_code=503,
             detail={
@@ -53,3 +75,169 @@ def health_check():
                 "error": "FFmpeg not found or not executable. Please check the installation.",
             },
         )
+    return {
+        "status": "healthy",
+        "ffmpeg_version": ffmpeg.version,
+        "encoder_count": len(ffmpeg.encoders),
+        "hwaccels": list(ffmpeg.hwaccels),
+        "probed_at": datetime.fromtimestamp(capabilities.probed_at, timezone.utc).isoformat(),
+    }
+
+
+@app.get("/metrics", tags=["Health"])
+def get_metrics():
+    """Stage timings, throughput, failures and load of this process, in the Prometheus text format."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _scan_request(request: ConversionRequest) -> list[str]:
+    # Runs in a worker thread: scanning a large library must not block the event loop
+    video_files = list(scan_video_files(request.input_directory, ScanOptions(recursive=request.recursive, exclude_dirs=(request.output_directory,))))
+    os.makedirs(request.output_directory, exist_ok=True)
+    return video_files
+
+
+@app.post("/convert", status_code=202, response_model=ConversionResponse, tags=["Jobs"])
+async def start_conversion(request: ConversionRequest):
+    """Starts a bulk conversion job in the background and returns its ID."""
+    try:
+        video_files = await asyncio.to_thread(_scan_request, request)
+    except (ValueError, OSError) as e:
+        log.warning("Rejected conversion request", error=str(e))
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+
+    settings = ConversionSettings(
+        output_dir=request.output_directory,
+        video_codec=request.video_codec,
+        audio_codec=request.audio_codec,
+        output_format=request.output_format,
+        video_bitrate=request.video_bitrate,
+        fallback_bitrate=request.fallback_bitrate,
+        cap_dynamic_bitrate=request.cap_dynamic_bitrate,
+        quality_profile=request.bitrate_quality_profile,
+        delete_input=request.delete_input_files,
+        verbose_logging=request.verbose_logging,
+        passthrough=request.passthrough,
+        passthrough_threshold=request.passthrough_threshold,
+        subtitles=request.subtitles,
+        attachments=request.attachments,
+        quality_metric=request.quality_metric,
+        quality_target=request.quality_target,
+        calibration_budget=request.calibration_budget,
+    )
+    policy = request.codec_fallback or config.settings.CODEC_FALLBACK
+    try:
+        settings, notes = await asyncio.to_thread(capabilities.resolve_settings, settings, policy)
+    except ValueError as e:
+        log.warning("Rejected conversion request", error=str(e))
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+
+    job_id = uuid.uuid4()
+    await run_db(database.create_job, job_id, correlation_id.get())
+    for note in notes:
+        log.warning("Codec check", job_id=str(job_id), note=note)
+        await run_db(database.log_to_job, job_id, note, "warning")
+    app.state.job_runner.submit(job_id, video_files, settings, request.concurrent_conversions)
+    log.info("Conversion job accepted", job_id=str(job_id), file_count=len(video_files))
+    return ConversionResponse(
+        job_id=job_id,
+        status="Conversion initiated.",
+        file_count=len(video_files),
+        files_to_process=[os.path.relpath(f, request.input_directory) for f in video_files],
+    )
+
+
+@app.get("/jobs", response_model=JobPage, tags=["Jobs"])
+async def list_jobs(
+    status: JobStatus | None = None,
+    correlation_id: str | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = None,
+):
+    """Lists jobs newest first. Pass `next_cursor` from a page as `cursor` to get the next one."""
+    try:
+        items, next_cursor = await run_db(database.list_jobs, status, correlation_id, created_after, created_before, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+    return JobPage(items=items, next_cursor=next_cursor)
+
+
+@app.get("/status/{job_id}", response_model=Job, tags=["Jobs"])
+async def get_job_status(job_id: uuid.UUID, log_tail: int | None = Query(default=None, ge=0)):
+    """Returns the status, progress and log of a job; log_tail limits the log to its last lines."""
+    job = await run_db(database.get_job, job_id, log_tail)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": "Job ID not found."})
+    return job
+
+
+@app.get("/jobs/{job_id}/logs", response_model=list[JobLogEntry], tags=["Jobs"])
+async def get_job_logs(job_id: uuid.UUID, after: int = Query(default=0, ge=0), limit: int = Query(default=100, ge=1, le=1000)):
+    """Returns a page of a job's log, oldest first. Pass the last entry's seq as `after` for the next page."""
+    entries = await run_db(database.get_job_logs, job_id, after, limit)
+    if not entries and after == 0 and await run_db(database.get_job, job_id, 0) is None:
+        raise HTTPException(status_code=404, detail={"error": "Job ID not found."})
+    return entries
+
+
+async def _stored_job_snapshot(job_id: uuid.UUID) -> JobEvent:
+    # Jobs that are no longer (or never were) on the event bus, e.g. from before a restart
+    job = await run_db(database.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": "Job ID not found."})
+    return JobEvent(0, EVENT_SNAPSHOT, {"status": job.status.value, "progress": job.progress})
+
+
+@app.get("/jobs/{job_id}/events", tags=["Jobs"])
+async def stream_job_events(job_id: uuid.UUID, request: Request, last_event_id: int | None = None):
+    """
+    Streams a job's status, progress, per-file progress and log as Server-Sent Events.
+
+    Reconnecting clients resume after the Last-Event-ID header (or last_event_id query
+    parameter). Once a finished job has been fully delivered, 204 tells EventSource
+    clients to stop reconnecting.
+    """
+    resuming = last_event_id is not None or "last-event-id" in request.headers
+    if last_event_id is None:
+        try:
+            last_event_id = int(request.headers.get("last-event-id") or 0)
+        except ValueError:
+            raise HTTPException(status_code=400, detail={"error": "Last-Event-ID must be an integer."})
+
+    events = app.state.job_events
+    if job_id not in events:
+        snapshot = await _stored_job_snapshot(job_id)
+        if resuming:
+            return Response(status_code=204)
+        return StreamingResponse(iter([snapshot.to_sse()]), media_type="text/event-stream")
+    if events.is_finished(job_id, last_event_id):
+        return Response(status_code=204)
+
+    async def stream():
+        async for event in events.subscribe(job_id, last_event_id, keepalive=EVENT_STREAM_KEEPALIVE_SECONDS):
+            yield ": keepalive\n\n" if event is None else event.to_sse()
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/jobs/{job_id}/events")
+async def job_events_websocket(websocket: WebSocket, job_id: uuid.UUID, last_event_id: int = 0):
+    """The WebSocket variant of the job event stream; each message is one event as JSON."""
+    await websocket.accept()
+    events = app.state.job_events
+    try:
+        if job_id not in events:
+            try:
+                snapshot = await _stored_job_snapshot(job_id)
+            except HTTPException:
+                await websocket.close(code=1008, reason="Job ID not found.")
+                return
+            await websocket.send_json(snapshot.to_json())
+        else:
+            async for event in events.subscribe(job_id, last_event_id):
+                await websocket.send_json(event.to_json())
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,157 @@
+"""
+Durable per-file manifest of a GUI conversion batch, kept in the job database.
+
+A batch is identified by its input and output folders and the settings that shape
+its outputs, so running the same batch again finds the manifest of the earlier run.
+Every state change is committed before the conversion moves on, which lets an
+interrupted batch resume: files that are done are skipped, and files that were being
+encoded have their partial outputs removed and are converted again, to the output
+path they were given the first time.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import database
+import metrics
+from conversion_logic import ConversionSettings, conversion_params, partial_outputs, remove_partial_output
+from schemas import BatchFileStatus
+
+
+def batch_id(input_dir: str, settings: ConversionSettings) -> str:
+    """The ID of the batch converting input_dir with settings; the same on every run."""
+    key = {
+        "input_dir": os.path.abspath(input_dir),
+        "output_dir": os.path.abspath(settings.output_dir),
+        **conversion_params(settings),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class BatchFile:
+    """The manifest entry of one input file."""
+    input_file: str
+    status: BatchFileStatus
+    output_path: str | None = None
+    error: str | None = None
+
+
+class BatchManifest:
+    """
+    The per-file state of a batch, loaded from and written through to the job database.
+
+    Opening the manifest recovers from an interrupted run: partial outputs of unfinished
+    files are deleted, and files that were being encoded are pending again (or done, if
+    the crash came after their output was renamed into place). Lookups are served from
+    memory; updates are committed immediately with synchronous=FULL, so they survive a
+    crash of the host, not just of the application. Safe to share between threads.
+    """
+
+    def __init__(self, input_dir: str, settings: ConversionSettings):
+        database.initialize_database()
+        self.batch_id = batch_id(input_dir, settings)
+        self.interrupted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(database.DB_FILE, timeout=database.BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        database._configure_connection(self._conn)
+        self._conn.execute("PRAGMA synchronous = FULL")
+
+        now_iso = datetime.now(timezone.utc).isoformat()
+        settings_json = json.dumps(conversion_params(settings))
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO batches (id, input_dir, output_dir, settings, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET updated_at = excluded.updated_at
+                """,
+                (self.batch_id, os.path.abspath(input_dir), os.path.abspath(settings.output_dir), settings_json, now_iso, now_iso),
+            )
+        rows = self._conn.execute(
+            "SELECT input_file, status, output_path, error FROM batch_files WHERE batch_id = ?", (self.batch_id,)
+        ).fetchall()
+        self._files = {
+            row["input_file"]: BatchFile(row["input_file"], BatchFileStatus(row["status"]), row["output_path"], row["error"])
+            for row in rows
+        }
+        self._recover()
+
+    def _recover(self):
+        for entry in list(self._files.values()):
+            if entry.status == BatchFileStatus.DONE:
+                if entry.output_path and not os.path.exists(entry.output_path):
+                    # The output was deleted since, so the file has to be converted again
+                    self.set_status(entry.input_file, BatchFileStatus.PENDING, entry.output_path)
+                continue
+            if entry.output_path:
+                for path in partial_outputs(entry.output_path):
+                    remove_partial_output(path)
+            if entry.status == BatchFileStatus.ENCODING:
+                if entry.output_path and os.path.exists(entry.output_path):
+                    # Output paths are only ever assigned when free, so this one was renamed into place just before the crash
+                    self.set_status(entry.input_file, BatchFileStatus.DONE, entry.output_path)
+                else:
+                    self.interrupted += 1
+                    self.set_status(entry.input_file, BatchFileStatus.PENDING, entry.output_path)
+
+    def get(self, input_file: str) -> BatchFile | None:
+        return self._files.get(os.path.abspath(input_file))
+
+    def is_done(self, input_file: str) -> bool:
+        """Whether an earlier run already converted the file and its output still exists."""
+        entry = self.get(input_file)
+        return entry is not None and entry.status == BatchFileStatus.DONE
+
+    def output_paths(self) -> dict[str, str]:
+        """
+        The output paths assigned to unfinished files by an earlier run, keyed by input file.
+
+        Planning reuses them, so a resumed file doesn't get a new z_1_ name next to its old one.
+        Paths that have been taken by another file in the meantime are left out.
+        """
+        return {
+            entry.input_file: entry.output_path
+            for entry in self._files.values()
+            if entry.status != BatchFileStatus.DONE and entry.output_path and not os.path.exists(entry.output_path)
+        }
+
+    def set_status(self, input_file: str, status: BatchFileStatus, output_path: str | None = None, error: str | None = None):
+        """
+        Records the state of an input file and commits it before returning.
+
+        Args:
+            input_file: The input file.
+            status: Its new state.
+            output_path: The output it is (or was) converted to; keeps the recorded one if None.
+            error: Why the conversion failed, for BatchFileStatus.FAILED.
+        """
+        input_file = os.path.abspath(input_file)
+        with self._lock:
+            previous = self._files.get(input_file)
+            if output_path is None and previous is not None:
+                output_path = previous.output_path
+            entry = BatchFile(input_file, status, output_path, error)
+            with metrics.stage(metrics.STAGE_DB_WRITE), self._conn:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO batch_files (batch_id, input_file, status, output_path, error, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (self.batch_id, input_file, status.value, output_path, error, datetime.now(timezone.utc).isoformat()),
+                )
+            self._files[input_file] = entry
+
+    def counts(self) -> dict[BatchFileStatus, int]:
+        """The number of files in each state."""
+        counts = dict.fromkeys(BatchFileStatus, 0)
+        for entry in self._files.values():
+            counts[entry.status] += 1
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
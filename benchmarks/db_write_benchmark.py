@@ -0,0 +1,115 @@
+"""
+Measures job-store write throughput with many jobs updating progress and logs at once.
+
+Compares the original access pattern (a fresh connection and a commit per update, in
+rollback-journal mode) with the WAL-mode JobWriter that group-commits queued updates.
+Each simulated job is a thread sending progress updates and log lines as fast as it can.
+
+Usage:
+    python -m benchmarks.db_write_benchmark [--jobs 32] [--updates 200] [--json]
+"""
+import argparse
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import database
+
+
+def _create_jobs(count: int) -> list[uuid.UUID]:
+    conn = database.get_db_connection()
+    job_ids = [uuid.uuid4() for _ in range(count)]
+    for job_id in job_ids:
+        database.create_job(conn, job_id, None)
+    conn.close()
+    return job_ids
+
+
+def run_legacy(job_ids: list[uuid.UUID], updates: int) -> dict:
+    """Every update opens its own connection and commits on its own, as database.py used to."""
+    conn = sqlite3.connect(database.DB_FILE)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    errors = []
+
+    def job(job_id):
+        for i in range(updates):
+            try:
+                conn = sqlite3.connect(database.DB_FILE)
+                conn.row_factory = sqlite3.Row
+                if i % 2:
+                    database.update_job_progress(conn, job_id, float(i))
+                else:
+                    database.log_to_job(conn, job_id, f"line {i}")
+                conn.close()
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    elapsed = _run_threads(job, job_ids)
+    return {"seconds": elapsed, "errors": len(errors), "commits": len(job_ids) * updates - len(errors)}
+
+
+def run_writer(job_ids: list[uuid.UUID], updates: int) -> dict:
+    """Updates are queued to a single JobWriter thread and group-committed."""
+    writer = database.JobWriter()
+
+    def job(job_id):
+        for i in range(updates):
+            if i % 2:
+                writer.update_progress(job_id, float(i))
+            else:
+                writer.log(job_id, f"line {i}")
+
+    # Include the time until everything is committed, not just queued
+    elapsed = _run_threads(job, job_ids, finish=writer.close)
+    return {"seconds": elapsed, "errors": 0, "commits": writer.commits}
+
+
+def _run_threads(target, job_ids, finish=None) -> float:
+    threads = [threading.Thread(target=target, args=(job_id,)) for job_id in job_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if finish is not None:
+        finish()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark job-store writes under concurrent jobs.")
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--updates", type=int, default=200, help="Progress and log writes per job.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, run in (("legacy", run_legacy), ("writer", run_writer)):
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DB_PATH = Path(tmp)
+            database.DB_FILE = Path(tmp) / "jobs.db"
+            database.initialize_database()
+            job_ids = _create_jobs(args.jobs)
+            result = run(job_ids, args.updates)
+            result["writes_per_second"] = round(args.jobs * args.updates / result["seconds"])
+            result["seconds"] = round(result["seconds"], 3)
+            results[name] = result
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.jobs} concurrent jobs x {args.updates} writes")
+    for name, result in results.items():
+        print(
+            f"  {name:<7} {result['writes_per_second']:>8} writes/s  {result['seconds']:>7.3f}s  "
+            f"{result['commits']:>6} commits  {result['errors']} 'database is locked' errors"
+        )
+
+
+if __name__ == "__main__":
+    main()
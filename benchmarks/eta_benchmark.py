@@ -0,0 +1,134 @@
+"""
+Replays batch traces through the ETA estimators and reports their accuracy.
+
+A trace is a JSON document describing one finished batch:
+
+    {
+        "concurrency": 4,
+        "files": [
+            {"name": "a.mp4", "duration": 30.0, "codec": "h264", "height": 1080, "start": 0.0, "end": 12.5},
+            ...
+        ]
+    }
+
+`start`/`end` are wall-clock seconds since the batch started. Without trace files, a
+deterministic mixed batch (short clips and multi-hour recordings) is simulated.
+
+Usage:
+    python -m benchmarks.eta_benchmark [trace.json ...] [--samples 100] [--json]
+"""
+import argparse
+import heapq
+import json
+import random
+
+from eta import EtaEstimator, resolution_bucket
+
+# Simulated encode speeds (media seconds per wall second) by resolution bucket
+SIMULATED_SPEEDS = {"720p": 6.0, "1080p": 3.0, "2160p": 0.8}
+
+
+def simulate_trace(file_count: int = 60, concurrency: int = 4, seed: int = 7) -> dict:
+    """Builds a deterministic FIFO trace of a mixed batch."""
+    rng = random.Random(seed)
+    files = []
+    for i in range(file_count):
+        if rng.random() < 0.8:
+            duration = rng.uniform(20, 120)
+        else:
+            duration = rng.uniform(3600, 3 * 3600)
+        height = rng.choice([720, 1080, 1080, 2160])
+        files.append({"name": f"file_{i:03}.mp4", "duration": duration, "codec": "h264", "height": height})
+
+    slots = [(0.0, slot) for slot in range(concurrency)]
+    heapq.heapify(slots)
+    for entry in files:
+        free_at, slot = heapq.heappop(slots)
+        speed = SIMULATED_SPEEDS[resolution_bucket(entry["height"])] * rng.uniform(0.85, 1.15)
+        entry["start"] = free_at
+        entry["end"] = free_at + entry["duration"] / speed
+        heapq.heappush(slots, (entry["end"], slot))
+    return {"concurrency": concurrency, "files": files}
+
+
+class _NaiveEstimator:
+    """The original estimate: average wall time per finished file times the files left."""
+
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.completed = 0
+
+    def eta(self, now):
+        if not self.completed:
+            return None
+        return now / self.completed * (self.total_files - self.completed)
+
+
+def replay(trace: dict, samples: int = 100) -> dict:
+    """
+    Replays a trace and returns the mean absolute percentage error of both estimators.
+    """
+    files = trace["files"]
+    makespan = max(f["end"] for f in files)
+    now = [0.0]
+    estimator = EtaEstimator(trace["concurrency"], clock=lambda: now[0])
+    naive = _NaiveEstimator(len(files))
+    for f in files:
+        estimator.add_file(f["name"], f["duration"], f.get("codec"), f.get("height"))
+
+    started, finished = set(), set()
+    errors = {"duration_weighted": [], "file_count": []}
+    for i in range(1, samples):
+        now[0] = makespan * i / samples
+        for f in files:
+            if f["name"] in finished:
+                continue
+            if f["start"] <= now[0] and f["name"] not in started:
+                started.add(f["name"])
+                estimator.start_file(f["name"])
+            if f["end"] <= now[0]:
+                estimator.update(f["name"], f["duration"])
+                estimator.finish_file(f["name"])
+                naive.completed += 1
+                finished.add(f["name"])
+            elif f["name"] in started:
+                speed = f["duration"] / (f["end"] - f["start"])
+                estimator.update(f["name"], (now[0] - f["start"]) * speed, speed)
+
+        actual = makespan - now[0]
+        for name, estimate in (("duration_weighted", estimator.eta()), ("file_count", naive.eta(now[0]))):
+            if estimate is not None:
+                errors[name].append(abs(estimate - actual) / actual)
+
+    return {
+        name: {"mape_percent": round(100 * sum(values) / len(values), 2) if values else None, "samples": len(values)}
+        for name, values in errors.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ETA estimators against batch traces.")
+    parser.add_argument("traces", nargs="*", help="Recorded batch trace JSON files.")
+    parser.add_argument("--samples", type=int, default=100, help="ETA samples taken per trace.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    traces = {}
+    for path in args.traces:
+        with open(path, "r") as f:
+            traces[path] = json.load(f)
+    if not traces:
+        traces["simulated-mixed-batch"] = simulate_trace()
+
+    results = {name: replay(trace, args.samples) for name, trace in traces.items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(name)
+        for estimator_name, stats in result.items():
+            print(f"  {estimator_name:<18} MAPE: {stats['mape_percent']}% over {stats['samples']} samples")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Times fingerprint index lookups against a large library of recorded conversions.
+
+Fills a temporary index with synthetic conversions, then measures lookups of an input
+whose size matches nothing (rejected without reading it), of a converted input whose
+fingerprint is stored, and of a renamed converted input (found via its inode), in
+microseconds.
+
+Usage:
+    python -m benchmarks.fingerprint_lookup_benchmark [--conversions 1000000] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from fingerprint_index import FingerprintIndex, params_key
+
+PARAMS = {"video_codec": "libx265", "output_format": "mp4", "video_bitrate": "optimized"}
+
+
+def populate(index: FingerprintIndex, count: int, rng: random.Random):
+    key = params_key(PARAMS)
+    rows = (
+        (f"{rng.getrandbits(128):032x}", key, rng.randrange(10**6, 10**10), f"/library/z_{i}.mp4", 10**6, 0)
+        for i in range(count)
+    )
+    with index._conn:
+        index._conn.executemany(
+            "INSERT OR IGNORE INTO conversions (fingerprint, params, input_size, output_path, output_size, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def timed_us(func, repeat: int = 200) -> float:
+    """The median duration of func in microseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1_000_000)
+    return round(sorted(durations)[len(durations) // 2], 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fingerprint index lookups on a large library.")
+    parser.add_argument("--conversions", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        index = FingerprintIndex(tmp / "fingerprint_index.db")
+        populate(index, args.conversions, random.Random(args.seed))
+
+        unknown = tmp / "unknown.mkv"
+        unknown.write_bytes(b"x" * 777)
+        source = tmp / "clip.mkv"
+        source.write_bytes(os.urandom(4_000_000))
+        output = tmp / "z_clip.mp4"
+        output.write_bytes(b"converted")
+        index.record(str(source), PARAMS, str(output))
+
+        results = {"unknown_size_us": timed_us(lambda: index.lookup(str(unknown), PARAMS))}
+        results["known_file_us"] = timed_us(lambda: index.lookup(str(source), PARAMS))
+        renamed = tmp / "renamed.mkv"
+        source.rename(renamed)
+        results["renamed_file_us"] = timed_us(lambda: index.lookup(str(renamed), PARAMS))
+        index.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Lookups against {args.conversions} recorded conversions (median of 200 runs)")
+    for name, us in results.items():
+        print(f"  {name.removesuffix('_us'):<16} {us:>8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Times job listing queries against a large history of jobs.
+
+Fills a temporary job store with historical jobs (each with a few log lines) and
+measures the first page, a page deep into the history via its cursor, and filtered
+pages, in milliseconds.
+
+Usage:
+    python -m benchmarks.job_listing_benchmark [--jobs 100000] [--limit 50] [--json]
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import database
+from schemas import JobStatus
+
+
+def populate(conn, count: int, rng: random.Random):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    statuses = list(JobStatus)
+    jobs, logs = [], []
+    for i in range(count):
+        job_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        created_iso = (start + timedelta(seconds=i * 30)).isoformat()
+        jobs.append((job_id, f"corr-{i % 1000}", rng.choice(statuses).value, 100.0, json.dumps([f"/out/z_{i}.mp4"]), created_iso, created_iso))
+        logs.extend((job_id, seq, created_iso, "info", f"log line {seq}") for seq in range(1, 6))
+    with conn:
+        conn.executemany("INSERT INTO jobs (id, correlation_id, status, progress, result, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)", jobs)
+        conn.executemany("INSERT INTO job_logs (job_id, seq, ts, level, message) VALUES (?, ?, ?, ?, ?)", logs)
+    return start
+
+
+def timed_ms(func, repeat: int = 20) -> float:
+    """The median duration of func in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+    return round(sorted(durations)[len(durations) // 2], 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark job listing on a large job history.")
+    parser.add_argument("--jobs", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = Path(tmp)
+        database.DB_FILE = Path(tmp) / "jobs.db"
+        database.initialize_database()
+        conn = database.get_db_connection()
+        start = populate(conn, args.jobs, random.Random(args.seed))
+
+        # Walk halfway into the history to get a deep cursor
+        cursor = None
+        for _ in range(args.jobs // args.limit // 2):
+            _, cursor = database.list_jobs(conn, limit=args.limit, cursor=cursor)
+
+        middle = start + timedelta(seconds=args.jobs * 15)
+        results = {
+            "first_page_ms": timed_ms(lambda: database.list_jobs(conn, limit=args.limit)),
+            "deep_page_ms": timed_ms(lambda: database.list_jobs(conn, limit=args.limit, cursor=cursor)),
+            "status_filter_ms": timed_ms(lambda: database.list_jobs(conn, status=JobStatus.FAILED, limit=args.limit)),
+            "correlation_filter_ms": timed_ms(lambda: database.list_jobs(conn, correlation_id="corr-42", limit=args.limit)),
+            "time_range_ms": timed_ms(lambda: database.list_jobs(conn, created_before=middle, limit=args.limit)),
+        }
+        conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Listing {args.limit} of {args.jobs} jobs (median of 20 runs)")
+    for name, ms in results.items():
+        print(f"  {name.removesuffix('_ms'):<20} {ms:>8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Load-tests the conversion orchestration against the stub ffmpeg and ffprobe in ffmpeg_stub.py.
+
+No real encodes run, so this works on CI boxes without ffmpeg and measures only what
+the application adds around ffmpeg: scanning, probing, planning, the worker pool, the
+batch manifest and fingerprint index (worker scenario, the GUI's _conversion_worker
+driven headlessly), or the job runner and job database behind POST /convert (api
+scenario).
+
+Each scenario runs several rounds of files inputs. Per round it reports the wall time
+and the orchestration overhead per file: how much longer the round took than probing
+and converting the same number of files by running the stub directly on a plain
+thread pool of the same size. After every round it checks for child processes nobody
+waited for and partial outputs left behind. The first round warms up; threads and open
+file descriptors that grow in every round after it, and RSS that grows by more than
+RSS_LEAK_THRESHOLD_MB from its end to the end of the last round, are reported as leaks.
+
+Usage:
+    python -m benchmarks.orchestration_load_test [--scenario worker|api|all] [--files 200] [--concurrency 8]
+        [--rounds 3] [--duration 60] [--speed 1000] [--json]
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import database
+import ffmpeg_stub
+from conversion_logic import PASSTHROUGH_OFF, ConversionSettings, ScanOptions, resolve_command, set_ffmpeg_executables
+from encoder_capabilities import CapabilityRegistry
+from fingerprint_index import FingerprintIndex
+
+SCENARIOS = ("worker", "api")
+
+# Growth beyond this between the warm-up round and the last one is reported as a leak
+RSS_LEAK_THRESHOLD_MB = 20.0
+
+
+def _rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _open_fds() -> int | None:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def _unreaped_children() -> int:
+    # Children that exited without anyone waiting for them; reaping them here also keeps rounds independent
+    count = 0
+    while hasattr(os, "waitpid"):
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        count += 1
+    return count
+
+
+def _partial_files(output_dir: Path) -> list[str]:
+    return [path.name for path in output_dir.iterdir() if ".part" in path.name]
+
+
+def _make_inputs(input_dir: Path, files: int) -> list[Path]:
+    input_dir.mkdir(parents=True)
+    inputs = [input_dir / f"input_{i:04d}.mkv" for i in range(files)]
+    for i, path in enumerate(inputs):
+        path.write_bytes(b"stub input %d" % i)
+    return inputs
+
+
+def stub_baseline_seconds(work_dir: Path, files: int, concurrency: int) -> float:
+    """The wall time of probing and converting files inputs with the stub alone, concurrency at a time."""
+    inputs = _make_inputs(work_dir / "in", files)
+    output_dir = work_dir / "out"
+    output_dir.mkdir()
+
+    def convert(path: Path):
+        subprocess.run(resolve_command(["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", str(path)]),
+                       capture_output=True, check=True)
+        command = ["ffmpeg", "-progress", "pipe:1", "-nostats", "-v", "quiet", "-i", str(path), str(output_dir / path.name)]
+        subprocess.run(resolve_command(command), stdout=subprocess.DEVNULL, check=True)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(convert, inputs))
+    return time.perf_counter() - started
+
+
+def _settings(output_dir: Path) -> ConversionSettings:
+    return ConversionSettings(
+        output_dir=str(output_dir), video_codec="libx265", audio_codec="aac", output_format="mkv",
+        video_bitrate="4M", passthrough=PASSTHROUGH_OFF, progress_interval=0.1,
+    )
+
+
+def run_worker_round(
+    round_dir: Path, files: int, concurrency: int, probe_workers: int, index: FingerprintIndex, capabilities: CapabilityRegistry,
+) -> dict:
+    """Converts files inputs through the GUI's _conversion_worker, without a window."""
+    from converter_app import ConverterApp
+    from scheduler import ORDER_FIFO
+
+    input_dir, output_dir = round_dir / "in", round_dir / "out"
+    _make_inputs(input_dir, files)
+    output_dir.mkdir()
+    app = ConverterApp.__new__(ConverterApp)
+    app.progress_queue = queue.Queue()
+    app.cancel_event = threading.Event()
+    app.current_processes = {}
+    app.conversion_start_times = {}
+    app.fingerprint_index = index
+    app.capabilities = capabilities
+
+    started = time.perf_counter()
+    app._conversion_worker(str(input_dir), ScanOptions(recursive=False), _settings(output_dir), concurrency, probe_workers, ORDER_FIFO, skip_converted=False)
+    wall_s = time.perf_counter() - started
+
+    levels = []
+    while not app.progress_queue.empty():
+        kind, payload = app.progress_queue.get_nowait()
+        if kind == "log":
+            levels.append(payload[0])
+    return {"wall_s": wall_s, "converted": levels.count("success"), "errors": levels.count("error"), "output_dir": output_dir}
+
+
+def run_api_round(client, round_dir: Path, files: int, concurrency: int, timeout: float = 600.0) -> dict:
+    """Converts files inputs as one job submitted through POST /convert, polling until it finishes."""
+    from schemas import JobStatus
+
+    input_dir, output_dir = round_dir / "in", round_dir / "out"
+    _make_inputs(input_dir, files)
+    request = {
+        "input_directory": str(input_dir), "output_directory": str(output_dir), "video_codec": "libx265",
+        "output_format": "mkv", "video_bitrate": "4M", "recursive": False, "passthrough": "off",
+        "concurrent_conversions": concurrency,
+    }
+    started = time.perf_counter()
+    response = client.post("/convert", json=request)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/status/{job_id}").json()
+        if job["status"] in (JobStatus.COMPLETED.value, JobStatus.FAILED.value):
+            break
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Job {job_id} did not finish within {timeout:.0f}s")
+        time.sleep(0.02)
+    wall_s = time.perf_counter() - started
+    converted = len(job["result"] or [])
+    return {"wall_s": wall_s, "converted": converted, "errors": files - converted, "output_dir": output_dir}
+
+
+def run_scenario(scenario: str, work_dir: Path, args, baseline_s: float) -> dict:
+    database.DB_PATH = work_dir / "data"
+    database.DB_FILE = database.DB_PATH / "jobs.db"
+    database.initialize_database()
+    index = FingerprintIndex(work_dir / "fingerprint_index.db")
+    # Shared by the rounds like by the GUI's batches, so only the first one probes the encoders
+    capabilities = CapabilityRegistry()
+
+    client = None
+    if scenario == "api":
+        from fastapi.testclient import TestClient
+
+        import api
+
+        client = TestClient(api.app)
+        client.__enter__()
+        # The per-request and per-job log lines would drown the report
+        logging.getLogger().setLevel(logging.WARNING)
+
+    rounds = []
+    try:
+        for number in range(args.rounds):
+            round_dir = work_dir / f"{scenario}_{number}"
+            if scenario == "api":
+                result = run_api_round(client, round_dir, args.files, args.concurrency)
+            else:
+                result = run_worker_round(round_dir, args.files, args.concurrency, args.probe_workers, index, capabilities)
+            # Let finished threads and processes wind down before counting them
+            time.sleep(0.2)
+            rounds.append({
+                "wall_s": round(result["wall_s"], 3),
+                "converted": result["converted"],
+                "errors": result["errors"],
+                "overhead_ms_per_file": round(1000 * (result["wall_s"] - baseline_s) / args.files, 2),
+                "threads": threading.active_count(),
+                "open_fds": _open_fds(),
+                "unreaped_children": _unreaped_children(),
+                "partial_files": len(_partial_files(result["output_dir"])),
+                "rss_mb": _rss_mb(),
+            })
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+        index.close()
+
+    measured = rounds[1:] or rounds
+    warm, last = rounds[0], rounds[-1]
+    rss_growth = None
+    if len(rounds) > 1 and warm["rss_mb"] is not None:
+        rss_growth = round(last["rss_mb"] - warm["rss_mb"], 1)
+    leaks = []
+    # Pools and cached connections may still grow after the warm-up round, but not in every round
+    for check in ("threads", "open_fds"):
+        counts = [r[check] for r in rounds]
+        if len(counts) > 1 and None not in counts and all(after > before for before, after in zip(counts, counts[1:])):
+            leaks.append(f"{counts[-1] - counts[0]:+d} {check.replace('_', ' ')} after warm-up")
+    for check in ("unreaped_children", "partial_files"):
+        total = sum(r[check] for r in rounds)
+        if total:
+            leaks.append(f"{total} {check.replace('_', ' ')}")
+    if rss_growth is not None and rss_growth > RSS_LEAK_THRESHOLD_MB:
+        leaks.append(f"RSS grew {rss_growth} MB after warm-up")
+    return {
+        "scenario": scenario,
+        "baseline_s": round(baseline_s, 3),
+        "overhead_ms_per_file": statistics.median(r["overhead_ms_per_file"] for r in measured),
+        "files_per_s": round(args.files / statistics.median(r["wall_s"] for r in measured), 2),
+        "rss_growth_mb": rss_growth,
+        "leaks": leaks,
+        "rounds": rounds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the conversion orchestration with a stub ffmpeg.")
+    parser.add_argument("--scenario", choices=(*SCENARIOS, "all"), default="all")
+    parser.add_argument("--files", type=int, default=200, help="Inputs converted per round.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--probe-workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds per scenario; the first one warms up.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Media seconds the stub reports per input.")
+    parser.add_argument("--speed", type=float, default=1000.0, help="Media seconds the stub encodes per wall second.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    os.environ["FFMPEG_STUB_DURATION"] = str(args.duration)
+    os.environ["FFMPEG_STUB_SPEED"] = str(args.speed)
+    os.environ["FFMPEG_STUB_STATS_PERIOD"] = "0.1"
+    set_ffmpeg_executables(ffmpeg_stub.stub_command("ffmpeg"), ffmpeg_stub.stub_command("ffprobe"))
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="orchestration-load-") as tmp:
+        print("Running the stub alone...", file=sys.stderr)
+        baseline_s = stub_baseline_seconds(Path(tmp) / "baseline", args.files, args.concurrency)
+        for scenario in SCENARIOS if args.scenario == "all" else (args.scenario,):
+            print(f"Running {scenario}...", file=sys.stderr)
+            work_dir = Path(tmp) / scenario
+            work_dir.mkdir()
+            results.append(run_scenario(scenario, work_dir, args, baseline_s))
+
+    if args.json:
+        print(json.dumps({"stub_baseline_s": round(baseline_s, 3), "scenarios": results}, indent=2))
+        return
+    print(f"Stub alone: {baseline_s:.2f}s for {args.files} files at concurrency {args.concurrency}")
+    for result in results:
+        print(
+            f"{result['scenario']:<7} overhead {result['overhead_ms_per_file']:>8.2f} ms/file, {result['files_per_s']:>7.2f} files/s, "
+            f"RSS growth {result['rss_growth_mb']} MB"
+        )
+        for number, r in enumerate(result["rounds"]):
+            print(f"    round {number}: {r['wall_s']:.2f}s, {r['converted']} converted, {r['errors']} errors, {r['overhead_ms_per_file']:.2f} ms/file")
+        print("    leaks: " + ("; ".join(result["leaks"]) if result["leaks"] else "none"))
+    if any(result["leaks"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
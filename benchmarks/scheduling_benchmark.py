@@ -0,0 +1,72 @@
+"""
+Compares the makespan of the job ordering policies on simulated mixed-size batches.
+
+Each batch mixes short clips with a few long, high-resolution recordings. Jobs are
+ordered by their predicted cost (duration x pixels) and list-scheduled onto the
+workers, while the actual encode time deviates from the prediction by a random factor.
+
+Usage:
+    python -m benchmarks.scheduling_benchmark [--workers 32] [--files 400] [--batches 20] [--json]
+"""
+import argparse
+import heapq
+import json
+import random
+import statistics
+
+from scheduler import ORDERING_POLICIES
+
+RESOLUTIONS = ((1280, 720), (1920, 1080), (3840, 2160))
+
+
+def simulate_batch(rng: random.Random, file_count: int) -> list[tuple[float, float]]:
+    """Returns (predicted cost, actual cost) pairs for a mixed batch, in discovery order."""
+    jobs = []
+    for _ in range(file_count):
+        duration = rng.uniform(3600, 4 * 3600) if rng.random() < 0.05 else rng.uniform(30, 600)
+        width, height = rng.choice(RESOLUTIONS)
+        predicted = duration * width * height
+        jobs.append((predicted, predicted * rng.uniform(0.8, 1.2)))
+    return jobs
+
+
+def actual_makespan(jobs: list[tuple[float, float]], workers: int) -> float:
+    slots = [0.0] * workers
+    for _, actual in jobs:
+        heapq.heapreplace(slots, slots[0] + actual)
+    return max(slots)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare job ordering policies on simulated batches.")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ratios = {policy: [] for policy in ORDERING_POLICIES}
+    for _ in range(args.batches):
+        jobs = simulate_batch(rng, args.files)
+        # The lower bound no schedule can beat: total work spread evenly, or the longest job
+        lower_bound = max(sum(a for _, a in jobs) / args.workers, max(a for _, a in jobs))
+        for policy, ordering in ORDERING_POLICIES.items():
+            ordered = ordering(jobs, lambda job: job[0])
+            ratios[policy].append(actual_makespan(ordered, args.workers) / lower_bound)
+
+    results = {
+        policy: {"mean_makespan_vs_lower_bound": round(statistics.mean(values), 3), "worst": round(max(values), 3)}
+        for policy, values in ratios.items()
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.batches} batches of {args.files} files on {args.workers} workers (1.000 = optimal lower bound)")
+    for policy, stats in results.items():
+        print(f"  {policy:<15} mean {stats['mean_makespan_vs_lower_bound']:.3f}  worst {stats['worst']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Conversion throughput suite on deterministic synthetic media.
+
+Generates test inputs with ffmpeg's lavfi sources (testsrc2 video and a sine tone,
+encoded bit-exactly, so the same options always give the same file) at each requested
+resolution and duration. Then runs the real conversion_logic pipeline (scan, probe and
+plan, encode on a worker pool with the CPU shared by a CpuAllocator) for every
+combination of codec, resolution, duration and concurrency level. Each case runs in
+its own process so its peak RSS, and that of its ffmpeg children, is measured alone.
+
+Per case it records files/s, media-seconds/s, the probe/planning overhead and the peak
+RSS, as JSON. The compare command checks a run against a stored baseline and exits
+with status 1 if any metric regressed by more than the threshold.
+
+Needs ffmpeg and ffprobe on the PATH.
+
+Usage:
+    python -m benchmarks.throughput_benchmark run [--codecs libx264,libx265] [--resolutions 640x360,1280x720]
+        [--durations 10,30] [--concurrency 1,2,4] [--files 4] [--output results.json]
+    python -m benchmarks.throughput_benchmark compare BASELINE.json CURRENT.json [--threshold 0.1]
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+from conversion_logic import PASSTHROUGH_OFF, ConversionSettings, ScanOptions, plan_conversions, run_conversion, scan_video_files
+from cpu_allocation import CpuAllocator
+
+# Metrics that regress when they drop, and metrics that regress when they grow
+HIGHER_IS_BETTER = ("files_per_s", "media_seconds_per_s")
+LOWER_IS_BETTER = ("probe_ms_per_file", "peak_rss_mb", "peak_child_rss_mb")
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def _split(text: str) -> list[str]:
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def media_path(media_dir: str, resolution: str, duration: int) -> str:
+    return os.path.join(media_dir, f"testsrc2_{resolution}_{duration}s.mkv")
+
+
+def generate_media(media_dir: str, resolution: str, duration: int) -> str:
+    """Generates (or reuses) the deterministic test input for a resolution and duration."""
+    path = media_path(media_dir, resolution, duration)
+    if os.path.exists(path):
+        return path
+    partial = path + ".part.mkv"
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate=30",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", str(duration), "-map_metadata", "-1",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-threads", "1", "-c:a", "aac",
+        "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        partial,
+    ]
+    subprocess.run(command, check=True)
+    os.replace(partial, path)
+    return path
+
+
+def _peak_rss_mb(who) -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(media_file: str, files: int, codec: str, concurrency: int, bitrate: str) -> dict:
+    """Converts files copies of media_file through the conversion pipeline and measures it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir, output_dir = os.path.join(tmp, "in"), os.path.join(tmp, "out")
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+        for i in range(files):
+            shutil.copyfile(media_file, os.path.join(input_dir, f"input_{i:03d}.mkv"))
+        settings = ConversionSettings(
+            output_dir=output_dir, video_codec=codec, audio_codec="aac", output_format="mkv",
+            video_bitrate=bitrate, passthrough=PASSTHROUGH_OFF,
+        )
+
+        started = time.perf_counter()
+        plans = plan_conversions(scan_video_files(input_dir, ScanOptions(recursive=False)), settings)
+        probe_s = time.perf_counter() - started
+        allocator = CpuAllocator(expected_encodes=concurrency)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda plan: run_conversion(plan, settings, cpu_allocator=allocator), plans))
+        wall_s = time.perf_counter() - started
+
+    media_seconds = sum(plan.estimated_duration or 0.0 for plan in plans)
+    return {
+        "files": len(plans),
+        "failures": sum(1 for result in results if not result["success"]),
+        "wall_s": round(wall_s, 3),
+        "files_per_s": round(len(plans) / wall_s, 4),
+        "media_seconds_per_s": round(media_seconds / wall_s, 3),
+        "probe_s": round(probe_s, 3),
+        "probe_ms_per_file": round(1000 * probe_s / max(1, len(plans)), 2),
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        "peak_child_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+    }
+
+
+def environment() -> dict:
+    try:
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    return {
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "ffmpeg": ffmpeg_version,
+    }
+
+
+def run_suite(args) -> dict:
+    media_dir = args.media_dir or tempfile.mkdtemp(prefix="throughput-media-")
+    os.makedirs(media_dir, exist_ok=True)
+    cases = []
+    try:
+        for codec, resolution, duration, concurrency in itertools.product(
+            _split(args.codecs), _split(args.resolutions), [int(d) for d in _split(args.durations)], [int(c) for c in _split(args.concurrency)]
+        ):
+            media_file = generate_media(media_dir, resolution, duration)
+            name = f"{codec}/{resolution}/{duration}s/c{concurrency}"
+            print(f"Running {name}...", file=sys.stderr)
+            # A fresh process per case, so the RSS peaks belong to this case alone
+            command = [
+                sys.executable, "-m", "benchmarks.throughput_benchmark", "case", media_file,
+                "--files", str(args.files), "--codec", codec, "--concurrency", str(concurrency), "--bitrate", args.bitrate,
+            ]
+            completed = subprocess.run(command, capture_output=True, text=True, check=True)
+            cases.append({
+                "name": name, "codec": codec, "resolution": resolution, "duration": duration, "concurrency": concurrency,
+                **json.loads(completed.stdout),
+            })
+    finally:
+        if not args.media_dir:
+            shutil.rmtree(media_dir, ignore_errors=True)
+    return {"environment": environment(), "cases": cases}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> tuple[list[dict], list[str]]:
+    """
+    Compares two runs case by case.
+
+    Returns:
+        The regressions (case, metric, baseline, current and relative change) beyond
+        threshold, and the names of baseline cases missing from the current run.
+    """
+    current_cases = {case["name"]: case for case in current["cases"]}
+    regressions, missing = [], []
+    for base in baseline["cases"]:
+        case = current_cases.get(base["name"])
+        if case is None:
+            missing.append(base["name"])
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            before, after = base.get(metric), case.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (metric in HIGHER_IS_BETTER and change < -threshold) or (metric in LOWER_IS_BETTER and change > threshold):
+                regressions.append({"case": base["name"], "metric": metric, "baseline": before, "current": after, "change": round(change, 4)})
+    return regressions, missing
+
+
+def _print_suite(results: dict):
+    print(f"{'case':<34} {'files/s':>9} {'media s/s':>10} {'probe ms':>9} {'RSS MB':>8} {'ffmpeg MB':>10} {'failed':>7}")
+    for case in results["cases"]:
+        print(
+            f"{case['name']:<34} {case['files_per_s']:>9.3f} {case['media_seconds_per_s']:>10.2f} {case['probe_ms_per_file']:>9.1f} "
+            f"{case['peak_rss_mb'] or 0:>8.1f} {case['peak_child_rss_mb'] or 0:>10.1f} {case['failures']:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conversion throughput on synthetic lavfi media.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the suite.")
+    run.add_argument("--codecs", default="libx264,libx265", help="Comma-separated CPU video codecs.")
+    run.add_argument("--resolutions", default="640x360,1280x720")
+    run.add_argument("--durations", default="10,30", help="Comma-separated input durations in seconds.")
+    run.add_argument("--concurrency", default="1,2", help="Comma-separated concurrency levels.")
+    run.add_argument("--files", type=int, default=4, help="Files converted per case.")
+    run.add_argument("--bitrate", default="2M")
+    run.add_argument("--media-dir", help="Keep the generated inputs here and reuse them across runs.")
+    run.add_argument("--output", help="Write the JSON results to this file.")
+    run.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    case = commands.add_parser("case", help="Run a single case (used by run).")
+    case.add_argument("media_file")
+    case.add_argument("--files", type=int, default=4)
+    case.add_argument("--codec", default="libx264")
+    case.add_argument("--concurrency", type=int, default=1)
+    case.add_argument("--bitrate", default="2M")
+
+    compare = commands.add_parser("compare", help="Flag regressions against a baseline run.")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed relative change, e.g. 0.1 for 10%%.")
+    args = parser.parse_args()
+
+    if args.command == "case":
+        print(json.dumps(run_case(args.media_file, args.files, args.codec, args.concurrency, args.bitrate)))
+        return
+
+    if args.command == "run":
+        results = run_suite(args)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            _print_suite(results)
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    regressions, missing = compare_results(baseline, current, args.threshold)
+    for name in missing:
+        print(f"missing   {name}")
+    for regression in regressions:
+        print(
+            f"REGRESSED {regression['case']} {regression['metric']}: "
+            f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})"
+        )
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%} in {len(baseline['cases']) - len(missing)} cases.")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import collections
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    import psutil
+except ImportError: # Optional: fall back to /proc on Linux, or speed-only decisions elsewhere
+    psutil = None
+
+DEFAULT_SAMPLE_INTERVAL = 5.0
+
+
+class ConcurrencyLimiter:
+    """
+    A semaphore whose limit can be changed while threads are waiting on it.
+
+    A ThreadPoolExecutor can't be resized, so the pool is created at the upper bound
+    and each conversion holds a slot of this limiter while ffmpeg runs.
+    """
+
+    def __init__(self, limit: int):
+        self._condition = threading.Condition()
+        self._limit = max(1, limit)
+        self._active = 0
+        self._waiting = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def set_limit(self, limit: int):
+        with self._condition:
+            self._limit = max(1, limit)
+            self._condition.notify_all()
+
+    def acquire(self, cancel_event: threading.Event | None = None) -> bool:
+        """Waits for a free slot. Returns False if cancel_event was set while waiting."""
+        with self._condition:
+            self._waiting += 1
+            try:
+                while self._active >= self._limit:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return False
+                    self._condition.wait(timeout=0.5)
+                self._active += 1
+                return True
+            finally:
+                self._waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+
+@dataclass(frozen=True)
+class SystemSample:
+    """One measurement of the signals the controller bases its decisions on. None means unavailable."""
+    cpu_percent: float | None
+    load_per_cpu: float | None
+    available_memory_fraction: float | None
+    aggregate_speed: float | None
+
+
+@dataclass(frozen=True)
+class Adjustment:
+    """A concurrency change and the reason for it."""
+    old_limit: int
+    new_limit: int
+    reason: str
+    sample: SystemSample
+
+    def describe(self) -> str:
+        def fmt(value, spec):
+            return "n/a" if value is None else format(value, spec)
+        s = self.sample
+        free_memory = None if s.available_memory_fraction is None else s.available_memory_fraction * 100
+        return (
+            f"Concurrency {self.old_limit} -> {self.new_limit}: {self.reason} "
+            f"(CPU {fmt(s.cpu_percent, '.0f')}%, load/core {fmt(s.load_per_cpu, '.2f')}, "
+            f"free memory {fmt(free_memory, '.0f')}%, "
+            f"aggregate speed {fmt(s.aggregate_speed, '.2f')}x)"
+        )
+
+
+class SystemSampler:
+    """Reads CPU utilisation, load average and free memory, using psutil when installed."""
+
+    def __init__(self):
+        self._cpu_count = os.cpu_count() or 1
+        self._last_cpu_times = None
+
+    def _cpu_percent(self) -> float | None:
+        if psutil is not None:
+            return psutil.cpu_percent(interval=None)
+        try:
+            with open("/proc/stat", "r") as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        total = sum(fields)
+        previous, self._last_cpu_times = self._last_cpu_times, (idle, total)
+        if previous is None or total == previous[1]:
+            return None
+        return 100.0 * (1 - (idle - previous[0]) / (total - previous[1]))
+
+    def _available_memory_fraction(self) -> float | None:
+        if psutil is not None:
+            memory = psutil.virtual_memory()
+            return memory.available / memory.total
+        try:
+            with open("/proc/meminfo", "r") as f:
+                info = {line.split(":")[0]: int(line.split()[1]) for line in f}
+            return info["MemAvailable"] / info["MemTotal"]
+        except (OSError, KeyError, ValueError, IndexError):
+            return None
+
+    def sample(self, aggregate_speed: float | None = None) -> SystemSample:
+        try:
+            load_per_cpu = os.getloadavg()[0] / self._cpu_count
+        except (AttributeError, OSError):
+            load_per_cpu = None # Not available on Windows
+        return SystemSample(
+            cpu_percent=self._cpu_percent(),
+            load_per_cpu=load_per_cpu,
+            available_memory_fraction=self._available_memory_fraction(),
+            aggregate_speed=aggregate_speed,
+        )
+
+
+class AdaptiveConcurrencyController:
+    """
+    Ramps the number of concurrent encodes up or down from measured system signals.
+
+    Every sample_interval it takes a SystemSample and decides:
+    - down, if free memory or load per core has been past its limit for stable_samples samples;
+    - back down, if the last step up did not raise the aggregate encode speed by at least
+      min_speed_gain (that level then becomes a temporary ceiling);
+    - up, if work is waiting for a slot and CPU has stayed below cpu_low with no pressure.
+    A cooldown after each change lets the new level settle before it is judged, which
+    together with the stable_samples window provides hysteresis.
+    """
+
+    def __init__(
+        self,
+        limiter: ConcurrencyLimiter,
+        min_workers: int = 1,
+        max_workers: int | None = None,
+        speed_source: Callable[[], float | None] | None = None,
+        sampler: SystemSampler | None = None,
+        on_adjust: Callable[[Adjustment], None] | None = None,
+        sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+        stable_samples: int = 3,
+        cooldown_samples: int = 2,
+        cpu_low: float = 75.0,
+        load_high: float = 1.5,
+        min_free_memory: float = 0.10,
+        min_speed_gain: float = 0.05,
+        ceiling_samples: int = 60,
+    ):
+        self.limiter = limiter
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.speed_source = speed_source or (lambda: None)
+        self.sampler = sampler or SystemSampler()
+        self.on_adjust = on_adjust
+        self.sample_interval = sample_interval
+        self.stable_samples = stable_samples
+        self.cooldown_samples = cooldown_samples
+        self.cpu_low = cpu_low
+        self.load_high = load_high
+        self.min_free_memory = min_free_memory
+        self.min_speed_gain = min_speed_gain
+        self.ceiling_samples = ceiling_samples
+        self.history: list[Adjustment] = []
+        self._window = collections.deque(maxlen=stable_samples)
+        self._cooldown = 0
+        self._speed_before_increase = None
+        self._ceiling = None
+        self._ceiling_ttl = 0
+
+    def _all(self, predicate) -> bool:
+        return len(self._window) == self.stable_samples and all(predicate(s) for s in self._window)
+
+    def _mean_speed(self) -> float | None:
+        speeds = [s.aggregate_speed for s in self._window if s.aggregate_speed is not None]
+        return sum(speeds) / len(speeds) if speeds else None
+
+    def _adjust(self, new_limit: int, reason: str, sample: SystemSample) -> Adjustment:
+        adjustment = Adjustment(self.limiter.limit, new_limit, reason, sample)
+        self.limiter.set_limit(new_limit)
+        self.history.append(adjustment)
+        self._window.clear()
+        self._cooldown = self.cooldown_samples
+        if self.on_adjust is not None:
+            self.on_adjust(adjustment)
+        return adjustment
+
+    def step(self, sample: SystemSample) -> Adjustment | None:
+        """Feeds one sample and applies (and returns) the resulting adjustment, if any."""
+        if self._ceiling_ttl:
+            self._ceiling_ttl -= 1
+            if not self._ceiling_ttl:
+                self._ceiling = None
+        if self._cooldown:
+            self._cooldown -= 1
+            return None
+        self._window.append(sample)
+
+        limit = self.limiter.limit
+        memory_low = lambda s: s.available_memory_fraction is not None and s.available_memory_fraction < self.min_free_memory
+        load_high = lambda s: s.load_per_cpu is not None and s.load_per_cpu > self.load_high
+        if limit > self.min_workers and self._all(memory_low):
+            self._speed_before_increase = None
+            return self._adjust(limit - 1, f"free memory below {self.min_free_memory:.0%}", sample)
+        if limit > self.min_workers and self._all(load_high):
+            self._speed_before_increase = None
+            return self._adjust(limit - 1, f"load per core above {self.load_high}", sample)
+
+        if len(self._window) < self.stable_samples:
+            return None
+
+        if self._speed_before_increase is not None:
+            speed_before, self._speed_before_increase = self._speed_before_increase, None
+            speed_now = self._mean_speed()
+            if speed_now is not None and speed_now < speed_before * (1 + self.min_speed_gain):
+                self._ceiling, self._ceiling_ttl = limit - 1, self.ceiling_samples
+                return self._adjust(
+                    limit - 1, f"raising to {limit} did not improve aggregate speed ({speed_before:.2f}x -> {speed_now:.2f}x)", sample
+                )
+
+        ceiling = min(self.max_workers, self._ceiling or self.max_workers)
+        cpu_idle = lambda s: s.cpu_percent is None or s.cpu_percent < self.cpu_low
+        no_pressure = lambda s: not memory_low(s) and (s.load_per_cpu is None or s.load_per_cpu < 1.0)
+        if limit < ceiling and self.limiter.waiting > 0 and self._all(cpu_idle) and self._all(no_pressure):
+            self._speed_before_increase = self._mean_speed()
+            return self._adjust(limit + 1, f"CPU below {self.cpu_low:.0f}% with work waiting", sample)
+        return None
+
+    def run(self, stop_event: threading.Event):
+        """Samples and adjusts every sample_interval seconds until stop_event is set."""
+        self.sampler.sample() # Prime the CPU counters
+        while not stop_event.wait(self.sample_interval):
+            self.step(self.sampler.sample(self.speed_source()))
@@ -4,6 +4,13 @@ class Settings(BaseSettings):
     """Manages application settings and loads them from a .env file."""
     API_KEY: str | None = None
     MAX_CONCURRENT_JOBS: int = 4
+    # The ffmpeg and ffprobe to run: a path, or a command line such as "python ffmpeg_stub.py ffmpeg"
+    FFMPEG_PATH: str | None = None
+    FFPROBE_PATH: str | None = None
+    # What to do when a requested hardware encoder can't be used: "cpu" to use a CPU encoder of the same codec, "fail" to reject the job
+    CODEC_FALLBACK: str = "cpu"
+    # How long ffmpeg's probed version, encoders and hardware acceleration methods are reused
+    CAPABILITY_TTL_SECONDS: float = 600.0
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
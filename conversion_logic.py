@@ -1,10 +1,61 @@
 import os
 import subprocess
 import json
+import shlex
 import sys
+import threading
+import time
+import collections
+import concurrent.futures
+import fnmatch
+import glob
+import itertools
+import re
+import shutil
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator
+
+import metrics
+from cpu_allocation import CpuAllocator, encoder_thread_args
+from ffmpeg_progress import DEFAULT_PROGRESS_INTERVAL, FfmpegProgress, stream_ffmpeg_progress
 
 OPTIMIZED_BITRATE_MAP = {}
 
+# Prevents ffmpeg from opening a console window on Windows; the flag doesn't exist elsewhere
+CREATE_NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+# Commands are built starting with "ffmpeg" or "ffprobe"; this is what actually runs for each.
+# FFMPEG_PATH and FFPROBE_PATH in the environment override them, e.g. with the stub in ffmpeg_stub.py.
+FFMPEG_EXECUTABLES = {
+    "ffmpeg": os.environ.get("FFMPEG_PATH") or "ffmpeg",
+    "ffprobe": os.environ.get("FFPROBE_PATH") or "ffprobe",
+}
+
+
+def set_ffmpeg_executables(ffmpeg: str | None = None, ffprobe: str | None = None):
+    """
+    Sets the commands run for ffmpeg and ffprobe; None keeps the current one.
+
+    Either may be a path or a command line with arguments, such as
+    "python ffmpeg_stub.py ffmpeg".
+    """
+    if ffmpeg:
+        FFMPEG_EXECUTABLES["ffmpeg"] = ffmpeg
+    if ffprobe:
+        FFMPEG_EXECUTABLES["ffprobe"] = ffprobe
+
+
+def resolve_command(command: list[str]) -> list[str]:
+    """The command with a leading "ffmpeg" or "ffprobe" replaced by the configured executable."""
+    executable = FFMPEG_EXECUTABLES.get(command[0]) if command else None
+    if executable is None:
+        return list(command)
+    if os.path.exists(executable):
+        # A path, possibly with spaces, rather than a command line
+        return [executable, *command[1:]]
+    return [*shlex.split(executable, posix=os.name != "nt"), *command[1:]]
+
 def get_resource_path(relative_path: str) -> str:
     """
     Get the absolute path to a resource, works for development and for PyInstaller.
@@ -32,6 +83,158 @@ def load_optimized_bitrate_map(quality_profile: str) -> dict:
         OPTIMIZED_BITRATE_MAP = {}
         return {}
 
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm')
+
+# Symlink policies for scan_video_files
+SYMLINKS_IGNORE = "ignore"  # Skip symlinked files and directories
+SYMLINKS_FILES = "files"    # Include symlinked files, don't descend into symlinked directories
+SYMLINKS_FOLLOW = "follow"  # Follow everything, guarding against directory loops
+
+
+@dataclass(frozen=True)
+class ScanOptions:
+    """
+    Filters and traversal rules for scan_video_files.
+
+    Glob patterns are matched against both the file name and the path relative to the
+    scanned directory (with forward slashes). Directories matching an exclude pattern
+    are not descended into, and neither are exclude_dirs (e.g. an output folder inside
+    the scanned one). The hidden temporary outputs of running conversions are never
+    yielded.
+    """
+    recursive: bool = True
+    extensions: tuple[str, ...] = VIDEO_EXTENSIONS
+    include_globs: tuple[str, ...] = ()
+    exclude_globs: tuple[str, ...] = ()
+    min_size: int = 0
+    symlinks: str = SYMLINKS_FILES
+    max_depth: int | None = None
+    exclude_dirs: tuple[str, ...] = ()
+
+
+def _matches_any(name: str, relative_path: str, patterns: tuple[str, ...]) -> bool:
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relative_path, p) for p in patterns)
+
+
+def scan_video_files(directory: str, options: ScanOptions | None = None) -> Iterator[str]:
+    """
+    Lazily walks a directory tree with os.scandir and yields video files as they are found.
+
+    Entries are yielded directory by directory (sorted by name within each directory), so
+    a caller can start working on the first files while a large tree is still being
+    scanned. The DirEntry's cached type and stat data is reused wherever possible.
+
+    Args:
+        directory: The directory to scan.
+        options: Traversal and filter rules. Defaults to a recursive scan of all video extensions.
+
+    Returns:
+        An iterator of absolute paths to video files.
+    """
+    if not os.path.isdir(directory):
+        raise ValueError(f"Directory not found: {directory}")
+    return _scan_tree(os.path.abspath(directory), options or ScanOptions())
+
+
+def _excluded_dirs(root: str, options: ScanOptions) -> set[str]:
+    # The scanned directory itself may be the output folder; only folders below it are left out
+    return {os.path.abspath(path) for path in options.exclude_dirs if path} - {root}
+
+
+def _scan_tree(root: str, options: ScanOptions) -> Iterator[str]:
+    extensions = {ext.lower() for ext in options.extensions}
+    excluded_dirs = _excluded_dirs(root, options)
+    follow_dirs = options.symlinks == SYMLINKS_FOLLOW
+    visited_dirs = set()
+    stack = [(root, 0)]
+    while stack:
+        current, depth = stack.pop()
+        if follow_dirs:
+            # Following directory symlinks can create cycles, so remember every real directory
+            try:
+                st = os.stat(current)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in visited_dirs:
+                continue
+            visited_dirs.add((st.st_dev, st.st_ino))
+
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue # Unreadable directory; skip it rather than aborting the whole scan
+
+        subdirs = []
+        for entry in entries:
+            relative_path = os.path.relpath(entry.path, root).replace(os.sep, "/")
+            if is_partial_output(entry.name):
+                continue
+            try:
+                is_symlink = entry.is_symlink()
+                if is_symlink and options.symlinks == SYMLINKS_IGNORE:
+                    continue
+                if entry.is_dir(follow_symlinks=follow_dirs):
+                    if options.recursive and (options.max_depth is None or depth < options.max_depth):
+                        if not _matches_any(entry.name, relative_path, options.exclude_globs) and entry.path not in excluded_dirs:
+                            subdirs.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=True):
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                if options.include_globs and not _matches_any(entry.name, relative_path, options.include_globs):
+                    continue
+                if _matches_any(entry.name, relative_path, options.exclude_globs):
+                    continue
+                if options.min_size and entry.stat(follow_symlinks=True).st_size < options.min_size:
+                    continue
+            except OSError:
+                continue # Broken symlink or file removed while scanning
+            yield entry.path
+
+        # Push in reverse so subdirectories are visited in name order
+        stack.extend((subdir, depth + 1) for subdir in reversed(subdirs))
+
+
+def matches_scan_options(root: str, path: str, options: ScanOptions) -> bool:
+    """
+    Checks a single file against the same rules scan_video_files applies, e.g. for files
+    reported by a filesystem watcher rather than found by a scan.
+    """
+    relative_path = os.path.relpath(path, root).replace(os.sep, "/")
+    parts = relative_path.split("/")
+    if relative_path.startswith("../"):
+        return False
+    if len(parts) > 1 and not options.recursive:
+        return False
+    if options.max_depth is not None and len(parts) - 1 > options.max_depth:
+        return False
+    if any(is_partial_output(part) for part in parts):
+        return False
+    absolute_path = os.path.abspath(path)
+    for excluded in _excluded_dirs(os.path.abspath(root), options):
+        if os.path.commonpath([excluded, absolute_path]) == excluded:
+            return False
+    # Files inside an excluded directory are excluded too
+    for depth in range(1, len(parts)):
+        if _matches_any(parts[depth - 1], "/".join(parts[:depth]), options.exclude_globs):
+            return False
+    name = parts[-1]
+    if os.path.splitext(name)[1].lower() not in {ext.lower() for ext in options.extensions}:
+        return False
+    if options.include_globs and not _matches_any(name, relative_path, options.include_globs):
+        return False
+    if _matches_any(name, relative_path, options.exclude_globs):
+        return False
+    if options.min_size:
+        try:
+            return os.path.getsize(path) >= options.min_size
+        except OSError:
+            return False
+    return True
+
+
 def find_video_files(directory: str) -> list[str]:
     """
     Scans a directory for video files (non-recursively).
@@ -42,29 +245,157 @@ def find_video_files(directory: str) -> list[str]:
     Returns:
         A list of absolute paths to video files.
     """
-    if not os.path.isdir(directory):
-        raise ValueError(f"Directory not found: {directory}")
+    return list(scan_video_files(directory, ScanOptions(recursive=False)))
+
+
+@dataclass(frozen=True)
+class StreamInfo:
+    """
+    Immutable view of a single stream reported by ffprobe.
+    """
+    index: int
+    codec_type: str | None
+    codec_name: str | None
+    width: int | None = None
+    height: int | None = None
+    bit_rate: int | None = None
+    channels: int | None = None
+    language: str | None = None
+    is_default: bool = False
+    attached_pic: bool = False
 
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm']
-    video_files = []
-    for item in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, item)):
-            _, ext = os.path.splitext(item)
-            if ext.lower() in video_extensions:
-                video_files.append(os.path.abspath(os.path.join(directory, item)))
-    return video_files
+    @classmethod
+    def from_ffprobe(cls, stream: dict) -> "StreamInfo":
+        tags = stream.get("tags") or {}
+        disposition = stream.get("disposition") or {}
+        return cls(
+            index=int(stream.get("index", 0)),
+            codec_type=stream.get("codec_type"),
+            codec_name=stream.get("codec_name"),
+            width=_to_int(stream.get("width")),
+            height=_to_int(stream.get("height")),
+            bit_rate=_to_int(stream.get("bit_rate")),
+            channels=_to_int(stream.get("channels")),
+            language=tags.get("language"),
+            is_default=bool(disposition.get("default")),
+            attached_pic=bool(disposition.get("attached_pic")),
+        )
 
 
-def get_video_bitrate(input_file: str) -> str | None:
+@dataclass(frozen=True)
+class MediaInfo:
     """
-    Gets the bitrate of a video file using ffprobe.
+    Immutable result of a single `ffprobe -show_format -show_streams` call.
+
+    Every helper that needs metadata about an input accepts a MediaInfo so a file
+    only has to be probed once, no matter how many decisions depend on it.
+    """
+    path: str
+    format_name: str | None
+    duration: float | None
+    bit_rate: int | None
+    size: int | None
+    streams: tuple[StreamInfo, ...]
+    start_time: float | None = None
+
+    @classmethod
+    def from_ffprobe(cls, path: str, data: dict) -> "MediaInfo":
+        fmt = data.get("format") or {}
+        return cls(
+            path=path,
+            format_name=fmt.get("format_name"),
+            duration=_to_float(fmt.get("duration")),
+            bit_rate=_to_int(fmt.get("bit_rate")),
+            size=_to_int(fmt.get("size")),
+            streams=tuple(StreamInfo.from_ffprobe(s) for s in data.get("streams", [])),
+            start_time=_to_float(fmt.get("start_time")),
+        )
+
+    @property
+    def video_stream(self) -> StreamInfo | None:
+        """The first video stream that isn't cover art, or None if the file has no video."""
+        videos = [s for s in self.streams if s.codec_type == "video"]
+        for stream in videos:
+            if not stream.attached_pic:
+                return stream
+        return videos[0] if videos else None
+
+    @property
+    def audio_streams(self) -> tuple[StreamInfo, ...]:
+        return tuple(s for s in self.streams if s.codec_type == "audio")
+
+
+def _to_int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_probe_counts = collections.Counter()
+_probe_counts_lock = threading.Lock()
+
+
+def get_probe_count(input_file: str | None = None) -> int:
+    """
+    Returns how many ffprobe processes have been spawned, in total or for a single input.
+    """
+    with _probe_counts_lock:
+        if input_file is None:
+            return sum(_probe_counts.values())
+        return _probe_counts[input_file]
+
+
+def reset_probe_counts() -> None:
+    """Resets the ffprobe spawn counters."""
+    with _probe_counts_lock:
+        _probe_counts.clear()
+
+
+_probe_cache = None
+
+
+def set_probe_cache(cache) -> None:
+    """
+    Sets the persistent ProbeCache that probe_media reads through, or None to disable it.
+    """
+    global _probe_cache
+    _probe_cache = cache
+
+
+def probe_media(input_file: str, use_cache: bool = True) -> MediaInfo | None:
+    """
+    Probes a media file once with ffprobe and returns its parsed metadata.
+
+    If a probe cache is configured (see set_probe_cache), an entry that still matches
+    the file's size, mtime and inode is returned without spawning ffprobe.
 
     Args:
-        input_file: The path to the input video file.
+        input_file: The path to the media file.
+        use_cache: Whether to read through the configured probe cache.
 
     Returns:
-        The bitrate of the video file as a string, or None if it cannot be determined.
+        A MediaInfo object, or None if the file could not be probed.
     """
+    cache = _probe_cache if use_cache else None
+    stat_result = None
+    if cache is not None:
+        try:
+            stat_result = os.stat(input_file)
+        except OSError:
+            cache = None
+        else:
+            cached = cache.get(input_file, stat_result)
+            if cached is not None:
+                return MediaInfo.from_ffprobe(input_file, cached)
+
     command = [
         "ffprobe",
         "-v",
@@ -72,73 +403,85 @@ def get_video_bitrate(input_file: str) -> str | None:
         "-print_format",
         "json",
         "-show_format",
+        "-show_streams",
         input_file,
     ]
+    with _probe_counts_lock:
+        _probe_counts[input_file] += 1
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        with metrics.stage(metrics.STAGE_PROBE):
+            result = subprocess.run(resolve_command(command), capture_output=True, text=True, check=True)
         data = json.loads(result.stdout)
-        if "format" in data and "bit_rate" in data["format"]:
-            return data["format"]["bit_rate"]
-        else:
-            return None
     except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError):
         return None
 
-def get_video_resolution_for_optimization(input_file: str) -> dict | None:
+    if cache is not None:
+        cache.put(input_file, stat_result, data)
+    return MediaInfo.from_ffprobe(input_file, data)
+
+
+def _as_media_info(source: "str | MediaInfo") -> MediaInfo | None:
+    if isinstance(source, MediaInfo):
+        return source
+    return probe_media(source)
+
+
+def get_video_bitrate(input_file: str | MediaInfo) -> str | None:
+    """
+    Gets the bitrate of a video file using ffprobe.
+
+    Args:
+        input_file: The path to the input video file, or its already probed MediaInfo.
+
+    Returns:
+        The bitrate of the video file as a string, or None if it cannot be determined.
+    """
+    media_info = _as_media_info(input_file)
+    if media_info is None or media_info.bit_rate is None:
+        return None
+    return str(media_info.bit_rate)
+
+def get_video_resolution_for_optimization(input_file: str | MediaInfo) -> dict | None:
     """
     Gets video details (resolution, codec) of a video file using ffprobe.
     The resolution is rounded up to the nearest supported resolution in the bitrate map.
 
     Args:
-        input_file: The path to the input video file.
+        input_file: The path to the input video file, or its already probed MediaInfo.
 
     Returns:
         A dictionary containing 'resolution' and 'codec_name', or None if it cannot be determined.
     """
-    command = [
-        "ffprobe",
-        "-v",
-        "quiet",
-        "-print_format",
-        "json",
-        "-show_streams",
-        input_file,
-    ]
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        for stream in data.get("streams", []):
-            if stream.get("codec_type") == "video":
-                width = stream.get("width")
-                height = stream.get("height")
-                codec_name = stream.get("codec_name")
-                if width and height and codec_name:
-                    # Get supported resolutions from the global map
-                    supported_resolutions = sorted([int(r.replace('p', '')) for r in OPTIMIZED_BITRATE_MAP.keys()])
-                    
-                    if not supported_resolutions:
-                        return None # No supported resolutions loaded
-
-                    # Find the best matching resolution
-                    best_res = supported_resolutions[-1] # Default to highest if above all
-                    for res in supported_resolutions:
-                        if height <= res:
-                            best_res = res
-                            break
-                    
-                    resolution = f"{best_res}p"
-                    
-                    return {"resolution": resolution, "codec_name": codec_name}
+    media_info = _as_media_info(input_file)
+    if media_info is None:
         return None
-    except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError):
+    stream = media_info.video_stream
+    if stream is None or not (stream.width and stream.height and stream.codec_name):
         return None
 
-def get_file_details(file_path: str) -> dict:
+    # Get supported resolutions from the global map
+    supported_resolutions = sorted([int(r.replace('p', '')) for r in OPTIMIZED_BITRATE_MAP.keys()])
+
+    if not supported_resolutions:
+        return None # No supported resolutions loaded
+
+    # Find the best matching resolution
+    best_res = supported_resolutions[-1] # Default to highest if above all
+    for res in supported_resolutions:
+        if stream.height <= res:
+            best_res = res
+            break
+
+    resolution = f"{best_res}p"
+
+    return {"resolution": resolution, "codec_name": stream.codec_name}
+
+def get_file_details(file_path: str | MediaInfo) -> dict:
     """
     Gets comprehensive details of a media file using ffprobe.
 
     Args:
-        file_path: The path to the media file.
+        file_path: The path to the media file, or its already probed MediaInfo.
 
     Returns:
         A dictionary containing details like bitrate, resolution, video codec, audio codec, and format.
@@ -151,51 +494,50 @@ def get_file_details(file_path: str) -> dict:
         "audio_codec": "N/A",
         "format": "N/A",
     }
-    command = [
-        "ffprobe",
-        "-v",
-        "quiet",
-        "-print_format",
-        "json",
-        "-show_format",
-        "-show_streams",
-        file_path,
-    ]
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
+    media_info = _as_media_info(file_path)
+    if media_info is None:
+        return details # Return default N/A values on error
 
-        # Get format details
-        if "format" in data:
-            details["format"] = data["format"].get("format_name", "N/A")
-            bitrate_bps = data["format"].get("bit_rate")
-            if bitrate_bps:
-                details["bitrate"] = f"{int(bitrate_bps) / 1000000:.2f} Mbps"
-
-        # Get stream details
-        for stream in data.get("streams", []):
-            if stream.get("codec_type") == "video":
-                details["video_codec"] = stream.get("codec_name", "N/A")
-                width = stream.get("width")
-                height = stream.get("height")
-                if width and height:
-                    details["resolution"] = f"{width}x{height}"
-            elif stream.get("codec_type") == "audio":
-                details["audio_codec"] = stream.get("codec_name", "N/A")
-                # Assuming one audio stream for simplicity, could be extended for multiple
+    # Get format details
+    if media_info.format_name:
+        details["format"] = media_info.format_name
+    if media_info.bit_rate:
+        details["bitrate"] = f"{media_info.bit_rate / 1000000:.2f} Mbps"
 
-    except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError):
-        pass # Return default N/A values on error
+    # Get stream details
+    for stream in media_info.streams:
+        if stream.codec_type == "video":
+            details["video_codec"] = stream.codec_name or "N/A"
+            if stream.width and stream.height:
+                details["resolution"] = f"{stream.width}x{stream.height}"
+        elif stream.codec_type == "audio":
+            details["audio_codec"] = stream.codec_name or "N/A"
+            # Assuming one audio stream for simplicity, could be extended for multiple
 
     return details
 
 
-def get_optimized_bitrate(input_file: str, output_video_codec: str, fallback_bitrate: str) -> str:
+def codec_family(codec: str | None) -> str | None:
+    """
+    Maps an ffprobe codec name or an ffmpeg encoder name to its codec, e.g. "hevc_nvenc" to "hevc".
+    """
+    if not codec:
+        return None
+    if 'h264' in codec:
+        return 'h264'
+    if 'hevc' in codec or 'h265' in codec:
+        return 'hevc'
+    if 'av1' in codec:
+        return 'av1'
+    return codec.split('_')[0]
+
+
+def get_optimized_bitrate(input_file: str | MediaInfo, output_video_codec: str, fallback_bitrate: str) -> str:
     """
     Determines the optimized bitrate based on input video details and a mapping table.
 
     Args:
-        input_file: The path to the input video file.
+        input_file: The path to the input video file, or its already probed MediaInfo.
         output_video_codec: The target output video codec.
         fallback_bitrate: The bitrate to use if no optimized mapping is found.
 
@@ -209,19 +551,8 @@ def get_optimized_bitrate(input_file: str, output_video_codec: str, fallback_bit
     resolution = video_details.get("resolution")
     input_codec = video_details.get("codec_name")
 
-    def simplify_codec(codec):
-        if not codec:
-            return None
-        if 'h264' in codec:
-            return 'h264'
-        if 'hevc' in codec or 'h265' in codec:
-            return 'hevc'
-        if 'av1' in codec:
-            return 'av1'
-        return codec.split('_')[0]
-
-    simple_input_codec = simplify_codec(input_codec)
-    simple_output_codec = simplify_codec(output_video_codec)
+    simple_input_codec = codec_family(input_codec)
+    simple_output_codec = codec_family(output_video_codec)
 
     if resolution and simple_input_codec and resolution in OPTIMIZED_BITRATE_MAP:
         resolution_map = OPTIMIZED_BITRATE_MAP[resolution]
@@ -233,6 +564,228 @@ def get_optimized_bitrate(input_file: str, output_video_codec: str, fallback_bit
     return fallback_bitrate
 
 
+def parse_bitrate(bitrate: str | None) -> int | None:
+    """
+    Parses a bitrate string such as "6M", "800K" or "8000000" into bits per second.
+
+    Returns:
+        The bitrate in bits per second, or None if the string cannot be parsed.
+    """
+    if not bitrate:
+        return None
+    value = str(bitrate).strip().upper()
+    multiplier = 1
+    if value.endswith("M"):
+        multiplier, value = 1_000_000, value[:-1]
+    elif value.endswith("K"):
+        multiplier, value = 1_000, value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return None
+
+
+# Bitrate mode that calibrates each input's bitrate against a quality target (see quality_calibration.py)
+BITRATE_TARGET_QUALITY = "target-quality"
+
+QUALITY_METRIC_SSIM = "ssim"
+QUALITY_METRIC_PSNR = "psnr"
+# The score a calibrated bitrate has to reach when no target is given: SSIM (0-1) or PSNR in dB
+DEFAULT_QUALITY_TARGETS = {QUALITY_METRIC_SSIM: 0.96, QUALITY_METRIC_PSNR: 40.0}
+
+# Calibration may take at most this fraction of the estimated time of the full encode
+DEFAULT_CALIBRATION_BUDGET = 0.1
+
+
+def resolve_target_bitrate(
+    input_file: str | MediaInfo,
+    video_codec: str,
+    video_bitrate: str,
+    fallback_bitrate: str,
+    cap_dynamic_bitrate: bool,
+) -> str:
+    """
+    Resolves the "-b:v" value for a conversion from the selected bitrate mode.
+
+    Args:
+        input_file: The path to the input video file, or its already probed MediaInfo.
+        video_codec: The target output video codec.
+        video_bitrate: "optimized", "dynamic", "target-quality" or a fixed bitrate such as
+            "10M". Target-quality mode starts from the optimized bitrate, which
+            quality_calibration.calibrate_plan then refines per input.
+        fallback_bitrate: The bitrate to use if optimized mapping or probing fails.
+        cap_dynamic_bitrate: Whether to cap the optimized/dynamic bitrate at the fallback bitrate.
+
+    Returns:
+        The bitrate to pass to ffmpeg.
+    """
+    if video_bitrate in ("optimized", BITRATE_TARGET_QUALITY):
+        target_bitrate = get_optimized_bitrate(input_file, video_codec, fallback_bitrate)
+    elif video_bitrate == "dynamic":
+        target_bitrate = get_video_bitrate(input_file)
+        if not target_bitrate:
+            return fallback_bitrate
+    else:
+        return video_bitrate
+
+    if cap_dynamic_bitrate:
+        # Convert to common unit (bits) for comparison
+        target_bitrate_val = parse_bitrate(target_bitrate)
+        fallback_bitrate_val = parse_bitrate(fallback_bitrate)
+        if target_bitrate_val is not None and fallback_bitrate_val is not None and target_bitrate_val > fallback_bitrate_val:
+            target_bitrate = fallback_bitrate
+    return target_bitrate
+
+
+# What happens to subtitle and attachment (e.g. font) streams
+SUBTITLES_KEEP = "keep" # Copied, or converted to a text format the container can hold
+SUBTITLES_DROP = "drop"
+ATTACHMENTS_KEEP = "keep" # Copied where the container supports attachments
+ATTACHMENTS_DROP = "drop"
+
+STREAM_COPY = "copy"
+STREAM_ENCODE = "encode"
+STREAM_DROP = "drop"
+
+# Text subtitles can be converted between containers; bitmap ones (PGS, VobSub, DVB) can't
+TEXT_SUBTITLE_CODECS = frozenset({"subrip", "srt", "ass", "ssa", "webvtt", "mov_text", "text"})
+# MP4-style containers only hold mov_text subtitles and no attachments
+MP4_FORMATS = frozenset({"mp4", "m4v", "mov"})
+MATROSKA_FORMATS = frozenset({"mkv", "mka"})
+# WebM is Matroska restricted to WebVTT subtitles and no attachments
+WEBM_FORMATS = frozenset({"webm"})
+
+
+@dataclass(frozen=True)
+class StreamPlan:
+    """What happens to one input stream: copied, encoded with codec, or dropped (and why)."""
+    index: int
+    codec_type: str | None
+    codec_name: str | None
+    action: str
+    codec: str | None = None
+    reason: str = ""
+
+    def describe(self) -> str:
+        source = f"#{self.index} {self.codec_type} ({self.codec_name or 'unknown'})"
+        if self.action == STREAM_COPY:
+            return f"{source} copied"
+        if self.action == STREAM_ENCODE:
+            return f"{source} -> {self.codec}"
+        return f"{source} dropped: {self.reason}"
+
+
+def plan_streams(
+    media_info: MediaInfo,
+    video_codec: str,
+    audio_codec: str,
+    output_format: str,
+    subtitles: str = SUBTITLES_KEEP,
+    attachments: str = ATTACHMENTS_KEEP,
+    copy_video: bool = False,
+) -> list[StreamPlan]:
+    """
+    Decides per input stream whether to copy, encode or drop it.
+
+    The main video stream is encoded (or copied, for a remux); other video streams such
+    as cover art are dropped. Every audio track is kept: copied if it already uses the
+    target audio codec, transcoded otherwise. Subtitles and attachments follow their
+    policy, within what the output container can hold. Data streams are dropped.
+
+    Args:
+        media_info: The probed input, with every stream.
+        video_codec: The target video codec.
+        audio_codec: The target audio codec.
+        output_format: The output container, e.g. "mp4" or "mkv".
+        subtitles: SUBTITLES_KEEP or SUBTITLES_DROP.
+        attachments: ATTACHMENTS_KEEP or ATTACHMENTS_DROP.
+        copy_video: Copy the main video stream instead of encoding it.
+
+    Returns:
+        A StreamPlan per input stream, in input order.
+    """
+    output_format = output_format.lower().lstrip(".")
+    main_video = media_info.video_stream
+    plans = []
+    for stream in media_info.streams:
+        def plan(action, codec=None, reason=""):
+            return StreamPlan(stream.index, stream.codec_type, stream.codec_name, action, codec, reason)
+
+        if stream.codec_type == "video":
+            if stream is not main_video:
+                plans.append(plan(STREAM_DROP, reason="not the main video stream"))
+            elif copy_video:
+                plans.append(plan(STREAM_COPY))
+            else:
+                plans.append(plan(STREAM_ENCODE, video_codec))
+        elif stream.codec_type == "audio":
+            if codec_family(stream.codec_name) == codec_family(audio_codec):
+                plans.append(plan(STREAM_COPY))
+            else:
+                plans.append(plan(STREAM_ENCODE, audio_codec))
+        elif stream.codec_type == "subtitle":
+            if subtitles == SUBTITLES_DROP:
+                plans.append(plan(STREAM_DROP, reason="subtitles are dropped"))
+            elif output_format in MP4_FORMATS:
+                if stream.codec_name == "mov_text":
+                    plans.append(plan(STREAM_COPY))
+                elif stream.codec_name in TEXT_SUBTITLE_CODECS:
+                    plans.append(plan(STREAM_ENCODE, "mov_text"))
+                else:
+                    plans.append(plan(STREAM_DROP, reason=f"{output_format} can't hold bitmap subtitles"))
+            elif output_format in WEBM_FORMATS:
+                if stream.codec_name == "webvtt":
+                    plans.append(plan(STREAM_COPY))
+                elif stream.codec_name in TEXT_SUBTITLE_CODECS:
+                    plans.append(plan(STREAM_ENCODE, "webvtt"))
+                else:
+                    plans.append(plan(STREAM_DROP, reason=f"{output_format} can't hold bitmap subtitles"))
+            elif output_format in MATROSKA_FORMATS and stream.codec_name == "mov_text":
+                plans.append(plan(STREAM_ENCODE, "subrip"))
+            else:
+                plans.append(plan(STREAM_COPY))
+        elif stream.codec_type == "attachment":
+            if attachments == ATTACHMENTS_DROP:
+                plans.append(plan(STREAM_DROP, reason="attachments are dropped"))
+            elif output_format in MATROSKA_FORMATS:
+                plans.append(plan(STREAM_COPY))
+            else:
+                plans.append(plan(STREAM_DROP, reason=f"{output_format} can't hold attachments"))
+        else:
+            plans.append(plan(STREAM_DROP, reason=f"{stream.codec_type or 'unknown'} streams aren't converted"))
+    return plans
+
+
+def stream_args(stream_plans: list[StreamPlan], video_codec_args: list[str], input_index: int = 0, first_outputs: dict[str, int] | None = None) -> list[str]:
+    """
+    The -map and per-stream codec arguments for a stream plan.
+
+    Args:
+        stream_plans: The plans from plan_streams.
+        video_codec_args: The arguments following "-c:v <codec>" for an encoded video
+            stream, e.g. encoder thread limits.
+        input_index: The ffmpeg input the planned streams are taken from.
+        first_outputs: Output streams per type ("v", "a", "s", "t") already mapped from
+            other inputs, so the codec arguments address the right output streams.
+    """
+    args = []
+    codec_args = []
+    output_counts = collections.Counter(first_outputs or {})
+    for stream_plan in stream_plans:
+        if stream_plan.action == STREAM_DROP:
+            continue
+        args.extend(["-map", f"{input_index}:{stream_plan.index}"])
+        # Codecs are set per output stream of each type, in the order the streams are mapped
+        specifier = {"video": "v", "audio": "a", "subtitle": "s", "attachment": "t"}[stream_plan.codec_type]
+        output_index = output_counts[specifier]
+        output_counts[specifier] += 1
+        codec = stream_plan.codec if stream_plan.action == STREAM_ENCODE else "copy"
+        codec_args.extend([f"-c:{specifier}:{output_index}", codec])
+        if specifier == "v" and stream_plan.action == STREAM_ENCODE:
+            codec_args.extend(video_codec_args)
+    return args + codec_args
+
+
 def build_ffmpeg_command(
     input_file: str,
     output_file: str,
@@ -241,10 +794,17 @@ def build_ffmpeg_command(
     video_bitrate: str,
     fallback_bitrate: str,
     cap_dynamic_bitrate: bool,
+    media_info: MediaInfo | None = None,
+    threads: int | None = None,
+    subtitles: str = SUBTITLES_KEEP,
+    attachments: str = ATTACHMENTS_KEEP,
 ) -> list[str]:
     """
     Constructs the ffmpeg command as a list of strings.
 
+    With media_info, every stream is mapped explicitly as decided by plan_streams;
+    without it, ffmpeg's default stream selection applies.
+
     Args:
         input_file: The path to the input video file.
         output_file: The path to the output video file.
@@ -253,6 +813,12 @@ def build_ffmpeg_command(
         video_bitrate: The video bitrate to use.
         fallback_bitrate: The bitrate to use if optimized mapping is not found.
         cap_dynamic_bitrate: Whether to cap the optimized bitrate at the fallback bitrate.
+        media_info: The already probed input details. If omitted, the input is probed when
+            the bitrate mode needs it.
+        threads: The number of threads the decoder and encoder may use. If omitted, ffmpeg
+            uses every core.
+        subtitles: The subtitle policy, SUBTITLES_KEEP or SUBTITLES_DROP.
+        attachments: The attachment policy, ATTACHMENTS_KEEP or ATTACHMENTS_DROP.
 
     Returns:
         A list of strings representing the ffmpeg command.
@@ -260,70 +826,91 @@ def build_ffmpeg_command(
     if not input_file or not output_file:
         raise ValueError("Input and output files must be specified.")
 
-    command = [
-        "ffmpeg",
-        "-i",
-        input_file,
-        "-c:v",
-        video_codec,
-        "-c:a",
-        audio_codec,
-    ]
-
-    if video_bitrate == "optimized":
-        target_bitrate = get_optimized_bitrate(input_file, video_codec, fallback_bitrate)
-        if cap_dynamic_bitrate:
-            try:
-                # Convert to common unit (bits) for comparison
-                target_bitrate_val = int(target_bitrate.upper().replace("M", "000000").replace("K", "000"))
-                fallback_bitrate_val = int(fallback_bitrate.upper().replace("M", "000000").replace("K", "000"))
-                if target_bitrate_val > fallback_bitrate_val:
-                    target_bitrate = fallback_bitrate
-            except ValueError:
-                pass  # Handle cases where bitrate strings are not perfectly parsable
-        command.extend(["-b:v", target_bitrate])
-    elif video_bitrate == "dynamic":
-        bitrate = get_video_bitrate(input_file)
-        if bitrate:
-            if cap_dynamic_bitrate:
-                try:
-                    dynamic_bitrate_int = int(bitrate.upper().replace("M", "000000").replace("K", "000"))
-                    fallback_bitrate_int = int(fallback_bitrate.upper().replace("M", "000000").replace("K", "000"))
-                    if dynamic_bitrate_int > fallback_bitrate_int:
-                        bitrate = fallback_bitrate
-                except ValueError:
-                    pass  # Could not convert bitrates to int for comparison
-            command.extend(["-b:v", bitrate])
-        else:
-            command.extend(["-b:v", fallback_bitrate])
+    command = ["ffmpeg"]
+    if threads:
+        # Before -i, -threads applies to the decoder
+        command.extend(["-threads", str(threads)])
+    command.extend(["-i", input_file])
+    video_codec_args = encoder_thread_args(video_codec, threads) if threads else []
+    if media_info is not None and media_info.streams:
+        output_format = os.path.splitext(output_file)[1]
+        command.extend(stream_args(plan_streams(media_info, video_codec, audio_codec, output_format, subtitles, attachments), video_codec_args))
     else:
-        command.extend(["-b:v", video_bitrate])
+        command.extend(["-c:v", video_codec, *video_codec_args, "-c:a", audio_codec])
+
+    target_bitrate = resolve_target_bitrate(
+        media_info or input_file, video_codec, video_bitrate, fallback_bitrate, cap_dynamic_bitrate
+    )
+    command.extend(["-b:v", target_bitrate])
 
     command.append(output_file)
 
     return command
 
 
-def execute_ffmpeg_command(command: list[str], verbose_logging: bool) -> subprocess.Popen:
+def build_copy_command(
+    input_file: str,
+    output_file: str,
+    audio_codec: str,
+    media_info: MediaInfo | None = None,
+    subtitles: str = SUBTITLES_KEEP,
+    attachments: str = ATTACHMENTS_KEEP,
+) -> list[str]:
+    """
+    Constructs an ffmpeg command that remuxes the input, copying its video stream.
+
+    The other streams are handled as by build_ffmpeg_command: audio tracks already in
+    audio_codec are copied and the rest transcoded, which costs little next to a video
+    encode. Without media_info, all audio is transcoded.
+    """
+    if not input_file or not output_file:
+        raise ValueError("Input and output files must be specified.")
+    command = ["ffmpeg", "-i", input_file]
+    if media_info is not None and media_info.streams:
+        output_format = os.path.splitext(output_file)[1]
+        command.extend(stream_args(plan_streams(media_info, "copy", audio_codec, output_format, subtitles, attachments, copy_video=True), []))
+    else:
+        command.extend(["-c:v", "copy", "-c:a", audio_codec])
+    command.append(output_file)
+    return command
+
+
+def execute_ffmpeg_command(command: list[str], verbose_logging: bool, progress: bool = False) -> subprocess.Popen:
     """
     Executes an ffmpeg command.
 
     Args:
         command: The ffmpeg command to execute, as a list of strings.
         verbose_logging: If True, ffmpeg will output verbose logs.
+        progress: If True, ffmpeg writes machine-readable progress to stdout
+            (`-progress pipe:1 -nostats`), to be read with ffmpeg_progress.stream_ffmpeg_progress.
     
     Returns:
         The Popen object for the running process.
     """
+    command = prepare_ffmpeg_command(command, verbose_logging, progress)
+    return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=CREATE_NO_WINDOW)
+
+
+def prepare_ffmpeg_command(command: list[str], verbose_logging: bool, progress: bool = False) -> list[str]:
+    """
+    Adds the logging and progress options to an ffmpeg command, as execute_ffmpeg_command does.
+
+    Returns:
+        A new command list; the given one is left unchanged.
+    """
+    command = list(command)
+    if progress:
+        command[1:1] = ["-progress", "pipe:1", "-nostats"]
+
     if not verbose_logging:
         # Insert -v quiet after ffmpeg if not verbose
         command.insert(1, "-v")
         command.insert(2, "quiet")
-
-    return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    return resolve_command(command)
 
 
-def get_output_filepath(input_file: str, output_dir: str, output_format: str) -> str:
+def get_output_filepath(input_file: str, output_dir: str, output_format: str, reserved: set[str] | None = None) -> str:
     """
     Determines the output file path based on the naming convention.
 
@@ -331,18 +918,544 @@ def get_output_filepath(input_file: str, output_dir: str, output_format: str) ->
         input_file: The path to the input video file.
         output_dir: The path to the output directory.
         output_format: The output file format (e.g., "mp4").
+        reserved: Output paths already assigned to other inputs of the same batch. The
+            returned path is added to this set.
 
     Returns:
         The path to the output video file.
     """
+    if reserved is None:
+        reserved = set()
+
     base_filename = os.path.splitext(os.path.basename(input_file))[0]
     output_filename = f"z_{base_filename}.{output_format}"
     output_filepath = os.path.join(output_dir, output_filename)
 
     counter = 1
-    while os.path.exists(output_filepath):
+    while os.path.exists(output_filepath) or output_filepath in reserved:
         output_filename = f"z_{counter}_{base_filename}.{output_format}"
         output_filepath = os.path.join(output_dir, output_filename)
         counter += 1
 
+    reserved.add(output_filepath)
     return output_filepath
+
+
+# What happens to inputs that already are in the target codec at or below the target bitrate
+PASSTHROUGH_OFF = "off" # Re-encode them anyway
+PASSTHROUGH_COPY = "copy" # Remux them, copying the video stream
+PASSTHROUGH_SKIP = "skip" # Leave them alone
+
+# Inputs count as already efficient up to this multiple of the target bitrate
+DEFAULT_PASSTHROUGH_THRESHOLD = 1.0
+
+# The action a plan takes for its input
+ACTION_ENCODE = "encode"
+ACTION_COPY = "copy"
+ACTION_SKIP = "skip"
+
+
+@dataclass(frozen=True)
+class ConversionSettings:
+    """
+    The user's conversion options, shared by every file of a batch.
+    """
+    output_dir: str
+    video_codec: str
+    audio_codec: str
+    output_format: str
+    video_bitrate: str = "optimized"
+    fallback_bitrate: str = "6M"
+    cap_dynamic_bitrate: bool = False
+    quality_profile: str = "Balanced Quality"
+    delete_input: bool = False
+    verbose_logging: bool = False
+    progress_interval: float = DEFAULT_PROGRESS_INTERVAL
+    passthrough: str = PASSTHROUGH_COPY
+    passthrough_threshold: float = DEFAULT_PASSTHROUGH_THRESHOLD
+    subtitles: str = SUBTITLES_KEEP
+    attachments: str = ATTACHMENTS_KEEP
+    # Inputs at least this long (seconds) or large (bytes) are encoded in segments; 0 disables each
+    segment_min_duration: float = 0.0
+    segment_min_size: int = 0
+    segment_count: int = 4
+    quality_metric: str = QUALITY_METRIC_SSIM
+    quality_target: float | None = None # The metric's default target if None
+    calibration_budget: float = DEFAULT_CALIBRATION_BUDGET
+
+
+# The settings that decide what an output looks like; logging, progress and input deletion don't
+OUTPUT_SETTINGS = (
+    "video_codec",
+    "audio_codec",
+    "output_format",
+    "video_bitrate",
+    "fallback_bitrate",
+    "cap_dynamic_bitrate",
+    "quality_profile",
+    "passthrough",
+    "passthrough_threshold",
+    "subtitles",
+    "attachments",
+)
+
+
+# The settings that shape outputs in target-quality mode only
+QUALITY_SETTINGS = ("quality_metric", "quality_target", "calibration_budget")
+
+
+def conversion_params(settings: ConversionSettings) -> dict:
+    """The settings that make two conversions of the same input produce the same output."""
+    params = {name: getattr(settings, name) for name in OUTPUT_SETTINGS}
+    if settings.video_bitrate == BITRATE_TARGET_QUALITY:
+        # Left out in other modes, so changing them doesn't invalidate earlier conversions there
+        params.update({name: getattr(settings, name) for name in QUALITY_SETTINGS})
+    return params
+
+
+@dataclass(frozen=True)
+class ConversionPlan:
+    """
+    Everything an encode worker needs to run ffmpeg for one input, decided up front.
+    """
+    input_file: str
+    output_filepath: str
+    target_bitrate: str
+    media_info: MediaInfo | None
+    estimated_duration: float | None
+    estimated_size: int | None
+    action: str = ACTION_ENCODE
+    reason: str = ""
+
+    @property
+    def probed(self) -> bool:
+        return self.media_info is not None
+
+
+# Probing is I/O- and process-spawn-bound, so it gets its own pool sized independently
+# of the number of concurrent encodes.
+DEFAULT_PROBE_WORKERS = 8
+
+# Assumed audio bitrate per audio stream when estimating output sizes.
+ESTIMATED_AUDIO_BITRATE = 128_000
+
+
+def estimate_output_size(media_info: MediaInfo | None, target_bitrate: str) -> int | None:
+    """
+    Estimates the output size in bytes from the target video bitrate and the input duration.
+    """
+    if media_info is None or not media_info.duration:
+        return None
+    video_bps = parse_bitrate(target_bitrate)
+    if video_bps is None:
+        return None
+    audio_bps = ESTIMATED_AUDIO_BITRATE * len(media_info.audio_streams)
+    return int((video_bps + audio_bps) * media_info.duration / 8)
+
+
+def source_video_bitrate(media_info: MediaInfo) -> int | None:
+    """
+    The input's video bitrate in bits per second.
+
+    Containers such as Matroska often don't report a per-stream bitrate; the overall
+    bitrate minus the audio (as reported, or estimated) is used then.
+    """
+    video_stream = media_info.video_stream
+    if video_stream is not None and video_stream.bit_rate:
+        return video_stream.bit_rate
+    if not media_info.bit_rate:
+        return None
+    audio_bps = sum(stream.bit_rate or ESTIMATED_AUDIO_BITRATE for stream in media_info.audio_streams)
+    return max(0, media_info.bit_rate - audio_bps)
+
+
+@dataclass(frozen=True)
+class ConversionDecision:
+    """Whether to encode, remux or skip an input, and why."""
+    action: str
+    reason: str = ""
+
+
+def decide_conversion(media_info: MediaInfo | None, settings: ConversionSettings, target_bitrate: str) -> ConversionDecision:
+    """
+    Decides whether re-encoding an input gains anything.
+
+    An input that is already in the target codec at no more than passthrough_threshold
+    times the target bitrate would only lose quality and burn CPU by being encoded
+    again, so it is remuxed or skipped instead, depending on settings.passthrough.
+
+    Args:
+        media_info: The probed input details, or None if probing failed.
+        settings: The batch's conversion settings.
+        target_bitrate: The bitrate the input would be encoded at.
+
+    Returns:
+        The ConversionDecision; its reason explains a remux or skip.
+    """
+    if settings.passthrough == PASSTHROUGH_OFF or media_info is None or media_info.video_stream is None:
+        return ConversionDecision(ACTION_ENCODE)
+    family = codec_family(media_info.video_stream.codec_name)
+    if family is None or family != codec_family(settings.video_codec):
+        return ConversionDecision(ACTION_ENCODE)
+    source_bps = source_video_bitrate(media_info)
+    target_bps = parse_bitrate(target_bitrate)
+    if source_bps is None or target_bps is None or source_bps > target_bps * settings.passthrough_threshold:
+        return ConversionDecision(ACTION_ENCODE)
+
+    action = ACTION_SKIP if settings.passthrough == PASSTHROUGH_SKIP else ACTION_COPY
+    reason = (
+        f"already {family} at {source_bps / 1_000_000:.2f} Mbps, within {settings.passthrough_threshold:g}x "
+        f"of the {target_bitrate} target"
+    )
+    return ConversionDecision(action, reason)
+
+
+class PassthroughReport:
+    """
+    Tallies the inputs of a batch that were remuxed or skipped instead of encoded, and the CPU time that saved.
+
+    The saving is estimated from the batch's own encodes: their CPU time per second of
+    media, applied to the media that wasn't encoded. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.copied = 0
+        self.skipped = 0
+        self.passthrough_seconds = 0.0
+        self.encoded_seconds = 0.0
+        self.encode_cpu_seconds = 0.0
+
+    def add_plan(self, plan: ConversionPlan):
+        """Counts a planned input that won't be encoded; plans that will be are ignored."""
+        if plan.action == ACTION_ENCODE:
+            return
+        with self._lock:
+            if plan.action == ACTION_COPY:
+                self.copied += 1
+            else:
+                self.skipped += 1
+            self.passthrough_seconds += plan.estimated_duration or 0.0
+
+    def add_encode(self, media_seconds: float | None, cpu_seconds: float | None):
+        """Records the cost of a finished encode."""
+        if not media_seconds or cpu_seconds is None:
+            return
+        with self._lock:
+            self.encoded_seconds += media_seconds
+            self.encode_cpu_seconds += cpu_seconds
+
+    def cpu_hours_saved(self) -> float | None:
+        """The estimated CPU-hours saved, or None if no encode has been measured yet."""
+        with self._lock:
+            if not self.encoded_seconds:
+                return None
+            return self.passthrough_seconds * self.encode_cpu_seconds / self.encoded_seconds / 3600
+
+    def describe(self) -> str | None:
+        """A one-line summary, or None if every input was encoded."""
+        if not (self.copied or self.skipped):
+            return None
+        saved = self.cpu_hours_saved()
+        saving = f"~{saved:.2f} CPU-hours saved" if saved is not None else "CPU-hours saved unknown (no encodes to measure)"
+        return f"Passthrough: {self.copied} remuxed, {self.skipped} skipped instead of re-encoded; {saving}."
+
+
+def plan_conversion(
+    input_file: str,
+    media_info: MediaInfo | None,
+    settings: ConversionSettings,
+    reserved_outputs: set[str] | None = None,
+    output_filepath: str | None = None,
+) -> ConversionPlan:
+    """
+    Builds the conversion plan for one already probed input.
+
+    Args:
+        input_file: The path to the input video file.
+        media_info: The probed input details, or None if probing failed.
+        settings: The batch's conversion settings.
+        reserved_outputs: Output paths already assigned within the batch.
+        output_filepath: The output path to use instead of picking a new one, e.g. the
+            one an interrupted run of the batch assigned to the input.
+
+    Returns:
+        The ConversionPlan for the input.
+    """
+    if media_info is None and settings.video_bitrate in ("optimized", "dynamic", BITRATE_TARGET_QUALITY):
+        # The probe failed, so there is nothing to derive a bitrate from
+        target_bitrate = settings.fallback_bitrate
+    else:
+        target_bitrate = resolve_target_bitrate(
+            media_info or input_file,
+            settings.video_codec,
+            settings.video_bitrate,
+            settings.fallback_bitrate,
+            settings.cap_dynamic_bitrate,
+        )
+
+    decision = decide_conversion(media_info, settings, target_bitrate)
+    if decision.action == ACTION_ENCODE:
+        estimated_size = estimate_output_size(media_info, target_bitrate)
+    elif decision.action == ACTION_COPY:
+        estimated_size = media_info.size
+    else:
+        estimated_size = 0
+
+    return ConversionPlan(
+        input_file=input_file,
+        output_filepath=output_filepath or get_output_filepath(input_file, settings.output_dir, settings.output_format, reserved_outputs),
+        target_bitrate=target_bitrate,
+        media_info=media_info,
+        estimated_duration=media_info.duration if media_info else None,
+        estimated_size=estimated_size,
+        action=decision.action,
+        reason=decision.reason,
+    )
+
+
+def iter_conversion_plans(
+    video_files: Iterable[str],
+    settings: ConversionSettings,
+    probe_workers: int = DEFAULT_PROBE_WORKERS,
+    cancel_event: threading.Event | None = None,
+    output_paths: dict[str, str] | None = None,
+) -> Iterator[ConversionPlan]:
+    """
+    Probes inputs concurrently and yields their conversion plans in input order.
+
+    video_files may be a lazy iterator (e.g. from scan_video_files); it is consumed
+    incrementally, keeping only a bounded window of probes in flight, so the first plans
+    are available while the input is still being discovered. Output paths are assigned
+    in input order, so files with the same name never collide.
+
+    Args:
+        video_files: The input video files, in submission order.
+        settings: The batch's conversion settings.
+        probe_workers: The number of concurrent ffprobe processes.
+        cancel_event: If set while planning, no further files are probed or yielded.
+        output_paths: Output paths already assigned to some inputs (keyed by absolute
+            input path), e.g. by an interrupted run of the batch. They are reused, and
+            never given to other inputs.
+
+    Returns:
+        An iterator of ConversionPlan objects.
+    """
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    probe_workers = max(1, probe_workers)
+    output_paths = output_paths or {}
+    reserved_outputs = set(output_paths.values())
+    in_flight = collections.deque()
+    files = iter(video_files)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=probe_workers) as executor:
+        try:
+            while True:
+                # Keep a few probes queued per worker so the pool never runs dry
+                for video_file in itertools.islice(files, probe_workers * 4 - len(in_flight)):
+                    in_flight.append((video_file, executor.submit(probe_media, video_file)))
+                if not in_flight or cancelled():
+                    break
+                video_file, future = in_flight.popleft()
+                media_info = future.result()
+                if cancelled():
+                    break
+                yield plan_conversion(video_file, media_info, settings, reserved_outputs, output_paths.get(os.path.abspath(video_file)))
+        finally:
+            # Don't wait for probes nobody is going to use
+            for _, future in in_flight:
+                future.cancel()
+
+
+def plan_conversions(
+    video_files: Iterable[str],
+    settings: ConversionSettings,
+    probe_workers: int = DEFAULT_PROBE_WORKERS,
+    cancel_event: threading.Event | None = None,
+) -> list[ConversionPlan]:
+    """
+    Probes every input concurrently and returns a full conversion plan per file.
+
+    Args:
+        video_files: The input video files, in submission order.
+        settings: The batch's conversion settings.
+        probe_workers: The number of concurrent ffprobe processes.
+        cancel_event: If set while planning, files not yet probed are skipped.
+
+    Returns:
+        A ConversionPlan for every input, in the same order as video_files.
+    """
+    return list(iter_conversion_plans(video_files, settings, probe_workers, cancel_event))
+
+
+def run_conversion(
+    plan: ConversionPlan,
+    settings: ConversionSettings,
+    cancel_event: threading.Event | None = None,
+    on_progress: Callable[[FfmpegProgress], None] | None = None,
+    on_process_started: Callable[[subprocess.Popen], None] | None = None,
+    cpu_allocator: CpuAllocator | None = None,
+) -> dict:
+    """
+    Runs ffmpeg for one planned input and streams its progress until it exits.
+
+    The bitrate was resolved during planning, so this never probes the input.
+
+    Args:
+        plan: The input's conversion plan.
+        settings: The batch's conversion settings.
+        cancel_event: Checked after ffmpeg exits to report a cancelled conversion.
+        on_progress: Called with throttled FfmpegProgress updates.
+        on_process_started: Called with the ffmpeg process right after it starts, e.g. so
+            the caller can terminate it on cancel.
+        cpu_allocator: Shares the CPU between concurrent encodes. If given, ffmpeg is limited
+            to this encode's share of the cores for as long as it runs.
+
+    Returns:
+        A dictionary with 'success', 'output_filepath', 'stderr', 'cpu_seconds' (an estimate:
+        the run time times the threads ffmpeg was given) and, on failure, 'error'.
+    """
+    if cpu_allocator is None:
+        return _run_ffmpeg(plan, settings, cancel_event, on_progress, on_process_started)
+    allocation = cpu_allocator.acquire(plan.input_file)
+
+    def attach_process(process):
+        cpu_allocator.attach(plan.input_file, process.pid)
+        if on_process_started is not None:
+            on_process_started(process)
+
+    try:
+        return _run_ffmpeg(plan, settings, cancel_event, on_progress, attach_process, allocation.threads)
+    finally:
+        cpu_allocator.release(plan.input_file)
+
+
+def build_plan_command(
+    plan: ConversionPlan,
+    settings: ConversionSettings,
+    threads: int | None = None,
+    output_path: str | None = None,
+) -> list[str]:
+    """
+    Builds the ffmpeg command for a planned conversion, with the bitrate resolved during planning.
+
+    output_path overrides where ffmpeg writes, e.g. the plan's temporary output path.
+    """
+    if plan.action == ACTION_COPY:
+        return build_copy_command(
+            plan.input_file, output_path or plan.output_filepath, settings.audio_codec, plan.media_info,
+            settings.subtitles, settings.attachments,
+        )
+    return build_ffmpeg_command(
+        plan.input_file,
+        output_path or plan.output_filepath,
+        settings.video_codec,
+        settings.audio_codec,
+        plan.target_bitrate,
+        settings.fallback_bitrate,
+        settings.cap_dynamic_bitrate,
+        media_info=plan.media_info,
+        threads=threads,
+        subtitles=settings.subtitles,
+        attachments=settings.attachments,
+    )
+
+
+def temp_output_path(output_filepath: str) -> str:
+    """
+    A fresh hidden path to encode an output to before it is renamed into place.
+
+    Each call returns a new name, so conversions that happen to share an output path
+    never write to or clean up each other's partial files. The real extension is kept
+    last so ffmpeg still picks the right container.
+    """
+    directory, filename = os.path.split(output_filepath)
+    base, ext = os.path.splitext(filename)
+    return os.path.join(directory, f".{base}.{uuid.uuid4().hex[:8]}.part{ext}")
+
+
+# The names temp_output_path gives, and the segment directories of segmented encodes next to them
+_PARTIAL_OUTPUT_NAME = re.compile(r"^\..+\.[0-9a-f]{8}\.part(\.[^.]+)?(\.segments)?$")
+
+
+def is_partial_output(name: str) -> bool:
+    """Whether a file or directory name is one of the temporary outputs of temp_output_path."""
+    return _PARTIAL_OUTPUT_NAME.match(name) is not None
+
+
+def partial_outputs(output_filepath: str) -> list[str]:
+    """
+    The temporary outputs left next to output_filepath by conversions that never finished.
+
+    This includes the segment directories of segmented encodes (see segmented.py).
+    """
+    directory, filename = os.path.split(output_filepath)
+    base, ext = os.path.splitext(filename)
+    pattern = os.path.join(glob.escape(directory), f".{glob.escape(base)}.*.part{glob.escape(ext)}")
+    return glob.glob(pattern) + glob.glob(pattern + ".segments")
+
+
+def remove_partial_output(path: str):
+    """Deletes a partial (temporary) output, file or segment directory, if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def finalize_output(result: dict, temp_path: str) -> dict:
+    """
+    Renames a successful conversion's temporary output into place, or deletes it on failure.
+
+    A crash can therefore only ever leave a temporary file behind, never a truncated
+    file under the real output name.
+    """
+    if result["success"]:
+        try:
+            os.replace(temp_path, result["output_filepath"])
+        except OSError as e:
+            result["success"] = False
+            result["error"] = f"Could not move the output into place: {e}"
+    if not result["success"]:
+        remove_partial_output(temp_path)
+    return result
+
+
+def _run_ffmpeg(plan, settings, cancel_event, on_progress, on_process_started, threads=None):
+    temp_path = temp_output_path(plan.output_filepath)
+    command = build_plan_command(plan, settings, threads, temp_path)
+    started = time.monotonic()
+    encoded = plan.action == ACTION_ENCODE
+    with metrics.stage(metrics.STAGE_ENCODE if encoded else metrics.STAGE_REMUX), metrics.ACTIVE_PROCESSES.track():
+        process = execute_ffmpeg_command(command, settings.verbose_logging, progress=True)
+        if on_process_started is not None:
+            on_process_started(process)
+
+        # stdout carries the -progress stream; publish throttled updates while ffmpeg runs
+        stderr = stream_ffmpeg_progress(
+            process,
+            plan.input_file,
+            plan.estimated_duration,
+            on_progress or (lambda progress: None),
+            settings.progress_interval,
+        )
+
+    result = {
+        "success": False,
+        "output_filepath": plan.output_filepath,
+        "stderr": stderr,
+        "cpu_seconds": (time.monotonic() - started) * (threads or os.cpu_count() or 1),
+    }
+    if cancel_event is not None and cancel_event.is_set():
+        result["error"] = "Conversion cancelled"
+    elif process.returncode == 0:
+        result["success"] = True
+    else:
+        result["error"] = stderr
+    result = finalize_output(result, temp_path)
+    metrics.record_conversion(plan, result, time.monotonic() - started, encoded)
+    return result
@@ -8,7 +8,69 @@ import concurrent.futures
 import functools
 import time
 
-from conversion_logic import find_video_files, build_ffmpeg_command, execute_ffmpeg_command, get_output_filepath, get_file_details, load_optimized_bitrate_map, get_video_resolution_for_optimization, get_optimized_bitrate
+from conversion_logic import scan_video_files, run_conversion, get_file_details, load_optimized_bitrate_map, set_probe_cache, iter_conversion_plans, conversion_params, ConversionSettings, ScanOptions, DEFAULT_PROBE_WORKERS
+from conversion_logic import PassthroughReport, ACTION_COPY, ACTION_ENCODE, ACTION_SKIP, PASSTHROUGH_COPY, PASSTHROUGH_OFF, PASSTHROUGH_SKIP, DEFAULT_PASSTHROUGH_THRESHOLD
+from conversion_logic import plan_streams, ATTACHMENTS_DROP, ATTACHMENTS_KEEP, SUBTITLES_DROP, SUBTITLES_KEEP
+from conversion_logic import BITRATE_TARGET_QUALITY, DEFAULT_CALIBRATION_BUDGET, QUALITY_METRIC_PSNR, QUALITY_METRIC_SSIM
+from conversion_logic import resolve_command
+from probe_cache import ProbeCache
+from ffmpeg_progress import DEFAULT_PROGRESS_INTERVAL
+from eta import EtaEstimator
+from scheduler import MakespanTracker, order_plans, ORDER_FIFO, ORDER_LONGEST_FIRST, ORDER_SHORTEST_FIRST
+from concurrency import AdaptiveConcurrencyController, ConcurrencyLimiter
+from cpu_allocation import CpuAllocator
+from batch_manifest import BatchManifest
+from fingerprint_index import FingerprintIndex
+from schemas import BatchFileStatus
+from segmented import SegmentedEncode, should_segment
+from quality_calibration import calibrate_plan
+from encoder_capabilities import CapabilityRegistry, FALLBACK_CPU, FALLBACK_FAIL
+import metrics
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "N/A"
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+
+JOB_ORDER_LABELS = {
+    ORDER_FIFO: "FIFO (start while scanning)",
+    ORDER_LONGEST_FIRST: "Longest First (LPT)",
+    ORDER_SHORTEST_FIRST: "Shortest First",
+}
+
+PASSTHROUGH_LABELS = {
+    PASSTHROUGH_COPY: "Remux (copy the video stream)",
+    PASSTHROUGH_SKIP: "Skip the file",
+    PASSTHROUGH_OFF: "Re-encode anyway",
+}
+
+# How many planned files may wait for a free encoder before scanning pauses
+MAX_QUEUED_PLANS = 10_000
+
+# Upper bound for automatic concurrency, matching the spinbox range
+MAX_AUTO_CONCURRENCY = 32
+
+
+def _split_patterns(text):
+    return tuple(p.strip() for p in text.split(",") if p.strip())
+
+
+def _copy_future_outcome(source, target):
+    # Completes target with source's result or exception
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _format_size(size_bytes):
+    if not size_bytes:
+        return "N/A"
+    return f"{size_bytes / (1024 ** 3):.2f} GB"
 
 class ConverterApp(ttk.Frame):
     def __init__(self, master):
@@ -66,7 +128,7 @@ class ConverterApp(ttk.Frame):
         # Video Bitrate
         ttk.Label(options_frame, text="Video Bitrate:").grid(row=3, column=0, sticky=tk.W)
         self.video_bitrate = tk.StringVar(value="optimized")
-        bitrates = ["dynamic", "optimized"] + [f"{i}M" for i in range(1, 10, 1)] + [f"{i}M" for i in range(10, 251, 5)]
+        bitrates = ["dynamic", "optimized", BITRATE_TARGET_QUALITY] + [f"{i}M" for i in range(1, 10, 1)] + [f"{i}M" for i in range(10, 251, 5)]
         ttk.Combobox(options_frame, textvariable=self.video_bitrate, values=bitrates, state="readonly").grid(row=3, column=1, sticky="ew")
 
         # Bitrate Quality Profile
@@ -94,9 +156,95 @@ class ConverterApp(ttk.Frame):
         self.concurrent_conversions_spinbox = ttk.Spinbox(options_frame, from_=1, to=32, textvariable=self.concurrent_conversions, state="readonly")
         self.concurrent_conversions_spinbox.grid(row=8, column=1, sticky="ew")
 
+        # Probe Workers
+        ttk.Label(options_frame, text="Probe Workers (planning):").grid(row=9, column=0, sticky=tk.W)
+        self.probe_workers = tk.IntVar(value=DEFAULT_PROBE_WORKERS)
+        self.probe_workers_spinbox = ttk.Spinbox(options_frame, from_=1, to=64, textvariable=self.probe_workers, state="readonly")
+        self.probe_workers_spinbox.grid(row=9, column=1, sticky="ew")
+
         # Verbose Logging
         self.verbose_logging = tk.BooleanVar(value=False)
-        ttk.Checkbutton(options_frame, text="Enable Verbose Logging", variable=self.verbose_logging).grid(row=9, column=0, columnspan=2, sticky=tk.W)
+        ttk.Checkbutton(options_frame, text="Enable Verbose Logging", variable=self.verbose_logging).grid(row=10, column=0, columnspan=2, sticky=tk.W)
+
+        # Progress Update Interval
+        ttk.Label(options_frame, text="Progress Update Interval (s):").grid(row=11, column=0, sticky=tk.W)
+        self.progress_interval = tk.StringVar(value=str(DEFAULT_PROGRESS_INTERVAL))
+        progress_intervals = ["0.5", "1.0", "2.0", "5.0", "10.0"]
+        ttk.Combobox(options_frame, textvariable=self.progress_interval, values=progress_intervals, state="readonly").grid(row=11, column=1, sticky="ew")
+
+        # Scan options
+        self.scan_subfolders = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Scan subfolders", variable=self.scan_subfolders).grid(row=12, column=0, columnspan=2, sticky=tk.W)
+
+        ttk.Label(options_frame, text="Include Patterns (comma-separated):").grid(row=13, column=0, sticky=tk.W)
+        self.include_patterns = tk.StringVar()
+        ttk.Entry(options_frame, textvariable=self.include_patterns).grid(row=13, column=1, sticky="ew")
+
+        ttk.Label(options_frame, text="Exclude Patterns (comma-separated):").grid(row=14, column=0, sticky=tk.W)
+        self.exclude_patterns = tk.StringVar()
+        ttk.Entry(options_frame, textvariable=self.exclude_patterns).grid(row=14, column=1, sticky="ew")
+
+        ttk.Label(options_frame, text="Minimum File Size (MB):").grid(row=15, column=0, sticky=tk.W)
+        self.min_file_size = tk.StringVar(value="0")
+        ttk.Entry(options_frame, textvariable=self.min_file_size).grid(row=15, column=1, sticky="ew")
+
+        # Job Order
+        ttk.Label(options_frame, text="Job Order:").grid(row=16, column=0, sticky=tk.W)
+        self.job_order = tk.StringVar(value=JOB_ORDER_LABELS[ORDER_FIFO])
+        ttk.Combobox(options_frame, textvariable=self.job_order, values=list(JOB_ORDER_LABELS.values()), state="readonly").grid(row=16, column=1, sticky="ew")
+
+        # Adaptive concurrency: the spinbox value becomes the starting level
+        self.auto_concurrency = tk.BooleanVar()
+        ttk.Checkbutton(options_frame, text="Auto-tune concurrent conversions (starts at the value above)", variable=self.auto_concurrency).grid(row=17, column=0, columnspan=2, sticky=tk.W)
+
+        # CPU affinity: each conversion runs on its own set of cores
+        self.pin_cpus = tk.BooleanVar()
+        ttk.Checkbutton(options_frame, text="Pin each conversion to its own CPU cores", variable=self.pin_cpus).grid(row=18, column=0, columnspan=2, sticky=tk.W)
+
+        # Content fingerprints: renamed or moved inputs that were converted before are skipped too
+        self.skip_converted = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Skip inputs already converted with the same settings", variable=self.skip_converted).grid(row=19, column=0, columnspan=2, sticky=tk.W)
+
+        # Passthrough: inputs already in the target codec at or below the target bitrate aren't re-encoded
+        ttk.Label(options_frame, text="Inputs Already at Target:").grid(row=20, column=0, sticky=tk.W)
+        self.passthrough = tk.StringVar(value=PASSTHROUGH_LABELS[PASSTHROUGH_COPY])
+        ttk.Combobox(options_frame, textvariable=self.passthrough, values=list(PASSTHROUGH_LABELS.values()), state="readonly").grid(row=20, column=1, sticky="ew")
+
+        ttk.Label(options_frame, text="Passthrough Threshold (x target bitrate):").grid(row=21, column=0, sticky=tk.W)
+        self.passthrough_threshold = tk.StringVar(value=str(DEFAULT_PASSTHROUGH_THRESHOLD))
+        ttk.Entry(options_frame, textvariable=self.passthrough_threshold).grid(row=21, column=1, sticky="ew")
+
+        # Stream policies: every audio track is kept; subtitles and attachments only if wanted and the container allows
+        self.keep_subtitles = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Keep subtitles (converted to fit the container)", variable=self.keep_subtitles).grid(row=22, column=0, columnspan=2, sticky=tk.W)
+        self.keep_attachments = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Keep attachments such as fonts (MKV output only)", variable=self.keep_attachments).grid(row=23, column=0, columnspan=2, sticky=tk.W)
+
+        # Segmented encoding: long or large inputs are split at keyframes and encoded by several workers at once
+        ttk.Label(options_frame, text="Split Inputs Longer Than (min, 0 = off):").grid(row=24, column=0, sticky=tk.W)
+        self.segment_min_minutes = tk.StringVar(value="0")
+        ttk.Entry(options_frame, textvariable=self.segment_min_minutes).grid(row=24, column=1, sticky="ew")
+
+        ttk.Label(options_frame, text="Split Inputs Larger Than (GB, 0 = off):").grid(row=25, column=0, sticky=tk.W)
+        self.segment_min_gb = tk.StringVar(value="0")
+        ttk.Entry(options_frame, textvariable=self.segment_min_gb).grid(row=25, column=1, sticky="ew")
+
+        # Target-quality mode: each input's bitrate is calibrated on encoded samples
+        ttk.Label(options_frame, text="Quality Metric (target-quality):").grid(row=26, column=0, sticky=tk.W)
+        self.quality_metric = tk.StringVar(value=QUALITY_METRIC_SSIM)
+        ttk.Combobox(options_frame, textvariable=self.quality_metric, values=[QUALITY_METRIC_SSIM, QUALITY_METRIC_PSNR], state="readonly").grid(row=26, column=1, sticky="ew")
+
+        ttk.Label(options_frame, text="Quality Target (blank = metric default):").grid(row=27, column=0, sticky=tk.W)
+        self.quality_target = tk.StringVar()
+        ttk.Entry(options_frame, textvariable=self.quality_target).grid(row=27, column=1, sticky="ew")
+
+        ttk.Label(options_frame, text="Calibration Budget (% of encode time):").grid(row=28, column=0, sticky=tk.W)
+        self.calibration_budget = tk.StringVar(value=f"{DEFAULT_CALIBRATION_BUDGET * 100:g}")
+        ttk.Entry(options_frame, textvariable=self.calibration_budget).grid(row=28, column=1, sticky="ew")
+
+        # Encoder check: a hardware encoder this machine can't open is replaced before the batch starts, or stops it
+        self.cpu_fallback = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Use a CPU encoder when the hardware encoder is unavailable", variable=self.cpu_fallback).grid(row=29, column=0, columnspan=2, sticky=tk.W)
 
         # Progress and Log frame
         progress_log_frame = ttk.LabelFrame(self, text="Progress and Log", padding="10")
@@ -115,15 +263,26 @@ class ConverterApp(ttk.Frame):
         self.log_area.tag_configure("timestamp", foreground="gray")
         self.log_area.tag_configure("details", foreground="blue")
 
+        # Live per-file progress of the running ffmpeg processes
+        self.active_files = ttk.Treeview(progress_log_frame, columns=("percent", "out_time", "fps", "speed"), height=4)
+        self.active_files.heading("#0", text="File")
+        self.active_files.heading("percent", text="Progress")
+        self.active_files.heading("out_time", text="Position")
+        self.active_files.heading("fps", text="FPS")
+        self.active_files.heading("speed", text="Speed")
+        for column in ("percent", "out_time", "fps", "speed"):
+            self.active_files.column(column, width=90, anchor=tk.E, stretch=False)
+        self.active_files.grid(row=1, column=0, sticky="ew")
+
         self.progress_bar = ttk.Progressbar(progress_log_frame, orient="horizontal", mode="determinate")
-        self.progress_bar.grid(row=1, column=0, sticky="ew")
+        self.progress_bar.grid(row=2, column=0, sticky="ew")
 
         self.eta_label = ttk.Label(progress_log_frame, text="ETA: Calculating...")
-        self.eta_label.grid(row=2, column=0, sticky=tk.W)
+        self.eta_label.grid(row=3, column=0, sticky=tk.W)
 
         # Log control buttons
         log_buttons_frame = ttk.Frame(progress_log_frame)
-        log_buttons_frame.grid(row=3, column=0, sticky="ew")
+        log_buttons_frame.grid(row=4, column=0, sticky="ew")
         log_buttons_frame.columnconfigure(0, weight=1)
         log_buttons_frame.columnconfigure(1, weight=1)
 
@@ -140,11 +299,20 @@ class ConverterApp(ttk.Frame):
         self.conversion_widgets = [self.start_button] + list(self.children.values())
         self.conversion_start_times = {}
         self.current_processes = {}
+        self.eta_estimator = None
+        self.concurrency_limiter = None
+        self.last_eta_refresh = 0.0
 
         self._check_ffmpeg()
 
+        # Re-scans of the same folders reuse earlier ffprobe results
+        set_probe_cache(ProbeCache())
+        self.fingerprint_index = FingerprintIndex()
+        # ffmpeg's encoders are probed once and reused by later batches
+        self.capabilities = CapabilityRegistry()
+
     def _check_ffmpeg(self):
-        if not shutil.which("ffmpeg"):
+        if not shutil.which(resolve_command(["ffmpeg"])[0]):
             messagebox.showerror("FFmpeg Not Found", "FFmpeg is not installed or not in your system's PATH. Please install FFmpeg to use this application.")
             self.master.destroy()
 
@@ -175,21 +343,51 @@ class ConverterApp(ttk.Frame):
         self.progress_queue = queue.Queue()
         self.start_time = time.time() # Initialize start time
         self.total_files_count = 0 # Will be set in _conversion_worker
-
+        self.eta_estimator = None # Will be set in _conversion_worker once the plan is ready
+
+        settings = ConversionSettings(
+            output_dir=self.output_dir.get(),
+            video_codec=self.video_codec.get(),
+            audio_codec=self.audio_codec.get(),
+            output_format=self.output_format.get(),
+            video_bitrate=self.video_bitrate.get(),
+            fallback_bitrate=self.fallback_bitrate.get(),
+            cap_dynamic_bitrate=self.cap_dynamic_bitrate.get(),
+            quality_profile=self.bitrate_quality_profile.get(),
+            delete_input=self.delete_input.get(),
+            verbose_logging=self.verbose_logging.get(),
+            progress_interval=float(self.progress_interval.get()),
+            passthrough=next(mode for mode, label in PASSTHROUGH_LABELS.items() if label == self.passthrough.get()),
+            passthrough_threshold=float(self.passthrough_threshold.get() or DEFAULT_PASSTHROUGH_THRESHOLD),
+            subtitles=SUBTITLES_KEEP if self.keep_subtitles.get() else SUBTITLES_DROP,
+            attachments=ATTACHMENTS_KEEP if self.keep_attachments.get() else ATTACHMENTS_DROP,
+            segment_min_duration=float(self.segment_min_minutes.get() or 0) * 60,
+            segment_min_size=int(float(self.segment_min_gb.get() or 0) * 1024 ** 3),
+            # One segment per concurrent conversion, so a lone long file can use the whole pool
+            segment_count=self.concurrent_conversions.get(),
+            quality_metric=self.quality_metric.get(),
+            quality_target=float(self.quality_target.get()) if self.quality_target.get().strip() else None,
+            calibration_budget=float(self.calibration_budget.get() or DEFAULT_CALIBRATION_BUDGET * 100) / 100,
+        )
+        scan_options = ScanOptions(
+            recursive=self.scan_subfolders.get(),
+            include_globs=_split_patterns(self.include_patterns.get()),
+            exclude_globs=_split_patterns(self.exclude_patterns.get()),
+            min_size=int(float(self.min_file_size.get() or 0) * 1024 * 1024),
+            # An output folder inside the input folder must not feed the batch its own outputs
+            exclude_dirs=(settings.output_dir,),
+        )
         args = (
             self.input_dir.get(),
-            self.output_dir.get(),
-            self.video_codec.get(),
-            self.audio_codec.get(),
-            self.video_bitrate.get(),
-            self.bitrate_quality_profile.get(), # Pass bitrate_quality_profile
-            self.output_format.get(),
-            self.delete_input.get(),
-            self.fallback_bitrate.get(),
-            self.cap_dynamic_bitrate.get(),
+            scan_options,
+            settings,
             self.concurrent_conversions.get(),
-            self.start_time, # Pass start_time
-            self.verbose_logging.get(), # Pass verbose_logging state
+            self.probe_workers.get(),
+            next(policy for policy, label in JOB_ORDER_LABELS.items() if label == self.job_order.get()),
+            self.auto_concurrency.get(),
+            self.pin_cpus.get(),
+            self.skip_converted.get(),
+            FALLBACK_CPU if self.cpu_fallback.get() else FALLBACK_FAIL,
         )
 
         self.thread = threading.Thread(target=self._conversion_worker, args=args)
@@ -211,142 +409,410 @@ class ConverterApp(ttk.Frame):
                 self.progress_queue.put(("log", ("warning", f"Terminating conversion for {video_file}.")))
         self.current_processes.clear() # Clear the dictionary after attempting to terminate all processes
 
-    def _conversion_worker(self, input_dir, output_dir, video_codec, audio_codec, video_bitrate, bitrate_quality_profile, output_format, delete_input, fallback_bitrate, cap_dynamic_bitrate, concurrent_conversions, start_time, verbose_logging):
+    def _conversion_worker(self, input_dir, scan_options, settings, concurrent_conversions, probe_workers, job_order, auto_concurrency=False, pin_cpus=False, skip_converted=True, codec_fallback=FALLBACK_CPU):
 
         # Load the appropriate optimized bitrate map based on user selection
-        load_optimized_bitrate_map(bitrate_quality_profile)
+        load_optimized_bitrate_map(settings.quality_profile)
 
-        if not input_dir or not output_dir:
+        if not input_dir or not settings.output_dir:
             self.progress_queue.put(("log", ("error", "Error: Input and output folders must be selected.")))
             self.progress_queue.put(("conversion_finished", None))
             return
 
-        video_files = find_video_files(input_dir)
-        if not video_files:
-            self.progress_queue.put(("log", ("warning", f"No video files found in {input_dir}")))
+        try:
+            settings, notes = self.capabilities.resolve_settings(settings, codec_fallback)
+        except ValueError as e:
+            self.progress_queue.put(("log", ("error", f"Error: {e}")))
+            self.progress_queue.put(("conversion_finished", None))
+            return
+        for note in notes:
+            self.progress_queue.put(("log", ("warning", note)))
+
+        try:
+            video_files = scan_video_files(input_dir, scan_options)
+        except ValueError as e:
+            self.progress_queue.put(("log", ("error", f"Error: {e}")))
             self.progress_queue.put(("conversion_finished", None))
             return
 
-        self.progress_queue.put(("log", ("info", f"Found {len(video_files)} video files to convert.")))
-        self.progress_queue.put(("progress_max", len(video_files)))
-        self.total_files_count = len(video_files) # Set total files count here
-
-        # Adjust the number of workers to not exceed the number of files
-        num_workers = min(concurrent_conversions, self.total_files_count)
-
-        # Use a ThreadPoolExecutor for concurrent conversions
-        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-            # Store futures to track progress and results
-            futures = {}
-            for video_file in video_files:
-                self.conversion_start_times[video_file] = time.time()
-                future = executor.submit(self._convert_single_file,
-                                        video_file,
-                                        output_dir,
-                                        video_codec,
-                                        audio_codec,
-                                        video_bitrate,
-                                        output_format,
-                                        delete_input,
-                                        fallback_bitrate,
-                                        cap_dynamic_bitrate,
-                                        self.cancel_event,
-                                        verbose_logging)
-                futures[future] = video_file
-
-            completed_count = 0
-            self.completed_files_count = 0 # Initialize for ETA calculation
-
-            for future in concurrent.futures.as_completed(futures):
+        # The manifest survives crashes, so re-running the same batch continues where it stopped
+        manifest = BatchManifest(input_dir, settings)
+        self.manifest = manifest
+        counts = manifest.counts()
+        if counts[BatchFileStatus.DONE] or manifest.interrupted:
+            log_message = (
+                f"Resuming batch: {counts[BatchFileStatus.DONE]} files already converted will be skipped, "
+                f"{manifest.interrupted} interrupted conversions start over."
+            )
+            self.progress_queue.put(("log", ("info", log_message)))
+        video_files = self._pending_files(video_files, manifest, conversion_params(settings) if skip_converted else None)
+
+        # The stage timings logged at the end cover this batch only
+        metrics.REGISTRY.clear()
+        self.queued_files = set()
+
+        self.progress_queue.put(("log", ("info", f"Scanning {input_dir} and planning conversions with {probe_workers} probe workers...")))
+
+        # The ETA is based on media seconds and live encode speed, refreshed by _update_progress
+        eta_estimator = EtaEstimator(concurrent_conversions)
+        self.eta_estimator = eta_estimator
+        makespan_tracker = MakespanTracker(concurrent_conversions)
+        self.makespan_tracker = makespan_tracker
+        passthrough_report = PassthroughReport()
+        self.passthrough_report = passthrough_report
+
+        # Every encode holds a limiter slot, so the auto mode can resize concurrency while the pool stays fixed
+        self.concurrency_limiter = ConcurrencyLimiter(concurrent_conversions)
+        pool_size = concurrent_conversions
+        controller_stop = threading.Event()
+        # Split the cores between the running encodes instead of letting each ffmpeg assume it owns them all
+        self.cpu_allocator = CpuAllocator(expected_encodes=concurrent_conversions, pin_affinity=pin_cpus)
+        self.progress_queue.put(("log", ("info", f"CPU budget: {self.cpu_allocator.budget.describe()}, shared between concurrent conversions.")))
+        if auto_concurrency:
+            pool_size = max(concurrent_conversions, min(MAX_AUTO_CONCURRENCY, os.cpu_count() or 1))
+            controller = AdaptiveConcurrencyController(
+                self.concurrency_limiter,
+                max_workers=pool_size,
+                speed_source=eta_estimator.aggregate_speed,
+                on_adjust=functools.partial(self._on_concurrency_adjusted, eta_estimator),
+            )
+            threading.Thread(target=controller.run, args=(controller_stop,), daemon=True).start()
+            self.progress_queue.put(("log", ("info", f"Auto concurrency: starting at {concurrent_conversions}, up to {pool_size} conversions.")))
+
+        plans = iter_conversion_plans(video_files, settings, probe_workers, self.cancel_event, manifest.output_paths())
+        if job_order != ORDER_FIFO:
+            # Any order other than FIFO needs the whole plan before the first encode starts
+            plans = order_plans(plans, job_order)
+            self.progress_queue.put(("log", ("info", f"Planned {len(plans)} files; submitting in '{JOB_ORDER_LABELS[job_order]}' order.")))
+
+        # Bound how far scanning and planning may run ahead of the encoders
+        queued_slots = threading.BoundedSemaphore(MAX_QUEUED_PLANS)
+        done_futures = queue.Queue()
+        futures = {}
+        completed_count = 0
+        self.completed_files_count = 0
+        plan_totals = {"duration": 0.0, "size": 0}
+
+        # With FIFO order, scanning, probing and encoding overlap: each file is submitted as soon as it is planned
+        with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+            for plan in plans:
+                passthrough_report.add_plan(plan)
+                if plan.action != ACTION_ENCODE:
+                    verb = "Skipping" if plan.action == ACTION_SKIP else "Remuxing"
+                    self.progress_queue.put(("log", ("info", f"{verb} {os.path.basename(plan.input_file)} instead of re-encoding: {plan.reason}.")))
+                if plan.action == ACTION_SKIP:
+                    continue
+                self._report_plan_entry(plan, settings, plan_totals)
+                makespan_tracker.add(plan)
+                video_stream = plan.media_info.video_stream if plan.media_info else None
+                eta_estimator.add_file(
+                    plan.input_file,
+                    plan.estimated_duration,
+                    video_stream.codec_name if video_stream else None,
+                    video_stream.height if video_stream else None,
+                )
+
+                while not queued_slots.acquire(timeout=0.1):
+                    completed_count = self._drain_results(done_futures, futures, settings, eta_estimator, completed_count)
+                    if self.cancel_event.is_set():
+                        break
+                if self.cancel_event.is_set():
+                    break
+
+                manifest.set_status(plan.input_file, BatchFileStatus.PENDING, plan.output_filepath)
+                self.conversion_start_times[plan.input_file] = time.time()
+                self.queued_files.add(plan.input_file)
+                metrics.QUEUE_DEPTH.inc()
+                if should_segment(plan, settings):
+                    future = self._submit_segmented(executor, plan, settings, eta_estimator)
+                else:
+                    future = executor.submit(self._convert_single_file, plan, settings, self.cancel_event)
+                futures[future] = plan.input_file
+                self.total_files_count = len(futures)
+                self.progress_queue.put(("progress_max", self.total_files_count))
+                future.add_done_callback(lambda f: (queued_slots.release(), done_futures.put(f)))
+                completed_count = self._drain_results(done_futures, futures, settings, eta_estimator, completed_count)
+
+            if not futures and not passthrough_report.skipped and not self.cancel_event.is_set():
+                self.progress_queue.put(("log", ("warning", f"No video files found in {input_dir}")))
+            elif futures:
+                log_message = (
+                    f"Plan ready: {len(futures)} files, {_format_duration(plan_totals['duration'])} of media, "
+                    f"estimated output {_format_size(plan_totals['size'])}."
+                )
+                self.progress_queue.put(("log", ("info", log_message)))
+
+            while completed_count < len(futures):
                 if self.cancel_event.is_set():
                     self.progress_queue.put(("log", ("warning", "Conversion canceled.")))
                     # Attempt to cancel any pending futures
                     for f in futures:
                         f.cancel()
                     break
-
-                video_file = futures[future]
-                try:
-                    result = future.result() # This will re-raise any exception from _convert_single_file
-                    if result["success"]:
-                        self.progress_queue.put(("log", ("success", f"Successfully converted {video_file} to {result["output_filepath"]}.")))
-                        self.completed_files_count += 1
-                        elapsed_time_for_file = time.time() - self.conversion_start_times.get(video_file, time.time())
-                        avg_time_per_file = (time.time() - start_time) / self.completed_files_count
-                        remaining_files = self.total_files_count - self.completed_files_count
-                        eta_seconds = avg_time_per_file * remaining_files
-                        self.progress_queue.put(("eta", eta_seconds))
-
-                        if delete_input:
-                            try:
-                                os.remove(video_file)
-                                self.progress_queue.put(("log", ("info", f"Deleted input file: {video_file}")))
-                            except OSError as e:
-                                self.progress_queue.put(("log", ("error", f"Error deleting file {video_file}: {e}")))
-                    else:
-                        self.progress_queue.put(("log", ("error", f"Error converting {video_file}: {result["error"]}")))
-                except concurrent.futures.CancelledError:
-                    self.progress_queue.put(("log", ("warning", f"Conversion of {video_file} was cancelled.")))
-                except Exception as exc:
-                    self.progress_queue.put(("log", ("error", f"Error processing {video_file}: {exc}")))
-                finally:
-                    completed_count += 1
-                    self.progress_queue.put(("progress", completed_count))
-
-        self.progress_queue.put(("log", ("info", "All conversions complete.")))
+                completed_count = self._drain_results(done_futures, futures, settings, eta_estimator, completed_count, timeout=0.1)
+
+        controller_stop.set()
+        manifest.close()
+        # Files cancelled before they started never left the queue
+        metrics.QUEUE_DEPTH.dec(len(self.queued_files))
+        self.queued_files.clear()
+        if futures:
+            self._report_makespan(makespan_tracker, job_order)
+        passthrough_summary = passthrough_report.describe()
+        if passthrough_summary:
+            self.progress_queue.put(("log", ("info", passthrough_summary)))
+        stage_summary = metrics.stage_summary()
+        if futures and stage_summary:
+            self.progress_queue.put(("log", ("info", stage_summary)))
+        if futures:
+            self.progress_queue.put(("log", ("info", "All conversions complete.")))
         self.progress_queue.put(("conversion_finished", None))
 
-    def _convert_single_file(self, video_file, output_dir, video_codec, audio_codec, video_bitrate, output_format, delete_input, fallback_bitrate, cap_dynamic_bitrate, cancel_event, verbose_logging):
-        original_details = get_file_details(video_file)
-        log_message = f"Input: {os.path.basename(video_file)} | Codec: {original_details['video_codec']}, Bitrate: {original_details['bitrate']}"
+    def _pending_files(self, video_files, manifest, params):
+        # Drops inputs this batch already converted and, given params, identical conversions from anywhere
+        for video_file in video_files:
+            if manifest.is_done(video_file):
+                continue
+            if params is not None:
+                existing_output = self.fingerprint_index.lookup(video_file, params)
+                if existing_output is not None:
+                    self.progress_queue.put(("log", ("info", f"Skipping {os.path.basename(video_file)}: already converted to {existing_output}.")))
+                    continue
+            yield video_file
+
+    def _on_concurrency_adjusted(self, eta_estimator, adjustment):
+        eta_estimator.concurrency = adjustment.new_limit
+        self.cpu_allocator.set_expected_encodes(adjustment.new_limit)
+        self.progress_queue.put(("log", ("info", adjustment.describe())))
+
+    def _drain_results(self, done_futures, futures, settings, eta_estimator, completed_count, timeout=None):
+        # Handles every finished conversion, optionally waiting up to timeout seconds for the first one
+        while True:
+            try:
+                future = done_futures.get(timeout=timeout) if timeout else done_futures.get_nowait()
+            except queue.Empty:
+                return completed_count
+            timeout = None
+
+            video_file = futures[future]
+            try:
+                result = future.result() # This will re-raise any exception from _convert_single_file
+                if result["success"]:
+                    self.progress_queue.put(("log", ("success", f"Successfully converted {video_file} to {result["output_filepath"]}.")))
+                    self.completed_files_count += 1
+
+                    if settings.delete_input:
+                        try:
+                            with metrics.stage(metrics.STAGE_DELETE_INPUT):
+                                os.remove(video_file)
+                            self.progress_queue.put(("log", ("info", f"Deleted input file: {video_file}")))
+                        except OSError as e:
+                            self.progress_queue.put(("log", ("error", f"Error deleting file {video_file}: {e}")))
+                else:
+                    self.progress_queue.put(("log", ("error", f"Error converting {video_file}: {result["error"]}")))
+            except concurrent.futures.CancelledError:
+                self.progress_queue.put(("log", ("warning", f"Conversion of {video_file} was cancelled.")))
+            except Exception as exc:
+                self.progress_queue.put(("log", ("error", f"Error processing {video_file}: {exc}")))
+            finally:
+                eta_estimator.finish_file(video_file)
+                self.makespan_tracker.finish(video_file)
+                completed_count += 1
+                self.progress_queue.put(("progress", completed_count))
+
+    def _report_makespan(self, makespan_tracker, job_order):
+        report = makespan_tracker.report()
+        if report is None or report["predicted_makespan"] is None:
+            return
+        log_message = (
+            f"Makespan ({JOB_ORDER_LABELS[job_order]}): actual {_format_duration(report['actual_makespan'])}, "
+            f"predicted {_format_duration(report['predicted_makespan'])}. Predicted for other orders: "
+            + ", ".join(f"{JOB_ORDER_LABELS[policy]} {_format_duration(seconds)}" for policy, seconds in report["policies"].items() if policy != job_order)
+        )
         self.progress_queue.put(("log", ("info", log_message)))
 
-        target_bitrate = video_bitrate
-        if video_bitrate == "optimized":
-            optimal_resolution = "N/A"
-            video_details = get_video_resolution_for_optimization(video_file)
-            if video_details:
-                optimal_resolution = video_details.get("resolution", "N/A")
-            
-            target_bitrate = get_optimized_bitrate(video_file, video_codec, fallback_bitrate)
-            log_message = f"Optimized settings: Resolution: {optimal_resolution}, Bitrate: {target_bitrate}"
+    def _report_plan_entry(self, plan, settings, plan_totals):
+        name = os.path.basename(plan.input_file)
+        if not plan.probed:
+            self.progress_queue.put(("log", ("warning", f"Could not probe {name}; using fallback settings.")))
+        else:
+            original_details = get_file_details(plan.media_info)
+            log_message = f"Input: {name} | Codec: {original_details['video_codec']}, Bitrate: {original_details['bitrate']}"
             self.progress_queue.put(("log", ("info", log_message)))
+            stream_plans = plan_streams(
+                plan.media_info, settings.video_codec, settings.audio_codec, settings.output_format,
+                settings.subtitles, settings.attachments, copy_video=plan.action == ACTION_COPY,
+            )
+            self.progress_queue.put(("log", ("details", f"Streams: {name} | " + "; ".join(p.describe() for p in stream_plans))))
 
-        output_filepath = get_output_filepath(video_file, output_dir, output_format)
-        command = build_ffmpeg_command(
-            video_file,
-            output_filepath,
-            video_codec,
-            audio_codec,
-            video_bitrate,
-            fallback_bitrate,
-            cap_dynamic_bitrate,
+        log_message = (
+            f"Plan: {name} -> {os.path.basename(plan.output_filepath)} | Bitrate: {plan.target_bitrate}, "
+            f"Duration: {_format_duration(plan.estimated_duration)}, Est. Size: {_format_size(plan.estimated_size)}"
+        )
+        self.progress_queue.put(("log", ("details", log_message)))
+        plan_totals["duration"] += plan.estimated_duration or 0.0
+        plan_totals["size"] += plan.estimated_size or 0
+
+    def _convert_single_file(self, plan, settings, cancel_event):
+        if not self.concurrency_limiter.acquire(cancel_event):
+            return {"success": False, "output_filepath": plan.output_filepath, "stderr": "", "error": "Conversion cancelled"}
+        self._leave_queue(plan.input_file)
+        try:
+            return self._run_single_conversion(plan, settings, cancel_event)
+        finally:
+            self.concurrency_limiter.release()
+
+    def _leave_queue(self, video_file):
+        # A file leaves the queue when its first conversion slot is granted; a segmented file's later parts don't count
+        try:
+            self.queued_files.remove(video_file)
+        except KeyError:
+            return
+        metrics.QUEUE_DEPTH.dec()
+        metrics.STAGE_SECONDS.observe(time.time() - self.conversion_start_times[video_file], stage=metrics.STAGE_QUEUE_WAIT)
+
+    def _submit_segmented(self, executor, plan, settings, eta_estimator):
+        # Splits a long input so several workers encode its parts at once. Calibrating and finding the keyframes run
+        # as a pool task holding a conversion slot, like any encode, so scanning and submitting go on meanwhile
+        file_future = concurrent.futures.Future()
+        file_future.set_running_or_notify_cancel()
+
+        def prepare_and_submit():
+            try:
+                outcome = self._prepare_segmented(executor, plan, settings, eta_estimator)
+            except Exception as e:
+                file_future.set_exception(e)
+                return
+            if isinstance(outcome, concurrent.futures.Future):
+                outcome.add_done_callback(functools.partial(_copy_future_outcome, target=file_future))
+            else:
+                file_future.set_result(outcome)
+
+        executor.submit(prepare_and_submit)
+        return file_future
+
+    def _prepare_segmented(self, executor, plan, settings, eta_estimator):
+        # Returns the future of the submitted segments, or the file's result if it was cancelled or encoded whole
+        cancel_event = self.cancel_event
+        name = os.path.basename(plan.input_file)
+        if not self.concurrency_limiter.acquire(cancel_event):
+            return {"success": False, "output_filepath": plan.output_filepath, "stderr": "", "error": "Conversion cancelled"}
+        self._leave_queue(plan.input_file)
+        try:
+            if settings.video_bitrate == BITRATE_TARGET_QUALITY:
+                # Calibrated up front, since every segment has to be encoded at the same bitrate
+                plan = self._calibrate_plan(plan, settings, cancel_event)
+            encode = SegmentedEncode(plan, settings)
+            if not encode.prepare():
+                self.progress_queue.put(("log", ("warning", f"Could not find keyframes to split {name} at; encoding it whole.")))
+                # Still holding the slot, so the whole file is encoded by this task
+                return self._run_single_conversion(plan, settings, cancel_event, calibrate=False)
+        finally:
+            self.concurrency_limiter.release()
+        self.progress_queue.put(("log", ("info", f"Splitting {name} into {len(encode.segments)} segments at keyframes, each encoded at {plan.target_bitrate}.")))
+
+        # The segments replace the file in the ETA, so each running part counts with its own speed
+        eta_estimator.finish_file(plan.input_file)
+        video_stream = plan.media_info.video_stream
+        for segment in encode.segments:
+            eta_estimator.add_file(segment.key, segment.duration, video_stream.codec_name, video_stream.height)
+
+        def on_concat_started(process):
+            self.current_processes[plan.input_file] = process
+
+        return encode.submit(
+            executor,
+            functools.partial(self._convert_segment, encode, settings, cancel_event),
+            cancel_event,
+            on_concat_started,
+            functools.partial(self._finish_conversion, plan, settings, cancel_event),
         )
-        
-        log_message = f"Converting {os.path.basename(video_file)} to {os.path.basename(output_filepath)} with video codec: {video_codec}, audio codec: {audio_codec}, bitrate: {target_bitrate}, format: {output_format}."
-        self.progress_queue.put(("log", ("info", log_message)))
 
-        process = execute_ffmpeg_command(command, verbose_logging)
-        # Store the process object for potential termination
-        self.current_processes[video_file] = process
+    def _convert_segment(self, encode, settings, cancel_event, segment):
+        if not self.concurrency_limiter.acquire(cancel_event):
+            return {"success": False, "output_filepath": segment.path, "stderr": "", "error": "Conversion cancelled"}
+        self._leave_queue(encode.plan.input_file)
+        try:
+            def on_process_started(process):
+                self.current_processes[segment.key] = process
+
+            def on_progress(progress):
+                self.eta_estimator.update(segment.key, progress.out_time, progress.speed)
+                self.progress_queue.put(("file_progress", progress))
+
+            self.eta_estimator.start_file(segment.key)
+            self.makespan_tracker.start(encode.plan.input_file)
+            self.manifest.set_status(encode.plan.input_file, BatchFileStatus.ENCODING, encode.plan.output_filepath)
+            result = encode.run_segment(segment, cancel_event, on_progress, on_process_started, self.cpu_allocator)
+            self.progress_queue.put(("file_finished", segment.key))
+            self.current_processes.pop(segment.key, None)
+            self.eta_estimator.finish_file(segment.key)
+            if settings.verbose_logging and result["stderr"]:
+                self.progress_queue.put(("log", ("error", f"FFmpeg STDERR for {segment.key}:\n{result['stderr'].strip()}")))
+            return result
+        finally:
+            self.concurrency_limiter.release()
+
+    def _calibrate_plan(self, plan, settings, cancel_event):
+        plan, calibration = calibrate_plan(plan, settings, self.fingerprint_index, cancel_event, self.cpu_allocator)
+        self.progress_queue.put(("log", ("info", f"Calibrated bitrate for {os.path.basename(plan.input_file)}: {calibration.describe()}.")))
+        return plan
+
+    def _run_single_conversion(self, plan, settings, cancel_event, calibrate=True):
+        if calibrate and plan.action == ACTION_ENCODE and settings.video_bitrate == BITRATE_TARGET_QUALITY:
+            plan = self._calibrate_plan(plan, settings, cancel_event)
+        video_file = plan.input_file
+        output_filepath = plan.output_filepath
+        if plan.action == ACTION_COPY:
+            log_message = f"Remuxing {os.path.basename(video_file)} to {os.path.basename(output_filepath)}, copying the video stream, format: {settings.output_format}."
+        else:
+            log_message = f"Converting {os.path.basename(video_file)} to {os.path.basename(output_filepath)} with video codec: {settings.video_codec}, audio codec: {settings.audio_codec}, bitrate: {plan.target_bitrate}, format: {settings.output_format}."
+        self.progress_queue.put(("log", ("info", log_message)))
 
-        stdout, stderr = process.communicate()
+        def on_process_started(process):
+            # Store the process object for potential termination
+            self.current_processes[video_file] = process
+
+        def on_progress(progress):
+            self.eta_estimator.update(video_file, progress.out_time, progress.speed)
+            self.progress_queue.put(("file_progress", progress))
+
+        self.eta_estimator.start_file(video_file)
+        self.makespan_tracker.start(video_file)
+        self.manifest.set_status(video_file, BatchFileStatus.ENCODING, output_filepath)
+        result = run_conversion(plan, settings, cancel_event, on_progress, on_process_started, self.cpu_allocator)
+        return self._finish_conversion(plan, settings, cancel_event, result)
+
+    def _finish_conversion(self, plan, settings, cancel_event, result):
+        # Records the outcome of a whole file, whether it was converted in one piece or in segments
+        video_file = plan.input_file
+        output_filepath = plan.output_filepath
+        self.progress_queue.put(("file_finished", video_file))
+        if result["success"]:
+            self.manifest.set_status(video_file, BatchFileStatus.DONE)
+            if plan.action == ACTION_ENCODE:
+                self.passthrough_report.add_encode(plan.estimated_duration, result.get("cpu_seconds"))
+            try:
+                # Recorded before the input may be deleted, so later batches can recognise its content
+                self.fingerprint_index.record(video_file, conversion_params(settings), output_filepath)
+            except OSError as e:
+                self.progress_queue.put(("log", ("warning", f"Could not index {os.path.basename(video_file)}: {e}")))
+        elif cancel_event.is_set():
+            self.manifest.set_status(video_file, BatchFileStatus.PENDING)
+        else:
+            self.manifest.set_status(video_file, BatchFileStatus.FAILED, error=result.get("error"))
 
-        if verbose_logging:
-            if stdout:
-                self.progress_queue.put(("log", ("details", f"FFmpeg STDOUT for {video_file}:\n{stdout.strip()}")))
-            if stderr:
-                self.progress_queue.put(("log", ("error", f"FFmpeg STDERR for {video_file}:\n{stderr.strip()}")))
+        if settings.verbose_logging:
+            if result["stderr"]:
+                self.progress_queue.put(("log", ("error", f"FFmpeg STDERR for {video_file}:\n{result["stderr"].strip()}")))
 
         # Remove process from tracking after it completes
         if video_file in self.current_processes:
             del self.current_processes[video_file]
 
-        if cancel_event.is_set():
-            return {"success": False, "error": "Conversion cancelled", "output_filepath": output_filepath}
-
-        if process.returncode == 0:
-            actual_details = get_file_details(output_filepath)
+        if result["success"]:
+            with metrics.stage(metrics.STAGE_VERIFY):
+                actual_details = get_file_details(output_filepath)
             details_log = (
                 f"  Actual Output Details:\n"
                 f"    Format: {actual_details["format"]}\n"
@@ -356,9 +822,28 @@ class ConverterApp(ttk.Frame):
                 f"    Bitrate: {actual_details["bitrate"]}"
             )
             self.progress_queue.put(("log", ("details", details_log)))
-            return {"success": True, "output_filepath": output_filepath}
+        return result
+
+    def _show_file_progress(self, progress):
+        values = (
+            f"{progress.percent:.1f}%" if progress.percent is not None else "N/A",
+            _format_duration(progress.out_time),
+            f"{progress.fps:.1f}" if progress.fps is not None else "N/A",
+            f"{progress.speed:.2f}x" if progress.speed is not None else "N/A",
+        )
+        if self.active_files.exists(progress.input_file):
+            self.active_files.item(progress.input_file, values=values)
         else:
-            return {"success": False, "error": stderr, "output_filepath": output_filepath}
+            self.active_files.insert("", tk.END, iid=progress.input_file, text=os.path.basename(progress.input_file), values=values)
+
+    def _refresh_eta(self):
+        now = time.monotonic()
+        if self.eta_estimator is None or now - self.last_eta_refresh < 1.0:
+            return
+        self.last_eta_refresh = now
+        eta_seconds = self.eta_estimator.eta()
+        if eta_seconds is not None:
+            self.eta_label.config(text=f"ETA: {_format_duration(eta_seconds)}")
 
     def _update_progress(self):
         try:
@@ -375,18 +860,21 @@ class ConverterApp(ttk.Frame):
                     self.progress_bar["maximum"] = data
                 elif message_type == "progress":
                     self.progress_bar["value"] = data
-                elif message_type == "eta":
-                    hours, remainder = divmod(int(data), 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    self.eta_label.config(text=f"ETA: {hours:02}:{minutes:02}:{seconds:02}")
-                    self.update_idletasks()                
+                elif message_type == "file_progress":
+                    self._show_file_progress(data)
+                elif message_type == "file_finished":
+                    if self.active_files.exists(data):
+                        self.active_files.delete(data)
                 elif message_type == "conversion_finished":
+                    self.active_files.delete(*self.active_files.get_children())
                     self._toggle_widgets(True)
                     self.cancel_button.config(state=tk.DISABLED)
                     return # Exit the update loop as conversions are finished
         except queue.Empty:
             pass
 
+        self._refresh_eta()
+
         if self.thread.is_alive():
             self.after(100, self._update_progress)
         else:
@@ -0,0 +1,196 @@
+import math
+import os
+import threading
+from dataclasses import dataclass
+
+# Hardware encoders do their work on the GPU; their CPU threads only matter for decoding
+HARDWARE_ENCODER_SUFFIXES = ("_nvenc", "_qsv", "_vaapi", "_videotoolbox", "_amf", "_v4l2m2m", "_mf")
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cgroup_cpu_quota(root: str = CGROUP_ROOT) -> float | None:
+    """
+    Reads the CPU quota of the current cgroup, e.g. a container started with --cpus=2.5.
+
+    Supports cgroup v2 (cpu.max) and v1 (cpu.cfs_quota_us / cpu.cfs_period_us).
+
+    Returns:
+        The number of cores the quota allows, or None if there is no quota.
+    """
+    try:
+        with open(os.path.join(root, "cpu.max"), "r") as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    for controller in ("cpu", "cpu,cpuacct"):
+        try:
+            with open(os.path.join(root, controller, "cpu.cfs_quota_us"), "r") as f:
+                quota = int(f.read())
+            with open(os.path.join(root, controller, "cpu.cfs_period_us"), "r") as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            continue
+        if quota > 0 and period > 0:
+            return quota / period
+        return None
+    return None
+
+
+def allowed_cpus() -> tuple[int, ...]:
+    """The CPUs this process may run on (its affinity mask), or all CPUs where that is unknown."""
+    if hasattr(os, "sched_getaffinity"):
+        return tuple(sorted(os.sched_getaffinity(0)))
+    return tuple(range(os.cpu_count() or 1))
+
+
+@dataclass(frozen=True)
+class CpuBudget:
+    """The cores available to the encoders and where that limit comes from."""
+    cores: int
+    cpus: tuple[int, ...]
+    quota: float | None = None
+
+    def describe(self) -> str:
+        if self.quota is not None and self.cores < len(self.cpus):
+            return f"{self.cores} cores (cgroup quota {self.quota:g} of {len(self.cpus)} CPUs)"
+        return f"{self.cores} cores"
+
+
+def detect_cpu_budget(cgroup_root: str = CGROUP_ROOT) -> CpuBudget:
+    """Determines how many cores the encoders may use, honouring affinity and cgroup quotas."""
+    cpus = allowed_cpus()
+    quota = cgroup_cpu_quota(cgroup_root)
+    cores = len(cpus)
+    if quota is not None:
+        cores = max(1, min(cores, math.ceil(quota)))
+    return CpuBudget(cores=cores, cpus=cpus, quota=quota)
+
+
+def split_evenly(total: int, parts: int) -> list[int]:
+    """Splits total into parts sizes differing by at most one, largest first, each at least 1."""
+    parts = max(1, parts)
+    base, remainder = divmod(total, parts)
+    return [max(1, base + (1 if i < remainder else 0)) for i in range(parts)]
+
+
+def encoder_thread_args(video_codec: str, threads: int) -> list[str]:
+    """
+    Returns the output options that limit a video encoder to the given number of threads.
+
+    Most encoders honour -threads; x265 and SVT-AV1 size their own thread pools and
+    need their private parameters instead.
+    """
+    if video_codec.endswith(HARDWARE_ENCODER_SUFFIXES):
+        return []
+    if video_codec == "libx265":
+        return ["-x265-params", f"pools={threads}"]
+    if video_codec == "libsvtav1":
+        return ["-svtav1-params", f"lp={threads}"]
+    return ["-threads", str(threads)]
+
+
+def _set_process_affinity(pid: int, cpus: tuple[int, ...]):
+    # sched_setaffinity applies to a single thread, so cover the threads ffmpeg has already started
+    try:
+        thread_ids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        thread_ids = [pid]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass # The thread or process has already exited
+
+
+@dataclass(frozen=True)
+class CpuAllocation:
+    """The thread count and (when pinning) the CPUs given to one encode."""
+    threads: int
+    cpus: tuple[int, ...] | None = None
+
+
+class CpuAllocator:
+    """
+    Divides the CPU budget between the encodes that are running at the same time.
+
+    Each encode gets an equal share of the cores, sized for the larger of the number of
+    running encodes and the expected concurrency, so the first encodes of a batch don't
+    grab every core. ffmpeg's thread count is fixed once it starts, so a change in the
+    number of running encodes rebalances the thread count of the next encodes and, with
+    pin_affinity, moves the running processes onto their new CPU sets straight away.
+    """
+
+    def __init__(self, budget: CpuBudget | None = None, expected_encodes: int = 1, pin_affinity: bool = False):
+        self.budget = budget or detect_cpu_budget()
+        self.pin_affinity = pin_affinity and hasattr(os, "sched_setaffinity")
+        self._expected = max(1, expected_encodes)
+        self._lock = threading.Lock()
+        self._active = {} # key -> pid (None until attached), in acquisition order
+        self._slot_indices = {} # key -> the share of the budget it holds
+
+    def set_expected_encodes(self, count: int):
+        """Updates the expected concurrency, e.g. after the concurrency limit changed."""
+        with self._lock:
+            self._expected = max(1, count)
+            self._rebalance()
+
+    def _slots(self) -> int:
+        return max(len(self._active), self._expected)
+
+    def _cpu_sets(self) -> list[tuple[int, ...]]:
+        cpus = self.budget.cpus
+        sets, start = [], 0
+        for size in split_evenly(len(cpus), min(self._slots(), len(cpus))):
+            sets.append(cpus[start:start + size])
+            start += size
+        return sets
+
+    def _cpu_set_of(self, key: str, cpu_sets: list[tuple[int, ...]]) -> tuple[int, ...]:
+        # Ranked by slot index, so the running encodes always cover disjoint sets
+        rank = sorted(self._slot_indices.values()).index(self._slot_indices[key])
+        return cpu_sets[rank % len(cpu_sets)]
+
+    def _rebalance(self):
+        if not self.pin_affinity:
+            return
+        cpu_sets = self._cpu_sets()
+        for key, pid in self._active.items():
+            if pid is not None:
+                _set_process_affinity(pid, self._cpu_set_of(key, cpu_sets))
+
+    def acquire(self, key: str) -> CpuAllocation:
+        """Registers a starting encode and returns its share of the CPU budget."""
+        with self._lock:
+            self._active[key] = None
+            self._slot_indices.pop(key, None)
+            # The lowest share no running encode holds, so a released share is reused rather than doubled up
+            used = set(self._slot_indices.values())
+            index = next(i for i in range(len(self._active)) if i not in used)
+            self._slot_indices[key] = index
+            threads = split_evenly(self.budget.cores, self._slots())[index]
+            cpus = self._cpu_set_of(key, self._cpu_sets()) if self.pin_affinity else None
+            self._rebalance()
+            return CpuAllocation(threads=threads, cpus=cpus)
+
+    def attach(self, key: str, pid: int):
+        """Associates a started ffmpeg process with its allocation and applies its affinity."""
+        with self._lock:
+            if key in self._active:
+                self._active[key] = pid
+                self._rebalance()
+
+    def release(self, key: str):
+        """Frees the share of a finished encode and rebalances the remaining ones."""
+        with self._lock:
+            self._active.pop(key, None)
+            self._slot_indices.pop(key, None)
+            self._rebalance()
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
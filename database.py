@@ -1,27 +1,77 @@
 import sqlite3
 from pathlib import Path
+import base64
 import json
+import queue
+import threading
 import uuid
 from datetime import datetime, timezone
 
-from schemas import Job, JobStatus
+import structlog
+
+import metrics
+from schemas import Job, JobLogEntry, JobStatus, JobSummary
+
+log = structlog.get_logger()
 
 # Define the path for the database in a 'data' subdirectory
 DB_PATH = Path("data")
 DB_FILE = DB_PATH / "jobs.db"
 
+# How long a connection waits for another writer's lock before raising "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+# Writes of the JobWriter that are committed together in one transaction, at most
+WRITE_BATCH_SIZE = 500
+# How long the JobWriter waits for more writes to join a batch
+WRITE_BATCH_WINDOW_SECONDS = 0.05
+
+def _configure_connection(conn: sqlite3.Connection):
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # With WAL, a commit only has to be durable at the next checkpoint; readers never block the writer
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
 def get_db_connection():
     """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT_MS / 1000)
+    _configure_connection(conn)
+    return conn
+
+_thread_connections = threading.local()
+
+def get_thread_connection() -> sqlite3.Connection:
+    """
+    Returns a connection owned by the calling thread, opening it on first use.
+
+    Worker threads (e.g. asyncio.to_thread) reuse their connection for every call
+    instead of paying for a connect and pragma setup each time. Don't close it.
+    """
+    cached = getattr(_thread_connections, "connections", None)
+    if cached is None:
+        cached = _thread_connections.connections = {}
+    conn = cached.get(str(DB_FILE))
+    if conn is None:
+        conn = cached[str(DB_FILE)] = get_db_connection()
     return conn
 
 def initialize_database():
-    """Initializes the database and creates the jobs table if it doesn't exist."""
+    """Initializes the database, creating or migrating its schema."""
     # Create the data directory if it doesn't exist
     DB_PATH.mkdir(exist_ok=True)
 
     conn = get_db_connection()
+    # WAL is a property of the database file, so setting it once covers every later connection
+    conn.execute("PRAGMA journal_mode = WAL")
+    create_schema(conn)
+    conn.close()
+
+# The schema version, stored in PRAGMA user_version
+SCHEMA_VERSION = 1
+
+def create_schema(conn: sqlite3.Connection):
+    """Creates the tables if they don't exist and migrates older databases to SCHEMA_VERSION."""
     cursor = conn.cursor()
 
     # Create the jobs table
@@ -38,8 +88,62 @@ def initialize_database():
     )
     """)
 
+    # Log lines are appended, never rewritten; (job_id, seq) orders and pages them
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS job_logs (
+        job_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        ts TEXT NOT NULL,
+        level TEXT NOT NULL,
+        message TEXT NOT NULL,
+        PRIMARY KEY (job_id, seq)
+    ) WITHOUT ROWID
+    """)
+
+    # Resumable GUI batches: one row per batch and the state of each of its input files
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS batches (
+        id TEXT PRIMARY KEY,
+        input_dir TEXT NOT NULL,
+        output_dir TEXT NOT NULL,
+        settings TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS batch_files (
+        batch_id TEXT NOT NULL,
+        input_file TEXT NOT NULL,
+        status TEXT NOT NULL,
+        output_path TEXT,
+        error TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (batch_id, input_file)
+    ) WITHOUT ROWID
+    """)
+
+    # Listing indexes: newest first overall, per status and per correlation ID, with id as the keyset tie-breaker
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_correlation ON jobs (correlation_id, created_at, id)")
+
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        _migrate_logs_to_table(cursor)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
-    conn.close()
+
+def _migrate_logs_to_table(cursor: sqlite3.Cursor):
+    # Version 0 kept each job's log as a JSON array in jobs.logs; the column stays, unused
+    rows = cursor.execute("SELECT id, logs, created_at FROM jobs WHERE logs IS NOT NULL").fetchall()
+    for row in rows:
+        messages = json.loads(row["logs"]) if row["logs"] else []
+        cursor.executemany(
+            "INSERT OR IGNORE INTO job_logs (job_id, seq, ts, level, message) VALUES (?, ?, ?, 'info', ?)",
+            [(row["id"], seq, row["created_at"], message) for seq, message in enumerate(messages, start=1)],
+        )
+    cursor.execute("UPDATE jobs SET logs = NULL")
 
 def create_job(conn: sqlite3.Connection, job_id: uuid.UUID, correlation_id: str) -> Job:
     """Creates a new job record in the database."""
@@ -58,15 +162,26 @@ def create_job(conn: sqlite3.Connection, job_id: uuid.UUID, correlation_id: str)
     )
 
     cursor.execute("""
-        INSERT INTO jobs (id, correlation_id, status, progress, logs, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (str(job.id), job.correlation_id, job.status.value, job.progress, json.dumps(job.logs), job.created_at.isoformat(), job.updated_at.isoformat()))
+        INSERT INTO jobs (id, correlation_id, status, progress, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (str(job.id), job.correlation_id, job.status.value, job.progress, job.created_at.isoformat(), job.updated_at.isoformat()))
+    cursor.execute("""
+        INSERT INTO job_logs (job_id, seq, ts, level, message) VALUES (?, 1, ?, 'info', ?)
+    """, (str(job.id), job.created_at.isoformat(), job.logs[0]))
 
     conn.commit()
     return job
 
-def get_job(conn: sqlite3.Connection, job_id: uuid.UUID) -> Job | None:
-    """Retrieves a job record from the database."""
+def get_job(conn: sqlite3.Connection, job_id: uuid.UUID, log_tail: int | None = None) -> Job | None:
+    """
+    Retrieves a job record from the database.
+
+    Args:
+        conn: The database connection.
+        job_id: The job to fetch.
+        log_tail: If given, only the last log_tail log lines are loaded; use get_job_logs
+            to page through the rest.
+    """
     cursor = conn.cursor()
 
     cursor.execute("SELECT * FROM jobs WHERE id = ?", (str(job_id),))
@@ -75,17 +190,113 @@ def get_job(conn: sqlite3.Connection, job_id: uuid.UUID) -> Job | None:
     if row is None:
         return None
 
+    if log_tail is None:
+        cursor.execute("SELECT message FROM job_logs WHERE job_id = ? ORDER BY seq", (str(job_id),))
+        logs = [log_row["message"] for log_row in cursor.fetchall()]
+    else:
+        cursor.execute("SELECT message FROM job_logs WHERE job_id = ? ORDER BY seq DESC LIMIT ?", (str(job_id), log_tail))
+        logs = [log_row["message"] for log_row in reversed(cursor.fetchall())]
+
     return Job(
         id=uuid.UUID(row["id"]),
         correlation_id=row["correlation_id"],
         status=JobStatus(row["status"]),
         progress=row["progress"],
-        logs=json.loads(row["logs"]) if row["logs"] else [],
+        logs=logs,
         result=json.loads(row["result"]) if row["result"] else None,
         created_at=datetime.fromisoformat(row["created_at"]),
         updated_at=datetime.fromisoformat(row["updated_at"]),
     )
 
+def _encode_cursor(created_at: str, job_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{job_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return created_at, job_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor") from None
+
+def _utc_iso(value: datetime) -> str:
+    # created_at is stored as UTC ISO text, so comparisons must use the same form
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+def list_jobs(
+    conn: sqlite3.Connection,
+    status: JobStatus | None = None,
+    correlation_id: str | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    limit: int = 50,
+    cursor: str | None = None,
+) -> tuple[list[JobSummary], str | None]:
+    """
+    Lists jobs newest first, without their logs or results.
+
+    Pagination is keyset-based: pass the returned cursor to get the next page. Each
+    page is an index range scan, so it costs the same however deep into the history it is.
+
+    Args:
+        conn: The database connection.
+        status: Only jobs with this status.
+        correlation_id: Only jobs created by requests with this correlation ID.
+        created_after: Only jobs created at or after this time.
+        created_before: Only jobs created before this time.
+        limit: The maximum number of jobs to return.
+        cursor: The cursor returned with the previous page.
+
+    Returns:
+        The page of job summaries and the cursor of the next page, or None if this was the last one.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    conditions, params = [], []
+    if status is not None:
+        conditions.append("status = ?")
+        params.append(status.value)
+    if correlation_id is not None:
+        conditions.append("correlation_id = ?")
+        params.append(correlation_id)
+    if created_after is not None:
+        conditions.append("created_at >= ?")
+        params.append(_utc_iso(created_after))
+    if created_before is not None:
+        conditions.append("created_at < ?")
+        params.append(_utc_iso(created_before))
+    if cursor is not None:
+        conditions.append("(created_at, id) < (?, ?)")
+        params.extend(_decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = conn.execute(
+        f"""
+        SELECT id, correlation_id, status, progress, created_at, updated_at FROM jobs
+        {where} ORDER BY created_at DESC, id DESC LIMIT ?
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    jobs = [
+        JobSummary(
+            id=uuid.UUID(row["id"]),
+            correlation_id=row["correlation_id"],
+            status=JobStatus(row["status"]),
+            progress=row["progress"],
+            created_at=datetime.fromisoformat(row["created_at"]),
+            updated_at=datetime.fromisoformat(row["updated_at"]),
+        )
+        for row in rows
+    ]
+    return jobs, next_cursor
+
 def update_job_status(conn: sqlite3.Connection, job_id: uuid.UUID, status: JobStatus):
     """Updates the status of a job."""
     cursor = conn.cursor()
@@ -93,20 +304,152 @@ def update_job_status(conn: sqlite3.Connection, job_id: uuid.UUID, status: JobSt
     cursor.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status.value, now_iso, str(job_id)))
     conn.commit()
 
-def log_to_job(conn: sqlite3.Connection, job_id: uuid.UUID, message: str):
-    """Appends a log message to a job's log record."""
+def update_job_progress(conn: sqlite3.Connection, job_id: uuid.UUID, progress: float):
+    """Updates the progress percentage of a job."""
     cursor = conn.cursor()
+    now_iso = datetime.now(timezone.utc).isoformat()
+    cursor.execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", (progress, now_iso, str(job_id)))
+    conn.commit()
 
-    # This is not perfectly atomic but sufficient for this project's scale
-    cursor.execute("SELECT logs FROM jobs WHERE id = ?", (str(job_id),))
-    row = cursor.fetchone()
-    if row is None:
-        return
-
-    logs = json.loads(row["logs"]) if row["logs"] else []
-    logs.append(message)
+def update_job_result(conn: sqlite3.Connection, job_id: uuid.UUID, result: list[str]):
+    """Stores the result (the output files) of a job."""
+    cursor = conn.cursor()
+    now_iso = datetime.now(timezone.utc).isoformat()
+    cursor.execute("UPDATE jobs SET result = ?, updated_at = ? WHERE id = ?", (json.dumps(result), now_iso, str(job_id)))
+    conn.commit()
 
+def log_to_job(conn: sqlite3.Connection, job_id: uuid.UUID, message: str, level: str = "info"):
+    """Appends a log message to a job's log."""
+    cursor = conn.cursor()
     now_iso = datetime.now(timezone.utc).isoformat()
-    cursor.execute("UPDATE jobs SET logs = ?, updated_at = ? WHERE id = ?", (json.dumps(logs), now_iso, str(job_id)))
+
+    cursor.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now_iso, str(job_id)))
+    if cursor.rowcount == 0:
+        conn.rollback()
+        return
+    # A single statement, so the next sequence number can't be taken twice
+    cursor.execute("""
+        INSERT INTO job_logs (job_id, seq, ts, level, message)
+        SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM job_logs WHERE job_id = ?
+    """, (str(job_id), now_iso, level, message, str(job_id)))
     conn.commit()
 
+def get_job_logs(conn: sqlite3.Connection, job_id: uuid.UUID, after_seq: int = 0, limit: int = 100) -> list[JobLogEntry]:
+    """
+    Reads a page of a job's log lines, oldest first.
+
+    Args:
+        conn: The database connection.
+        job_id: The job whose log to read.
+        after_seq: Only lines after this sequence number are returned; pass the last
+            entry's seq to get the next page.
+        limit: The maximum number of lines to return.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT seq, ts, level, message FROM job_logs WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+        (str(job_id), after_seq, limit),
+    )
+    return [
+        JobLogEntry(seq=row["seq"], ts=datetime.fromisoformat(row["ts"]), level=row["level"], message=row["message"])
+        for row in cursor.fetchall()
+    ]
+
+
+
+class JobWriter:
+    """
+    A single writer thread that applies job updates in group-committed batches.
+
+    Progress, log, status and result updates are queued without blocking the caller
+    and applied in order by one connection, so concurrent jobs never compete for the
+    write lock and many updates share one commit. Within a batch only the latest
+    progress of each job is written.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, batch_window: float = WRITE_BATCH_WINDOW_SECONDS):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="job-writer", daemon=True)
+        self._thread.start()
+        self.commits = 0
+
+    def update_progress(self, job_id: uuid.UUID, progress: float):
+        self._queue.put(("progress", job_id, progress))
+
+    def log(self, job_id: uuid.UUID, message: str, level: str = "info"):
+        self._queue.put(("log", job_id, (message, level)))
+
+    def update_status(self, job_id: uuid.UUID, status: JobStatus):
+        self._queue.put(("status", job_id, status))
+
+    def update_result(self, job_id: uuid.UUID, result: list[str]):
+        self._queue.put(("result", job_id, result))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Blocks until everything queued so far is committed. Returns False on timeout."""
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Commits the remaining updates and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self) -> list | None:
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.batch_window))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = get_db_connection()
+        try:
+            while True:
+                batch = self._next_batch()
+                stopping = batch[-1] is None
+                operations = [op for op in batch if op is not None]
+                try:
+                    with metrics.stage(metrics.STAGE_DB_WRITE):
+                        self._apply(conn, operations)
+                except sqlite3.Error as e:
+                    log.error("Failed to write job updates", error=str(e), updates=len(operations))
+                for kind, _, done in operations:
+                    if kind == "flush":
+                        done.set()
+                if stopping:
+                    return
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, operations: list):
+        latest_progress = {job_id: i for i, (kind, job_id, _) in enumerate(operations) if kind == "progress"}
+        pending_logs = {}
+        now_iso = datetime.now(timezone.utc).isoformat()
+        with conn:
+            for i, (kind, job_id, value) in enumerate(operations):
+                if kind == "progress" and latest_progress[job_id] == i:
+                    conn.execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", (value, now_iso, str(job_id)))
+                elif kind == "status":
+                    conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (value.value, now_iso, str(job_id)))
+                elif kind == "result":
+                    conn.execute("UPDATE jobs SET result = ?, updated_at = ? WHERE id = ?", (json.dumps(value), now_iso, str(job_id)))
+                elif kind == "log":
+                    pending_logs.setdefault(job_id, []).append(value)
+
+            # Look up each job's next sequence number once per batch, then append its lines together
+            for job_id, messages in pending_logs.items():
+                if conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now_iso, str(job_id))).rowcount == 0:
+                    continue
+                last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM job_logs WHERE job_id = ?", (str(job_id),)).fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO job_logs (job_id, seq, ts, level, message) VALUES (?, ?, ?, ?, ?)",
+                    [(str(job_id), last_seq + i, now_iso, level, message) for i, (message, level) in enumerate(messages, start=1)],
+                )
+        if any(kind != "flush" for kind, _, _ in operations):
+            self.commits += 1
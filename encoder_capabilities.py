@@ -0,0 +1,249 @@
+"""
+Cached ffmpeg capabilities: its version, encoders and hardware acceleration methods.
+
+Asking ffmpeg for these costs a process each time, and an encoder the machine can't
+use otherwise only shows up as one failed file after another. CapabilityRegistry runs
+`ffmpeg -version`, `-encoders` and `-hwaccels` once and keeps the answer for ttl
+seconds. Before a batch starts, resolve_settings checks the requested codecs against
+it and, by policy, replaces an unusable video encoder with a CPU encoder of the same
+codec (hevc_nvenc with libx265, h264_qsv with libx264, av1_amf with libsvtav1, ...).
+
+ffmpeg lists the hardware encoders it was built with whether or not the machine has
+the hardware, so a hardware encoder is also tried once on a single generated frame.
+That result is cached like the listing.
+"""
+import dataclasses
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from conversion_logic import CREATE_NO_WINDOW, ConversionSettings, codec_family, resolve_command
+from cpu_allocation import HARDWARE_ENCODER_SUFFIXES
+
+FALLBACK_CPU = "cpu"
+FALLBACK_FAIL = "fail"
+FALLBACK_POLICIES = (FALLBACK_CPU, FALLBACK_FAIL)
+
+DEFAULT_TTL_SECONDS = 600.0
+# A failed probe is retried sooner, so installing ffmpeg doesn't need a restart
+FAILED_PROBE_TTL_SECONDS = 30.0
+PROBE_TIMEOUT_SECONDS = 20.0
+
+# CPU encoders per codec, preferred first
+CPU_ENCODERS = {
+    "h264": ("libx264",),
+    "hevc": ("libx265",),
+    "av1": ("libsvtav1", "libaom-av1", "librav1e"),
+    "vp9": ("libvpx-vp9",),
+    "vp8": ("libvpx",),
+    "mpeg2video": ("mpeg2video",),
+    "mjpeg": ("mjpeg",),
+}
+
+# A single small frame, enough for a hardware encoder to open its device
+TEST_SOURCE = "color=c=black:s=256x144:r=25:d=0.04"
+
+_ENCODER_LINE = re.compile(r"^\s*([VAS])[A-Z.]{5}\s+(\S+)")
+
+
+@dataclass(frozen=True)
+class EncoderCapabilities:
+    """What one ffmpeg build can do, or why it couldn't be asked."""
+    version: str | None
+    encoders: frozenset[str]
+    hwaccels: tuple[str, ...]
+    error: str | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.error is None
+
+
+def encoder_family(encoder: str) -> str | None:
+    """The codec an encoder encodes, including CPU encoders whose names don't say it, such as libx265."""
+    for family, encoders in CPU_ENCODERS.items():
+        if encoder in encoders:
+            return family
+    return codec_family(encoder)
+
+
+def is_hardware_encoder(codec: str) -> bool:
+    return codec.endswith(HARDWARE_ENCODER_SUFFIXES)
+
+
+def parse_encoders(output: str) -> frozenset[str]:
+    """The encoder names in `ffmpeg -encoders` output."""
+    encoders = set()
+    listing = False
+    for line in output.splitlines():
+        if line.strip().startswith("------"):
+            listing = True
+            continue
+        match = _ENCODER_LINE.match(line)
+        if listing and match:
+            encoders.add(match.group(2))
+    return frozenset(encoders)
+
+
+def parse_hwaccels(output: str) -> tuple[str, ...]:
+    """The methods in `ffmpeg -hwaccels` output."""
+    lines = [line.strip() for line in output.splitlines()]
+    if "Hardware acceleration methods:" in lines:
+        lines = lines[lines.index("Hardware acceleration methods:") + 1:]
+    return tuple(line for line in lines if line)
+
+
+def _ffmpeg_output(args: list[str]) -> str:
+    result = subprocess.run(
+        resolve_command(["ffmpeg", *args]),
+        capture_output=True, text=True, check=True, timeout=PROBE_TIMEOUT_SECONDS, creationflags=CREATE_NO_WINDOW,
+    )
+    return result.stdout
+
+
+def probe_capabilities() -> EncoderCapabilities:
+    """Asks ffmpeg for its version, encoders and hardware acceleration methods."""
+    try:
+        version = _ffmpeg_output(["-version"]).splitlines()[0]
+        encoders = parse_encoders(_ffmpeg_output(["-hide_banner", "-encoders"]))
+        hwaccels = parse_hwaccels(_ffmpeg_output(["-hide_banner", "-hwaccels"]))
+    except (OSError, subprocess.SubprocessError, IndexError) as e:
+        return EncoderCapabilities(None, frozenset(), (), error=str(e) or type(e).__name__)
+    return EncoderCapabilities(version, encoders, hwaccels)
+
+
+def try_encoder(codec: str) -> str | None:
+    """
+    Encodes one generated frame with codec.
+
+    Returns:
+        None if that worked, otherwise why not.
+    """
+    command = ["ffmpeg", "-hide_banner", "-v", "error", "-f", "lavfi", "-i", TEST_SOURCE, "-frames:v", "1", "-c:v", codec, "-f", "null", "-"]
+    try:
+        result = subprocess.run(
+            resolve_command(command), capture_output=True, text=True, timeout=PROBE_TIMEOUT_SECONDS, creationflags=CREATE_NO_WINDOW
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        return str(e) or type(e).__name__
+    if result.returncode == 0:
+        return None
+    lines = result.stderr.strip().splitlines()
+    if not lines:
+        return f"ffmpeg exited with code {result.returncode}"
+    # ffmpeg prefixes the encoder's own complaint with its name; the last line is often just "Conversion failed!"
+    return next((line for line in lines if codec in line), lines[-1])
+
+
+class CapabilityRegistry:
+    """
+    The capabilities of the configured ffmpeg, probed on first use and cached for ttl seconds.
+
+    Safe to share between threads; concurrent callers wait for a single probe.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        prober: Callable[[], EncoderCapabilities] = probe_capabilities,
+        encoder_tester: Callable[[str], str | None] = try_encoder,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self._prober = prober
+        self._encoder_tester = encoder_tester
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._capabilities: EncoderCapabilities | None = None
+        self._expires = 0.0
+        self._encoder_checks: dict[str, tuple[str | None, float]] = {}
+        self._test_locks: dict[str, threading.Lock] = {}
+        self.probed_at: float | None = None
+
+    def get(self, refresh: bool = False) -> EncoderCapabilities:
+        """The cached capabilities, probing ffmpeg if there are none yet, they expired or refresh is set."""
+        with self._lock:
+            now = self._clock()
+            if refresh or self._capabilities is None or now >= self._expires:
+                capabilities = self._prober()
+                self._capabilities = capabilities
+                self._expires = now + (self.ttl if capabilities.available else min(self.ttl, FAILED_PROBE_TTL_SECONDS))
+                self._encoder_checks.clear()
+                self.probed_at = time.time()
+            return self._capabilities
+
+    def encoder_error(self, codec: str) -> str | None:
+        """
+        Why codec can't be used with this ffmpeg, or None if it can.
+
+        A codec name such as "h264" rather than an encoder name counts as usable when
+        ffmpeg has any encoder for it, since ffmpeg then picks one itself.
+        """
+        if codec == "copy":
+            return None
+        capabilities = self.get()
+        if codec not in capabilities.encoders:
+            family = encoder_family(codec)
+            if codec == family and any(encoder_family(encoder) == family for encoder in capabilities.encoders):
+                return None
+            return f"this ffmpeg has no {codec} encoder"
+        if not is_hardware_encoder(codec):
+            return None
+
+        with self._lock:
+            test_lock = self._test_locks.setdefault(codec, threading.Lock())
+        # One test per encoder at a time, without holding up callers that only need the listing
+        with test_lock:
+            with self._lock:
+                cached = self._encoder_checks.get(codec)
+                if cached is not None and self._clock() < cached[1]:
+                    return cached[0]
+            error = self._encoder_tester(codec)
+            with self._lock:
+                self._encoder_checks[codec] = (error, self._clock() + self.ttl)
+        return error
+
+    def cpu_fallback(self, codec: str) -> str | None:
+        """The first usable CPU encoder of codec's codec, or None if there is none."""
+        for candidate in CPU_ENCODERS.get(encoder_family(codec), ()):
+            if candidate != codec and self.encoder_error(candidate) is None:
+                return candidate
+        return None
+
+    def resolve_settings(self, settings: ConversionSettings, policy: str = FALLBACK_CPU) -> tuple[ConversionSettings, list[str]]:
+        """
+        Checks a batch's codecs before it starts.
+
+        Args:
+            settings: The batch's settings.
+            policy: FALLBACK_CPU to replace an unusable video encoder with a CPU encoder
+                of the same codec, FALLBACK_FAIL to reject the batch instead.
+
+        Returns:
+            The settings to convert with (with a replacement video codec if one was
+            needed) and notes on what was changed or couldn't be checked, to be logged.
+
+        Raises:
+            ValueError: If a requested codec is unusable and isn't replaced.
+        """
+        if policy not in FALLBACK_POLICIES:
+            raise ValueError(f"Unknown codec fallback policy: {policy}")
+        capabilities = self.get()
+        if not capabilities.available:
+            # Every conversion reports the underlying problem itself
+            return settings, [f"Could not check the available encoders: {capabilities.error}"]
+
+        audio_error = self.encoder_error(settings.audio_codec)
+        if audio_error is not None:
+            raise ValueError(f"Audio codec {settings.audio_codec} is not available: {audio_error}.")
+        video_error = self.encoder_error(settings.video_codec)
+        if video_error is None:
+            return settings, []
+        fallback = self.cpu_fallback(settings.video_codec) if policy == FALLBACK_CPU else None
+        if fallback is None:
+            raise ValueError(f"Video codec {settings.video_codec} is not available: {video_error}.")
+        note = f"Video codec {settings.video_codec} is not available ({video_error}); using {fallback} instead."
+        return dataclasses.replace(settings, video_codec=fallback), [note]
@@ -0,0 +1,140 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+# Standard resolution buckets used to group throughput measurements
+RESOLUTION_BUCKETS = (480, 720, 1080, 1440, 2160, 4320)
+
+
+def resolution_bucket(height: int | None) -> str:
+    """Rounds a frame height up to the nearest standard resolution bucket, e.g. 1080 -> "1080p"."""
+    if not height:
+        return "unknown"
+    for bucket in RESOLUTION_BUCKETS:
+        if height <= bucket:
+            return f"{bucket}p"
+    return f"{RESOLUTION_BUCKETS[-1]}p"
+
+
+@dataclass
+class _FileState:
+    duration: float
+    throughput_class: tuple[str, str]
+    out_time: float = 0.0
+    speed: float | None = None
+    started_at: float | None = None
+
+
+class EtaEstimator:
+    """
+    Estimates the remaining wall-clock time of a batch from media seconds, not file counts.
+
+    Every file contributes its probed duration. Running files use their live encode
+    speed (media seconds per wall second); pending files use the throughput learned
+    so far for their (codec, resolution) class, falling back to the batch-wide average
+    and then to default_speed. The remaining work is spread across the concurrency
+    slots, but the estimate is never shorter than the slowest running file.
+
+    All methods are thread-safe and cheap (independent of the number of pending files),
+    so the estimate can be refreshed continuously.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        default_speed: float = 1.0,
+        smoothing: float = 0.3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.default_speed = default_speed
+        self.smoothing = smoothing
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._files = {}
+        self._pending_seconds = {}
+        self._class_speed = {}
+        self._global_speed = None
+
+    def add_file(self, key: str, duration: float | None, codec: str | None = None, height: int | None = None):
+        """Registers a file that still has to be converted."""
+        throughput_class = (codec or "unknown", resolution_bucket(height))
+        with self._lock:
+            self._files[key] = _FileState(duration=duration or 0.0, throughput_class=throughput_class)
+            self._pending_seconds[throughput_class] = self._pending_seconds.get(throughput_class, 0.0) + (duration or 0.0)
+
+    def start_file(self, key: str):
+        """Marks a file as running."""
+        with self._lock:
+            state = self._files.get(key)
+            if state is None or state.started_at is not None:
+                return
+            state.started_at = self._clock()
+            self._pending_seconds[state.throughput_class] -= state.duration
+
+    def update(self, key: str, out_time: float, speed: float | None = None):
+        """Records live progress of a running file, e.g. from its ffmpeg -progress stream."""
+        with self._lock:
+            state = self._files.get(key)
+            if state is None or state.started_at is None:
+                return
+            state.out_time = out_time
+            if speed:
+                state.speed = speed
+                self._learn(state.throughput_class, speed)
+
+    def finish_file(self, key: str):
+        """Removes a finished (or failed) file and learns from its overall throughput."""
+        with self._lock:
+            state = self._files.pop(key, None)
+            if state is None:
+                return
+            if state.started_at is None:
+                self._pending_seconds[state.throughput_class] -= state.duration
+                return
+            elapsed = self._clock() - state.started_at
+            if elapsed > 0 and state.duration > 0 and state.out_time > 0:
+                self._learn(state.throughput_class, min(state.duration, state.out_time) / elapsed)
+
+    def _learn(self, throughput_class, speed):
+        previous = self._class_speed.get(throughput_class)
+        self._class_speed[throughput_class] = speed if previous is None else previous + self.smoothing * (speed - previous)
+        self._global_speed = speed if self._global_speed is None else self._global_speed + self.smoothing * (speed - self._global_speed)
+
+    def _speed_for(self, throughput_class):
+        return self._class_speed.get(throughput_class) or self._global_speed or self.default_speed
+
+    def aggregate_speed(self) -> float | None:
+        """The summed live encode speed of all running files, or None if none has reported one yet."""
+        with self._lock:
+            speeds = [s.speed for s in self._files.values() if s.started_at is not None and s.speed]
+            return sum(speeds) if speeds else None
+
+    def remaining_media_seconds(self) -> float:
+        """The media seconds still to be encoded across pending and running files."""
+        with self._lock:
+            running = sum(max(0.0, s.duration - s.out_time) for s in self._files.values() if s.started_at is not None)
+            return running + sum(max(0.0, seconds) for seconds in self._pending_seconds.values())
+
+    def eta(self) -> float | None:
+        """
+        Returns the estimated remaining wall-clock seconds, or None if nothing is known yet.
+        """
+        with self._lock:
+            if not self._files:
+                return 0.0
+            longest_running = 0.0
+            slot_seconds = 0.0
+            for state in self._files.values():
+                if state.started_at is None:
+                    continue
+                remaining = max(0.0, state.duration - state.out_time) / (state.speed or self._speed_for(state.throughput_class))
+                longest_running = max(longest_running, remaining)
+                slot_seconds += remaining
+            for throughput_class, seconds in self._pending_seconds.items():
+                if seconds > 0:
+                    slot_seconds += seconds / self._speed_for(throughput_class)
+            if slot_seconds == 0 and self._global_speed is None:
+                return None
+            return max(longest_running, slot_seconds / self.concurrency)
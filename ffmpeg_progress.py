@@ -0,0 +1,171 @@
+import asyncio
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+# Default minimum number of seconds between two published updates for the same file
+DEFAULT_PROGRESS_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class FfmpegProgress:
+    """
+    A snapshot of one ffmpeg process, parsed from its `-progress` stream.
+    """
+    input_file: str
+    out_time: float
+    fps: float | None
+    speed: float | None
+    percent: float | None
+    done: bool = False
+
+
+def _parse_float(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value.strip().rstrip("x"))
+    except ValueError:
+        return None
+
+
+def _parse_out_time(fields: dict) -> float:
+    # out_time_us is the most precise key; out_time_ms is also in microseconds on most builds
+    for key in ("out_time_us", "out_time_ms"):
+        value = _parse_float(fields.get(key))
+        if value is not None and value >= 0:
+            return value / 1_000_000
+    out_time = fields.get("out_time")
+    if out_time and ":" in out_time:
+        try:
+            hours, minutes, seconds = out_time.split(":")
+            return max(0.0, int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+        except ValueError:
+            pass
+    return 0.0
+
+
+class ProgressParser:
+    """
+    Incremental parser for the key=value blocks ffmpeg writes with `-progress`.
+
+    Each block ends with a `progress=continue` or `progress=end` line; feeding that line
+    returns the completed snapshot.
+    """
+
+    def __init__(self, input_file: str, duration: float | None):
+        self.input_file = input_file
+        self.duration = duration
+        self._fields = {}
+
+    def feed(self, line: str) -> FfmpegProgress | None:
+        line = line.strip()
+        if "=" not in line:
+            return None
+        key, value = line.split("=", 1)
+        if key != "progress":
+            self._fields[key] = value
+            return None
+
+        out_time = _parse_out_time(self._fields)
+        percent = None
+        if self.duration:
+            percent = 100.0 if value == "end" else min(100.0, out_time / self.duration * 100)
+        progress = FfmpegProgress(
+            input_file=self.input_file,
+            out_time=out_time,
+            fps=_parse_float(self._fields.get("fps")),
+            speed=_parse_float(self._fields.get("speed")),
+            percent=percent,
+            done=value == "end",
+        )
+        self._fields = {}
+        return progress
+
+
+class ProgressThrottle:
+    """
+    Limits how often progress for a single file is published. The final update is always let through.
+    """
+
+    def __init__(self, interval: float = DEFAULT_PROGRESS_INTERVAL, clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self._clock = clock
+        self._last_emit = None
+
+    def ready(self, progress: FfmpegProgress) -> bool:
+        now = self._clock()
+        if progress.done or self._last_emit is None or now - self._last_emit >= self.interval:
+            self._last_emit = now
+            return True
+        return False
+
+
+def stream_ffmpeg_progress(
+    process: subprocess.Popen,
+    input_file: str,
+    duration: float | None,
+    on_progress: Callable[[FfmpegProgress], None],
+    update_interval: float = DEFAULT_PROGRESS_INTERVAL,
+) -> str:
+    """
+    Reads an ffmpeg process's `-progress pipe:1` output line by line until it exits.
+
+    stderr is drained on a helper thread so a chatty (verbose) ffmpeg can never block
+    on a full pipe while progress is being read.
+
+    Args:
+        process: An ffmpeg process started with progress output on stdout.
+        input_file: The input being converted, used to tag each update.
+        duration: The input's duration in seconds, used for the percentage.
+        on_progress: Called with each throttled progress update.
+        update_interval: The minimum number of seconds between two updates.
+
+    Returns:
+        Everything the process wrote to stderr.
+    """
+    stderr_chunks = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    drain.start()
+
+    parser = ProgressParser(input_file, duration)
+    throttle = ProgressThrottle(update_interval)
+    for line in process.stdout:
+        progress = parser.feed(line)
+        if progress is not None and throttle.ready(progress):
+            on_progress(progress)
+
+    process.wait()
+    drain.join()
+    return "".join(chunk for chunk in stderr_chunks if chunk)
+
+
+async def stream_ffmpeg_progress_async(
+    process: asyncio.subprocess.Process,
+    input_file: str,
+    duration: float | None,
+    on_progress: Callable[[FfmpegProgress], None],
+    update_interval: float = DEFAULT_PROGRESS_INTERVAL,
+) -> str:
+    """
+    The asyncio counterpart of stream_ffmpeg_progress, for processes started with
+    asyncio.create_subprocess_exec. Never blocks the event loop.
+
+    Returns:
+        Everything the process wrote to stderr.
+    """
+    stderr_task = asyncio.create_task(process.stderr.read())
+    parser = ProgressParser(input_file, duration)
+    throttle = ProgressThrottle(update_interval)
+    try:
+        async for line in process.stdout:
+            progress = parser.feed(line.decode(errors="replace"))
+            if progress is not None and throttle.ready(progress):
+                on_progress(progress)
+        await process.wait()
+        stderr = await stderr_task
+    finally:
+        stderr_task.cancel()
+    return stderr.decode(errors="replace")
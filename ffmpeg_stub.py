@@ -0,0 +1,236 @@
+"""
+A stand-in for ffmpeg and ffprobe, for load-testing the orchestration without real encodes.
+
+ffprobe answers with configurable probe JSON (the real file name and size filled in)
+and, for keyframe probes, packets with a keyframe every few seconds. ffmpeg writes the
+`-progress` blocks a real encode would, sleeping so the encode takes its media duration
+divided by the configured speed, then writes a small output file. -version, -encoders
+and -hwaccels are answered too. Like ffmpeg on a machine without a GPU, it lists the
+NVENC encoders but fails to open them, unless FFMPEG_STUB_HARDWARE is set.
+
+Point the converter at it with FFMPEG_PATH and FFPROBE_PATH (stub_command gives the
+values), or set_ffmpeg_executables. The stub is configured through the environment:
+
+    FFMPEG_STUB_PROBE             Probe JSON, or the path of a file holding it.
+    FFMPEG_STUB_DURATION          Media seconds of every input (default 60).
+    FFMPEG_STUB_BYTES_PER_SECOND  If set, an input's duration is its size divided by this instead.
+    FFMPEG_STUB_SPEED             Media seconds encoded per wall second (default 100).
+    FFMPEG_STUB_STATS_PERIOD      Wall seconds between progress blocks (default 0.5).
+    FFMPEG_STUB_FAIL              Inputs whose path contains this fail to probe and encode.
+    FFMPEG_STUB_OUTPUT_BYTES      Size of the files ffmpeg writes (default 1024).
+    FFMPEG_STUB_HARDWARE          If set, the hardware encoders work.
+
+Usage:
+    python ffmpeg_stub.py ffmpeg|ffprobe [arguments]
+"""
+import json
+import math
+import os
+import shlex
+import sys
+import time
+
+DEFAULT_DURATION = 60.0
+DEFAULT_SPEED = 100.0
+DEFAULT_STATS_PERIOD = 0.5
+DEFAULT_OUTPUT_BYTES = 1024
+FRAME_RATE = 30.0
+KEYFRAME_INTERVAL = 2.0
+
+DEFAULT_PROBE = {
+    "format": {"format_name": "matroska,webm", "start_time": "0.000000", "bit_rate": "8000000"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080, "bit_rate": "7800000",
+         "disposition": {"default": 1}},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "channels": 2, "bit_rate": "192000",
+         "tags": {"language": "eng"}, "disposition": {"default": 1}},
+    ],
+}
+
+ENCODERS = ("libx264", "libx265", "libsvtav1", "libvpx-vp9", "h264_nvenc", "hevc_nvenc", "av1_nvenc", "aac", "libopus")
+HARDWARE_ENCODERS = ("h264_nvenc", "hevc_nvenc", "av1_nvenc")
+# Codec names ffmpeg resolves to one of its encoders itself
+CODEC_NAMES = ("h264", "hevc", "av1")
+
+
+def stub_command(tool: str) -> str:
+    """The command line that runs this stub as tool ("ffmpeg" or "ffprobe"), for FFMPEG_PATH and FFPROBE_PATH."""
+    return shlex.join([sys.executable, os.path.abspath(__file__), tool])
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _fails(path: str | None) -> bool:
+    pattern = os.environ.get("FFMPEG_STUB_FAIL")
+    return bool(pattern and path and pattern in path)
+
+
+def media_duration(path: str) -> float:
+    """The duration the stub reports for an input."""
+    bytes_per_second = _env_float("FFMPEG_STUB_BYTES_PER_SECOND", 0.0)
+    if bytes_per_second > 0:
+        try:
+            return max(1.0, os.path.getsize(path) / bytes_per_second)
+        except OSError:
+            pass
+    return _env_float("FFMPEG_STUB_DURATION", DEFAULT_DURATION)
+
+
+def probe_data(path: str) -> dict:
+    """The probe JSON for an input: the configured template with its name, size and duration."""
+    template = os.environ.get("FFMPEG_STUB_PROBE")
+    if template and os.path.isfile(template):
+        with open(template, encoding="utf-8") as f:
+            data = json.load(f)
+    elif template:
+        data = json.loads(template)
+    else:
+        data = json.loads(json.dumps(DEFAULT_PROBE))
+    fmt = data.setdefault("format", {})
+    fmt["filename"] = path
+    fmt.setdefault("duration", f"{media_duration(path):.6f}")
+    try:
+        fmt["size"] = str(os.path.getsize(path))
+    except OSError:
+        pass
+    return data
+
+
+def _option(args: list[str], name: str) -> str | None:
+    value = None
+    for i, arg in enumerate(args[:-1]):
+        if arg == name:
+            value = args[i + 1]
+    return value
+
+
+def _keyframe_packets(intervals: str, duration: float) -> list[dict]:
+    packets = []
+    for interval in intervals.split(","):
+        start, _, length = interval.partition("%+")
+        try:
+            start, length = float(start or 0), float(length or duration)
+        except ValueError:
+            continue
+        time_ = math.ceil(start / KEYFRAME_INTERVAL) * KEYFRAME_INTERVAL
+        while time_ <= min(start + length, duration):
+            packets.append({"pts_time": f"{time_:.6f}", "flags": "K__"})
+            time_ += KEYFRAME_INTERVAL
+    return packets
+
+
+def ffprobe(args: list[str]) -> int:
+    path = args[-1] if args else None
+    if not path or _fails(path) or not os.path.exists(path):
+        print(f"{path}: No such file or directory" if path else "No input specified", file=sys.stderr)
+        return 1
+    intervals = _option(args, "-read_intervals")
+    if intervals is not None:
+        data = {"packets": _keyframe_packets(intervals, media_duration(path))}
+    else:
+        data = probe_data(path)
+    print(json.dumps(data))
+    return 0
+
+
+def _format_time(seconds: float) -> str:
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:09.6f}"
+
+
+def _info(args: list[str]) -> int | None:
+    # Answers the informational options ffmpeg handles without an input
+    if "-version" in args:
+        print("ffmpeg version stub Copyright (c) the ffmpeg_stub authors\nbuilt for load tests")
+        return 0
+    if "-encoders" in args:
+        print("Encoders:\n V..... = Video\n A..... = Audio\n ------")
+        for encoder in ENCODERS:
+            kind = "A" if encoder in ("aac", "libopus") else "V"
+            print(f" {kind}..... {encoder:<20} stub {encoder}")
+        return 0
+    if "-hwaccels" in args:
+        print("Hardware acceleration methods:\ncuda")
+        return 0
+    return None
+
+
+def ffmpeg(args: list[str]) -> int:
+    info = _info(args)
+    if info is not None:
+        return info
+    inputs = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == "-i"]
+    if not inputs or any(_fails(path) for path in inputs):
+        print(f"{inputs[0] if inputs else 'No input'}: Invalid data found when processing input", file=sys.stderr)
+        return 1
+    for codec in (_option(args, "-c:v"), _option(args, "-c:v:0")):
+        if codec is None or codec == "copy" or codec in CODEC_NAMES:
+            continue
+        if codec not in ENCODERS:
+            print(f"Unknown encoder '{codec}'", file=sys.stderr)
+            return 1
+        if codec in HARDWARE_ENCODERS and not os.environ.get("FFMPEG_STUB_HARDWARE"):
+            print(f"[{codec} @ 0x0] Cannot load libcuda.so.1\nError while opening encoder - maybe incorrect parameters", file=sys.stderr)
+            return 1
+    source = inputs[-1]
+    if source.endswith(".txt") or not os.path.exists(source):
+        source = inputs[0]
+
+    # Encode as much media as a real run would: from -ss, for -t or -frames:v or to the end of the input
+    start = float(_option(args, "-ss") or 0)
+    length = _option(args, "-t")
+    frames = _option(args, "-frames:v")
+    if frames:
+        duration = int(frames) / FRAME_RATE
+    else:
+        duration = float(length) if length else max(0.0, media_duration(source) - start)
+    speed = _env_float("FFMPEG_STUB_SPEED", DEFAULT_SPEED)
+    period = _env_float("FFMPEG_STUB_STATS_PERIOD", DEFAULT_STATS_PERIOD)
+    progress = sys.stdout if _option(args, "-progress") in ("pipe:1", "-") else None
+
+    started = time.monotonic()
+    wall_seconds = duration / speed if speed > 0 else 0.0
+    while True:
+        elapsed = time.monotonic() - started
+        done = elapsed >= wall_seconds
+        out_time = duration if done else elapsed * speed
+        if progress is not None:
+            frame = int(out_time * FRAME_RATE)
+            progress.write(
+                f"frame={frame}\nfps={frame / elapsed if elapsed else 0:.2f}\nbitrate=N/A\n"
+                f"out_time_us={int(out_time * 1_000_000)}\nout_time_ms={int(out_time * 1_000_000)}\n"
+                f"out_time={_format_time(out_time)}\nspeed={speed:.3g}x\nprogress={'end' if done else 'continue'}\n"
+            )
+            progress.flush()
+        if done:
+            break
+        time.sleep(min(period, wall_seconds - elapsed))
+
+    output = args[-1]
+    lavfi = _option(args, "-lavfi") or ""
+    if "ssim" in lavfi:
+        print("[Parsed_ssim_0 @ 0x0] SSIM Y:0.970 U:0.980 V:0.980 All:0.973000 (15.7)", file=sys.stderr)
+    elif "psnr" in lavfi:
+        print("[Parsed_psnr_0 @ 0x0] PSNR y:42.0 u:44.0 v:44.0 average:42.500000 min:38.0 max:50.0", file=sys.stderr)
+    if output not in ("-", os.devnull) and _option(args, "-f") != "null":
+        with open(output, "wb") as f:
+            f.write(b"\0" * int(_env_float("FFMPEG_STUB_OUTPUT_BYTES", DEFAULT_OUTPUT_BYTES)))
+    return 0
+
+
+def main(argv: list[str]) -> int:
+    if not argv or argv[0] not in ("ffmpeg", "ffprobe"):
+        print(__doc__.strip().splitlines()[-1], file=sys.stderr)
+        return 2
+    tool, args = argv[0], argv[1:]
+    return ffprobe(args) if tool == "ffprobe" else ffmpeg(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,255 @@
+"""
+Persistent index of finished conversions, keyed by the content of the input.
+
+A file's fingerprint is its size plus a hash of a few sampled blocks, so it is cheap to
+compute and doesn't change when the file is renamed or moved. Each finished conversion
+is recorded under the input's fingerprint and the conversion parameters, which lets a
+later batch skip inputs whose identical conversion already exists, wherever the input
+now lives.
+
+Other results that only depend on an input's content, such as the bitrates found by
+quality_calibration, are cached under the same fingerprints.
+
+Lookups stay cheap on large libraries: an input whose size matches no recorded
+conversion is rejected from an index without reading the file, and fingerprints of
+files that were hashed before are reused while their size, mtime and inode are unchanged.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import metrics
+
+# The index lives next to the job database in the 'data' subdirectory
+INDEX_PATH = Path("data")
+INDEX_FILE = INDEX_PATH / "fingerprint_index.db"
+
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 4
+
+
+def fingerprint_file(path: str, block_size: int = SAMPLE_BLOCK_SIZE, blocks: int = SAMPLE_BLOCKS) -> str:
+    """
+    Computes a fast content fingerprint of a file.
+
+    Hashes the file size and `blocks` evenly spaced blocks (always including the first
+    and the last), or the whole file if it is smaller than that.
+
+    Args:
+        path: The file to fingerprint.
+        block_size: The size of each sampled block in bytes.
+        blocks: The number of sampled blocks, at least 2.
+
+    Returns:
+        The fingerprint as a hex string.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(size.to_bytes(8, "little"))
+        if size <= block_size * blocks:
+            digest.update(f.read())
+        else:
+            last = size - block_size
+            for i in range(blocks):
+                f.seek(last * i // (blocks - 1))
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def params_key(params: dict) -> str:
+    """A stable key for a set of conversion parameters."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class FingerprintIndex:
+    """
+    Maps (input fingerprint, conversion parameters) to the output that conversion produced.
+
+    An output that has been deleted or changed since it was recorded no longer counts
+    and its entry is dropped on lookup. The index is safe to share between threads.
+    """
+
+    def __init__(self, db_file: str | Path = INDEX_FILE):
+        db_file = Path(db_file)
+        if str(db_file) != ":memory:":
+            db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversions (
+            fingerprint TEXT NOT NULL,
+            params TEXT NOT NULL,
+            input_size INTEGER NOT NULL,
+            output_path TEXT NOT NULL,
+            output_size INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (fingerprint, params)
+        ) WITHOUT ROWID
+        """)
+        # Lets inputs of a size that was never converted be rejected without reading them
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_conversions_input_size ON conversions (input_size)")
+        # Fingerprints already computed, validated like the probe cache; the inode finds renamed files
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS file_fingerprints (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_file_fingerprints_inode ON file_fingerprints (inode, size, mtime_ns)")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS calibrations (
+            fingerprint TEXT NOT NULL,
+            params TEXT NOT NULL,
+            bitrate TEXT NOT NULL,
+            score REAL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (fingerprint, params)
+        ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    def fingerprint(self, path: str, stat_result: os.stat_result | None = None) -> str:
+        """
+        Returns the fingerprint of a file, reusing the stored one while the file is unchanged.
+
+        Raises:
+            OSError: If the file can't be read.
+        """
+        path = os.path.abspath(path)
+        stat_result = stat_result or os.stat(path)
+        key = (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, fingerprint FROM file_fingerprints WHERE path = ?", (path,)
+            ).fetchone()
+            if row is not None and tuple(row[:3]) == key:
+                return row[3]
+            row = None
+            if stat_result.st_ino:
+                # A rename or move within the file system keeps the inode and the mtime
+                row = self._conn.execute(
+                    "SELECT fingerprint FROM file_fingerprints WHERE inode = ? AND size = ? AND mtime_ns = ? LIMIT 1",
+                    (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns),
+                ).fetchone()
+        fingerprint = row[0] if row is not None else fingerprint_file(path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_fingerprints (path, size, mtime_ns, inode, fingerprint) VALUES (?, ?, ?, ?, ?)",
+                (path, *key, fingerprint),
+            )
+            self._conn.commit()
+        return fingerprint
+
+    def lookup(self, input_file: str, params: dict) -> str | None:
+        """
+        Finds an existing output of the same conversion of the same content.
+
+        Args:
+            input_file: The input file, under any name.
+            params: The conversion parameters, e.g. conversion_logic.conversion_params(settings).
+
+        Returns:
+            The path of the output, or None if this conversion hasn't been done (or its
+            output is gone).
+        """
+        try:
+            stat_result = os.stat(input_file)
+        except OSError:
+            return None
+        with self._lock:
+            known_size = self._conn.execute(
+                "SELECT 1 FROM conversions WHERE input_size = ? LIMIT 1", (stat_result.st_size,)
+            ).fetchone()
+        if known_size is None:
+            return None
+
+        try:
+            fingerprint = self.fingerprint(input_file, stat_result)
+        except OSError:
+            return None
+        key = params_key(params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output_path, output_size FROM conversions WHERE fingerprint = ? AND params = ?", (fingerprint, key)
+            ).fetchone()
+            if row is None:
+                return None
+            output_path, output_size = row
+            try:
+                valid = os.path.getsize(output_path) == output_size
+            except OSError:
+                valid = False
+            if not valid:
+                self._conn.execute("DELETE FROM conversions WHERE fingerprint = ? AND params = ?", (fingerprint, key))
+                self._conn.commit()
+                return None
+        return output_path
+
+    def record(self, input_file: str, params: dict, output_file: str):
+        """
+        Records that converting input_file with params produced output_file.
+
+        Must be called while the input still exists, i.e. before it is deleted.
+
+        Raises:
+            OSError: If the input or the output can't be read.
+        """
+        stat_result = os.stat(input_file)
+        fingerprint = self.fingerprint(input_file, stat_result)
+        output_size = os.path.getsize(output_file)
+        with self._lock, metrics.stage(metrics.STAGE_DB_WRITE):
+            self._conn.execute("""
+                INSERT OR REPLACE INTO conversions (fingerprint, params, input_size, output_path, output_size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (fingerprint, params_key(params), stat_result.st_size, os.path.abspath(output_file), output_size, int(time.time())))
+            self._conn.commit()
+
+    def get_calibration(self, input_file: str, params: dict) -> tuple[str, float | None] | None:
+        """
+        The calibrated bitrate and its quality score stored for the input's content, if any.
+
+        Raises:
+            OSError: If the input can't be read.
+        """
+        fingerprint = self.fingerprint(input_file)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT bitrate, score FROM calibrations WHERE fingerprint = ? AND params = ?", (fingerprint, params_key(params))
+            ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def record_calibration(self, input_file: str, params: dict, bitrate: str, score: float | None):
+        """
+        Stores the calibrated bitrate of the input's content for the given calibration parameters.
+
+        Raises:
+            OSError: If the input can't be read.
+        """
+        fingerprint = self.fingerprint(input_file)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calibrations (fingerprint, params, bitrate, score, created_at) VALUES (?, ?, ?, ?, ?)",
+                (fingerprint, params_key(params), bitrate, score, int(time.time())),
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
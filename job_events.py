@@ -0,0 +1,167 @@
+"""
+In-process publish/subscribe for job events, streamed to API clients over SSE or WebSocket.
+
+Every job has a channel with a bounded history of its recent events. Events are
+numbered per job, so a client that reconnects with the last ID it saw resumes
+exactly where it left off. Each subscriber has a bounded queue: a consumer that
+falls behind doesn't hold up the publisher or grow memory, it is switched to
+catching up from the history instead (or, once that has moved on, to a snapshot
+of the job's latest state).
+"""
+import asyncio
+import collections
+import json
+import uuid
+from dataclasses import dataclass, field
+
+DEFAULT_HISTORY_SIZE = 1000
+DEFAULT_SUBSCRIBER_BUFFER = 256
+DEFAULT_RETAINED_JOBS = 256
+
+EVENT_STATUS = "status"
+EVENT_PROGRESS = "progress"
+EVENT_FILE_PROGRESS = "file_progress"
+EVENT_LOG = "log"
+# Sent instead of events that are no longer in the history
+EVENT_SNAPSHOT = "snapshot"
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+@dataclass(frozen=True)
+class JobEvent:
+    """One event of a job, numbered from 1 in publish order."""
+    id: int
+    type: str
+    data: dict
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "event": self.type, "data": self.data}
+
+
+class _Subscriber:
+    def __init__(self, buffer_size: int):
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+
+@dataclass
+class _Channel:
+    history: collections.deque
+    last_id: int = 0
+    finished: bool = False
+    state: dict = field(default_factory=dict)
+    subscribers: set = field(default_factory=set)
+
+
+class JobEventBus:
+    """
+    Fans job events out to any number of subscribers without touching the database.
+
+    Must be used from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        history_size: int = DEFAULT_HISTORY_SIZE,
+        subscriber_buffer: int = DEFAULT_SUBSCRIBER_BUFFER,
+        retained_jobs: int = DEFAULT_RETAINED_JOBS,
+    ):
+        self.history_size = history_size
+        self.subscriber_buffer = subscriber_buffer
+        self.retained_jobs = retained_jobs
+        self._channels: collections.OrderedDict[uuid.UUID, _Channel] = collections.OrderedDict()
+
+    def open(self, job_id: uuid.UUID):
+        """Creates the channel of a new job."""
+        self._channels[job_id] = _Channel(history=collections.deque(maxlen=self.history_size))
+        self._evict()
+
+    def _evict(self):
+        # Keep the history of recently finished jobs for late subscribers, but not forever
+        finished = [job_id for job_id, channel in self._channels.items() if channel.finished and not channel.subscribers]
+        for job_id in finished[:max(0, len(finished) - self.retained_jobs)]:
+            del self._channels[job_id]
+
+    def __contains__(self, job_id: uuid.UUID) -> bool:
+        return job_id in self._channels
+
+    def is_finished(self, job_id: uuid.UUID, last_event_id: int = 0) -> bool:
+        """Whether the job has finished and every event up to last_event_id has been delivered."""
+        channel = self._channels[job_id]
+        return channel.finished and last_event_id >= channel.last_id
+
+    def publish(self, job_id: uuid.UUID, event_type: str, data: dict) -> JobEvent | None:
+        """Publishes an event to the job's subscribers. Events of unknown jobs are dropped."""
+        channel = self._channels.get(job_id)
+        if channel is None:
+            return None
+        channel.last_id += 1
+        event = JobEvent(channel.last_id, event_type, data)
+        channel.history.append(event)
+        if event_type in (EVENT_STATUS, EVENT_PROGRESS):
+            channel.state.update(data)
+        if event_type == EVENT_STATUS and data.get("status") in TERMINAL_STATUSES:
+            channel.finished = True
+            self._evict()
+
+        for subscriber in channel.subscribers:
+            if subscriber.overflowed:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Stop queueing; the subscriber catches up from the history instead
+                subscriber.overflowed = True
+        return event
+
+    def _catch_up(self, channel: _Channel, cursor: int) -> list[JobEvent]:
+        if cursor >= channel.last_id:
+            return []
+        if not channel.history or channel.history[0].id > cursor + 1:
+            # Some events after the cursor are gone; summarise instead of replaying a partial history
+            return [JobEvent(channel.last_id, EVENT_SNAPSHOT, dict(channel.state))]
+        return [event for event in channel.history if event.id > cursor]
+
+    async def subscribe(self, job_id: uuid.UUID, last_event_id: int = 0, keepalive: float | None = None):
+        """
+        Yields the job's events after last_event_id, then live events until the job finishes.
+
+        If keepalive is given, None is yielded whenever no event arrived for that many
+        seconds, so the caller can keep an idle connection open.
+
+        Raises:
+            KeyError: If the bus has no channel for the job.
+        """
+        channel = self._channels[job_id]
+        subscriber = _Subscriber(self.subscriber_buffer)
+        channel.subscribers.add(subscriber)
+        cursor = last_event_id
+        catching_up = True
+        try:
+            while True:
+                if catching_up or subscriber.overflowed:
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.overflowed = False
+                    catching_up = False
+                    # Subscribed before replaying, so nothing published meanwhile can be missed
+                    for event in self._catch_up(channel, cursor):
+                        cursor = event.id
+                        yield event
+                if channel.finished and cursor >= channel.last_id:
+                    return
+
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event.id > cursor and not subscriber.overflowed:
+                    cursor = event.id
+                    yield event
+        finally:
+            channel.subscribers.discard(subscriber)
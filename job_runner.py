@@ -0,0 +1,293 @@
+"""
+Runs API conversion jobs on the asyncio event loop.
+
+ffmpeg is started with asyncio.create_subprocess_exec and its progress is read
+asynchronously, so any number of jobs and API clients share one event loop. The
+blocking parts (probing, SQLite reads, file deletion) run in worker threads, and
+job updates are queued to a database.JobWriter that group-commits them. A
+global semaphore caps the number of ffmpeg processes across all jobs at
+MAX_CONCURRENT_JOBS; each job can ask for fewer with its own concurrency.
+
+Everything written to the jobs table is also published on a JobEventBus, together
+with per-file progress, so API clients can follow a job without polling the database.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import structlog
+
+import database
+import metrics
+from conversion_logic import (
+    ACTION_ENCODE,
+    ACTION_SKIP,
+    BITRATE_TARGET_QUALITY,
+    CREATE_NO_WINDOW,
+    ConversionPlan,
+    ConversionSettings,
+    PassthroughReport,
+    build_plan_command,
+    finalize_output,
+    load_optimized_bitrate_map,
+    plan_conversions,
+    prepare_ffmpeg_command,
+    remove_partial_output,
+    temp_output_path,
+)
+from cpu_allocation import CpuAllocator
+from fingerprint_index import FingerprintIndex
+from ffmpeg_progress import FfmpegProgress, stream_ffmpeg_progress_async
+from job_events import EVENT_FILE_PROGRESS, EVENT_LOG, EVENT_PROGRESS, EVENT_STATUS, JobEventBus
+from quality_calibration import calibrate_plan
+from schemas import JobStatus
+
+log = structlog.get_logger()
+
+# The optimized bitrate map is module state in conversion_logic, so jobs plan one at a time
+_planning_lock = threading.Lock()
+
+
+def _plan_job(video_files: list[str], settings: ConversionSettings) -> list[ConversionPlan]:
+    with _planning_lock:
+        load_optimized_bitrate_map(settings.quality_profile)
+        return plan_conversions(video_files, settings)
+
+
+@asynccontextmanager
+async def _conversion_slot(*semaphores: asyncio.Semaphore):
+    """Holds every semaphore for the block, counting the wait for them as queue wait."""
+    started = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        with metrics.QUEUE_DEPTH.track():
+            for semaphore in semaphores:
+                await stack.enter_async_context(semaphore)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage=metrics.STAGE_QUEUE_WAIT)
+        yield
+
+
+async def run_db(func, *args):
+    """Calls a database function in a worker thread, with that thread's connection."""
+    return await asyncio.to_thread(lambda: func(database.get_thread_connection(), *args))
+
+
+class JobProgress:
+    """
+    Overall progress of a job, weighted by each file's duration.
+
+    Files with an unknown duration count as an average file.
+    """
+
+    def __init__(self, plans: list[ConversionPlan]):
+        known = [p.estimated_duration for p in plans if p.estimated_duration]
+        default_weight = sum(known) / len(known) if known else 1.0
+        self._weights = {p.input_file: p.estimated_duration or default_weight for p in plans}
+        self._total = sum(self._weights.values())
+        self._fractions = {}
+
+    def update(self, input_file: str, fraction: float):
+        self._fractions[input_file] = min(1.0, max(0.0, fraction))
+
+    def percent(self) -> float:
+        if not self._total:
+            return 100.0
+        done = sum(self._weights[f] * fraction for f, fraction in self._fractions.items())
+        return round(100.0 * done / self._total, 2)
+
+
+class JobRunner:
+    """
+    Runs conversion jobs as asyncio tasks, keeping the jobs table up to date.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_jobs: int,
+        progress_interval: float = 1.0,
+        events: JobEventBus | None = None,
+        writer: database.JobWriter | None = None,
+        calibration_cache: FingerprintIndex | None = None,
+    ):
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.progress_interval = progress_interval
+        self.events = events or JobEventBus()
+        self._owns_writer = writer is None
+        self.writer = writer or database.JobWriter()
+        self.cpu_allocator = CpuAllocator(expected_encodes=self.max_concurrent_jobs)
+        # Opened on the first target-quality job
+        self.calibration_cache = calibration_cache
+        self._slots = asyncio.Semaphore(self.max_concurrent_jobs)
+        self._tasks: set[asyncio.Task] = set()
+        self.active_processes = 0
+
+    def submit(self, job_id: uuid.UUID, video_files: list[str], settings: ConversionSettings, concurrent_conversions: int) -> asyncio.Task:
+        """Starts a job in the background and returns its task."""
+        self.events.open(job_id)
+        task = asyncio.create_task(self._run_job(job_id, video_files, settings, concurrent_conversions))
+        # The event loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def shutdown(self):
+        """Cancels all running jobs and waits for them to record their final state."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._owns_writer:
+            await asyncio.to_thread(self.writer.close)
+
+    def _log(self, job_id, message: str, level: str = "info"):
+        self.events.publish(job_id, EVENT_LOG, {"message": message, "level": level})
+        self.writer.log(job_id, message, level)
+
+    def _set_status(self, job_id, status: JobStatus):
+        self.writer.update_status(job_id, status)
+        self.events.publish(job_id, EVENT_STATUS, {"status": status.value})
+
+    async def _run_job(self, job_id, video_files, settings, concurrent_conversions):
+        structlog.contextvars.bind_contextvars(job_id=str(job_id))
+        publisher = None
+        # Worker threads can't be cancelled like tasks; calibrations check this between trials
+        cancel_event = threading.Event()
+        try:
+            self._set_status(job_id, JobStatus.IN_PROGRESS)
+            self._log(job_id, f"Found {len(video_files)} video files to convert.")
+            plans = await asyncio.to_thread(_plan_job, video_files, settings)
+            report = PassthroughReport()
+            for plan in plans:
+                report.add_plan(plan)
+                if plan.action != ACTION_ENCODE:
+                    verb = "Skipping" if plan.action == ACTION_SKIP else "Remuxing"
+                    self._log(job_id, f"{verb} {os.path.basename(plan.input_file)} instead of re-encoding: {plan.reason}.")
+            plans = [plan for plan in plans if plan.action != ACTION_SKIP]
+
+            progress = JobProgress(plans)
+            publisher = asyncio.create_task(self._publish_progress(job_id, progress))
+            job_slots = asyncio.Semaphore(max(1, concurrent_conversions))
+            results = await asyncio.gather(*(self._convert(job_id, plan, settings, job_slots, progress, cancel_event) for plan in plans))
+            for plan, result in zip(plans, results):
+                if result["success"] and plan.action == ACTION_ENCODE:
+                    report.add_encode(plan.estimated_duration, result.get("cpu_seconds"))
+            summary = report.describe()
+            if summary:
+                self._log(job_id, summary)
+
+            failed = [r for r in results if not r["success"]]
+            self.writer.update_result(job_id, [r["output_filepath"] for r in results if r["success"]])
+            self.writer.update_progress(job_id, progress.percent())
+            self.events.publish(job_id, EVENT_PROGRESS, {"progress": progress.percent()})
+            status = JobStatus.FAILED if failed else JobStatus.COMPLETED
+            self._log(job_id, f"Job finished: {len(results) - len(failed)} converted, {len(failed)} failed.")
+            self._set_status(job_id, status)
+            log.info("Job finished", status=status.value, converted=len(results) - len(failed), failed=len(failed))
+        except asyncio.CancelledError:
+            self._log(job_id, "Job was interrupted.", "warning")
+            self._set_status(job_id, JobStatus.FAILED)
+            log.warning("Job interrupted")
+            raise
+        except Exception as e:
+            log.exception("Job failed")
+            self._log(job_id, f"Job failed: {e}", "error")
+            self._set_status(job_id, JobStatus.FAILED)
+        finally:
+            cancel_event.set()
+            if publisher is not None:
+                publisher.cancel()
+
+    async def _publish_progress(self, job_id, progress: JobProgress):
+        # Sampled at a fixed interval, so fast ffmpeg updates never pile up database writes
+        published = None
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            percent = progress.percent()
+            if percent != published:
+                self.writer.update_progress(job_id, percent)
+                self.events.publish(job_id, EVENT_PROGRESS, {"progress": percent})
+                published = percent
+
+    async def _convert(
+        self, job_id, plan: ConversionPlan, settings: ConversionSettings, job_slots, progress: JobProgress, cancel_event: threading.Event,
+    ) -> dict:
+        name = os.path.basename(plan.input_file)
+        async with _conversion_slot(job_slots, self._slots):
+            if plan.action == ACTION_ENCODE and settings.video_bitrate == BITRATE_TARGET_QUALITY:
+                if self.calibration_cache is None:
+                    self.calibration_cache = FingerprintIndex()
+                plan, calibration = await asyncio.to_thread(calibrate_plan, plan, settings, self.calibration_cache, cancel_event, self.cpu_allocator)
+                self._log(job_id, f"Calibrated bitrate for {name}: {calibration.describe()}.")
+            self._log(job_id, f"Converting {name} to {os.path.basename(plan.output_filepath)} (bitrate {plan.target_bitrate}).")
+            started = time.monotonic()
+            result = await self._run_ffmpeg(job_id, plan, settings, progress)
+            metrics.record_conversion(plan, result, time.monotonic() - started, plan.action == ACTION_ENCODE)
+
+        if result["success"]:
+            progress.update(plan.input_file, 1.0)
+            self._log(job_id, f"Successfully converted {name} to {result['output_filepath']}.", "success")
+            if settings.delete_input:
+                try:
+                    with metrics.stage(metrics.STAGE_DELETE_INPUT):
+                        await asyncio.to_thread(os.remove, plan.input_file)
+                    self._log(job_id, f"Deleted input file: {name}")
+                except OSError as e:
+                    self._log(job_id, f"Error deleting file {name}: {e}", "error")
+        else:
+            self._log(job_id, f"Error converting {name}: {result['error']}", "error")
+            log.error("Conversion failed", input_file=plan.input_file, error=result["error"])
+        return result
+
+    async def _run_ffmpeg(self, job_id, plan: ConversionPlan, settings: ConversionSettings, progress: JobProgress) -> dict:
+        def on_progress(update: FfmpegProgress):
+            if update.percent is not None:
+                progress.update(plan.input_file, update.percent / 100)
+            self.events.publish(job_id, EVENT_FILE_PROGRESS, {
+                "input_file": update.input_file,
+                "percent": update.percent,
+                "out_time": update.out_time,
+                "fps": update.fps,
+                "speed": update.speed,
+            })
+
+        result = {"success": False, "output_filepath": plan.output_filepath, "stderr": ""}
+        started = asyncio.get_running_loop().time()
+        temp_path = temp_output_path(plan.output_filepath)
+        allocation_key = f"{job_id}:{plan.input_file}"
+        allocation = self.cpu_allocator.acquire(allocation_key)
+        try:
+            command = prepare_ffmpeg_command(build_plan_command(plan, settings, allocation.threads, temp_path), settings.verbose_logging, progress=True)
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    creationflags=CREATE_NO_WINDOW,
+                )
+            except OSError as e:
+                result["error"] = f"Could not start ffmpeg: {e}"
+                return result
+
+            self.cpu_allocator.attach(allocation_key, process.pid)
+            self.active_processes += 1
+            try:
+                with metrics.stage(metrics.STAGE_ENCODE if plan.action == ACTION_ENCODE else metrics.STAGE_REMUX), metrics.ACTIVE_PROCESSES.track():
+                    result["stderr"] = await stream_ffmpeg_progress_async(
+                        process, plan.input_file, plan.estimated_duration, on_progress, settings.progress_interval
+                    )
+            finally:
+                self.active_processes -= 1
+                if process.returncode is None:
+                    process.kill() # Cancelled while ffmpeg was running
+                    await process.wait()
+                    remove_partial_output(temp_path)
+        finally:
+            self.cpu_allocator.release(allocation_key)
+
+        result["cpu_seconds"] = (asyncio.get_running_loop().time() - started) * allocation.threads
+        if process.returncode == 0:
+            result["success"] = True
+        else:
+            result["error"] = result["stderr"].strip() or f"ffmpeg exited with code {process.returncode}"
+        return await asyncio.to_thread(finalize_output, result, temp_path)
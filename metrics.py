@@ -0,0 +1,275 @@
+"""
+Lightweight in-process metrics: counters, gauges and histograms with labels.
+
+The stages of a conversion (probing, waiting for a slot, calibration, encoding,
+verifying the output, deleting the input, database writes) are timed with stage()
+into one histogram, next to the encode speed, bytes in and out, conversions by result
+and failures by reason, and the number of running ffmpeg processes and queued files.
+Everything lives in the process doing the work: the API serves it at GET /metrics in
+the Prometheus text format, and the GUI logs a per-stage summary after each batch.
+
+Recording a sample takes a lock and a few additions, so the instrumentation is always on.
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STAGE_PROBE = "probe"
+STAGE_QUEUE_WAIT = "queue_wait"
+STAGE_CALIBRATE = "calibrate"
+STAGE_ENCODE = "encode"
+STAGE_REMUX = "remux"
+STAGE_CONCAT = "concat"
+STAGE_VERIFY = "verify"
+STAGE_DELETE_INPUT = "delete_input"
+STAGE_DB_WRITE = "db_write"
+
+RESULT_SUCCESS = "success"
+RESULT_FAILED = "failed"
+RESULT_CANCELLED = "cancelled"
+
+# Seconds, from a database commit up to a long encode
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+# Media seconds per wall second
+SPEED_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} takes the labels {self.label_names}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _label_text(self, key: tuple[str, ...], extra: dict | None = None) -> str:
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items) -> list[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    """A value that only goes up, such as a number of conversions or bytes written."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as the number of running processes."""
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Counts one more while the block runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Counts observations into buckets, with their count and sum."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = STAGE_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one above every bound), then sum and count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def summary(self, **labels) -> tuple[int, float]:
+        """The number and sum of the observations."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return (entry[2], entry[1]) if entry else (0, 0.0)
+
+    def series(self) -> dict[tuple[str, ...], tuple[int, float]]:
+        """The number and sum of the observations for every set of labels seen."""
+        with self._lock:
+            return {key: (entry[2], entry[1]) for key, entry in self._values.items()}
+
+    def _render_samples(self, items) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._label_text(key, {'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = STAGE_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def clear(self):
+        """Drops every recorded value, e.g. between tests."""
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("converter_stage_seconds", "Time spent in each stage of a conversion.", ("stage",))
+ENCODE_SPEED = REGISTRY.histogram(
+    "converter_encode_speed_ratio", "Media seconds encoded per wall second, per converted file.", buckets=SPEED_BUCKETS
+)
+INPUT_BYTES = REGISTRY.counter("converter_input_bytes_total", "Bytes of input converted successfully.")
+OUTPUT_BYTES = REGISTRY.counter("converter_output_bytes_total", "Bytes of output written by successful conversions.")
+CONVERSIONS = REGISTRY.counter("converter_conversions_total", "Finished conversions by result.", ("result",))
+FAILURES = REGISTRY.counter("converter_failures_total", "Failed conversions by reason.", ("reason",))
+ACTIVE_PROCESSES = REGISTRY.gauge("converter_active_processes", "Running ffmpeg processes.")
+QUEUE_DEPTH = REGISTRY.gauge("converter_queue_depth", "Files waiting for a conversion slot.")
+
+
+@contextmanager
+def stage(name: str):
+    """Times the block as one run of a stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+
+def failure_reason(result: dict) -> str:
+    """A short, low-cardinality reason for a failed conversion result."""
+    error = result.get("error") or ""
+    if error == "Conversion cancelled":
+        return RESULT_CANCELLED
+    if error.startswith("Could not start ffmpeg"):
+        return "spawn_failed"
+    if error.startswith("Could not move the output"):
+        return "finalize_failed"
+    if error.startswith("Segment "):
+        return "segment_failed"
+    return "ffmpeg_error"
+
+
+def record_conversion(plan, result: dict, seconds: float, encoded: bool = True):
+    """
+    Counts a finished conversion of a ConversionPlan: its result and, on success, its
+    bytes in and out and encode speed, or on failure its reason.
+
+    Args:
+        plan: The plan that was converted.
+        result: The conversion's result dictionary.
+        seconds: The wall time of the conversion.
+        encoded: False for remuxes, whose speed says nothing about the encoder.
+    """
+    if not result["success"]:
+        reason = failure_reason(result)
+        if reason == RESULT_CANCELLED:
+            CONVERSIONS.inc(result=RESULT_CANCELLED)
+        else:
+            CONVERSIONS.inc(result=RESULT_FAILED)
+            FAILURES.inc(reason=reason)
+        return
+    CONVERSIONS.inc(result=RESULT_SUCCESS)
+    size_in = plan.media_info.size if plan.media_info is not None else None
+    try:
+        INPUT_BYTES.inc(size_in if size_in is not None else os.path.getsize(plan.input_file))
+        OUTPUT_BYTES.inc(os.path.getsize(result["output_filepath"]))
+    except OSError:
+        pass
+    if encoded and plan.estimated_duration and seconds > 0:
+        ENCODE_SPEED.observe(plan.estimated_duration / seconds)
+
+
+def stage_summary() -> str | None:
+    """One line with the total and mean time of every stage recorded so far, or None if none was."""
+    series = STAGE_SECONDS.series()
+    if not series:
+        return None
+    parts = []
+    for (name,), (count, total) in sorted(series.items(), key=lambda item: -item[1][1]):
+        parts.append(f"{name} {total:.1f}s total, {1000 * total / count:.0f} ms avg over {count}")
+    return "Stage timings: " + "; ".join(parts) + "."
@@ -0,0 +1,121 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# The probe cache lives next to the job database in the 'data' subdirectory
+CACHE_PATH = Path("data")
+CACHE_FILE = CACHE_PATH / "probe_cache.db"
+
+DEFAULT_MAX_ENTRIES = 250_000
+
+# Hits only refresh last_used when the stored value is older than this, so a warm
+# re-scan is read-only instead of rewriting every row it touches.
+TOUCH_GRANULARITY_SECONDS = 3600
+
+
+class ProbeCache:
+    """
+    Persistent, size-bounded cache of parsed ffprobe output.
+
+    Entries are keyed on the absolute path and validated against the file's size,
+    mtime and inode, so a changed or replaced file is always probed again. When the
+    cache grows beyond max_entries, the least recently used entries are evicted.
+    The cache is safe to share between threads.
+    """
+
+    def __init__(self, db_file: str | Path = CACHE_FILE, max_entries: int = DEFAULT_MAX_ENTRIES):
+        db_file = Path(db_file)
+        if str(db_file) != ":memory:":
+            db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS probe_cache (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            last_used INTEGER NOT NULL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_probe_cache_last_used ON probe_cache (last_used)")
+        self._conn.commit()
+        self._entry_count = self._conn.execute("SELECT COUNT(*) FROM probe_cache").fetchone()[0]
+
+    def get(self, path: str, stat_result: os.stat_result) -> dict | None:
+        """
+        Returns the cached ffprobe data for a file, or None on a miss.
+
+        A stale entry (the file's size, mtime or inode changed) is removed and
+        reported as a miss.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, data, last_used FROM probe_cache WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            size, mtime_ns, inode, data, last_used = row
+            if (size, mtime_ns, inode) != (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino):
+                self._conn.execute("DELETE FROM probe_cache WHERE path = ?", (path,))
+                self._conn.commit()
+                self._entry_count -= 1
+                return None
+
+            now = int(time.time())
+            if now - last_used >= TOUCH_GRANULARITY_SECONDS:
+                self._conn.execute("UPDATE probe_cache SET last_used = ? WHERE path = ?", (now, path))
+                self._conn.commit()
+
+        return json.loads(data)
+
+    def put(self, path: str, stat_result: os.stat_result, data: dict):
+        """Stores the parsed ffprobe format and stream data for a file."""
+        path = os.path.abspath(path)
+        payload = json.dumps({"format": data.get("format", {}), "streams": data.get("streams", [])})
+        with self._lock:
+            existed = self._conn.execute("SELECT 1 FROM probe_cache WHERE path = ?", (path,)).fetchone() is not None
+            self._conn.execute("""
+                INSERT OR REPLACE INTO probe_cache (path, size, mtime_ns, inode, data, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, payload, int(time.time())))
+            if not existed:
+                self._entry_count += 1
+            if self._entry_count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Trim to 90% of the bound so eviction doesn't run on every insert once full
+        target = int(self.max_entries * 0.9)
+        excess = self._entry_count - target
+        self._conn.execute("""
+            DELETE FROM probe_cache WHERE path IN (
+                SELECT path FROM probe_cache ORDER BY last_used ASC LIMIT ?
+            )
+        """, (excess,))
+        self._entry_count = self._conn.execute("SELECT COUNT(*) FROM probe_cache").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._entry_count
+
+    def clear(self):
+        """Removes every cached entry."""
+        with self._lock:
+            self._conn.execute("DELETE FROM probe_cache")
+            self._conn.commit()
+            self._entry_count = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
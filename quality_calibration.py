@@ -0,0 +1,316 @@
+"""
+Per-input bitrate calibration against a quality target.
+
+The optimized bitrate map only knows an input's resolution and codec, so easy content
+gets more bits than it needs and hard content fewer. In target-quality mode a few
+short samples spread over the input are encoded at candidate bitrates and scored
+against the source with ffmpeg's ssim or psnr filter. A binary search over a ladder of
+bitrates around the optimized one finds the lowest bitrate whose mean sample score
+meets the target.
+
+Calibration is bounded: the first trial's encode speed gives an estimate of the full
+encode time, and the search stops once another trial would take it past
+settings.calibration_budget of that estimate. Inputs too short to calibrate within
+the budget keep the optimized bitrate. Finished calibrations are cached per input
+fingerprint, so converting the same content again costs no trials.
+"""
+import dataclasses
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from conversion_logic import (
+    CREATE_NO_WINDOW,
+    DEFAULT_QUALITY_TARGETS,
+    QUALITY_METRIC_PSNR,
+    ConversionPlan,
+    ConversionSettings,
+    estimate_output_size,
+    parse_bitrate,
+    resolve_command,
+)
+import metrics
+from cpu_allocation import CpuAllocator, encoder_thread_args
+from fingerprint_index import FingerprintIndex
+
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 4.0
+
+# The candidate bitrates span this range around the optimized bitrate, in steps of LADDER_STEP
+LADDER_LOW_FACTOR = 0.25
+LADDER_HIGH_FACTOR = 2.0
+LADDER_STEP = 1.25
+MIN_CANDIDATE_BITRATE = 100_000
+
+_SSIM_PATTERN = re.compile(r"SSIM .*All:([0-9.]+)")
+_PSNR_PATTERN = re.compile(r"PSNR .*average:([0-9.]+|inf)")
+
+
+@dataclass(frozen=True)
+class Calibration:
+    """The outcome of calibrating one input: the bitrate to use and how it was found."""
+    bitrate: str
+    metric: str
+    score: float | None = None
+    trials: int = 0
+    seconds: float = 0.0
+    cached: bool = False
+    reason: str = ""
+
+    def describe(self) -> str:
+        if self.cached:
+            return f"{self.bitrate} (cached calibration, {self.metric} {self.score:.4g})"
+        if self.reason:
+            return f"{self.bitrate} ({self.reason})"
+        return f"{self.bitrate} ({self.metric} {self.score:.4g}, {self.trials} trials in {self.seconds:.1f}s)"
+
+
+def quality_target(settings: ConversionSettings) -> float:
+    """The score a calibrated bitrate has to reach."""
+    if settings.quality_target is not None:
+        return settings.quality_target
+    return DEFAULT_QUALITY_TARGETS[settings.quality_metric]
+
+
+def calibration_params(settings: ConversionSettings, start_bitrate: str) -> dict:
+    """
+    The settings a cached calibration is only valid for.
+
+    The start bitrate is part of them since the candidate ladder is built around it, and
+    it differs between quality profiles.
+    """
+    return {
+        "video_codec": settings.video_codec,
+        "start_bitrate": start_bitrate,
+        "quality_metric": settings.quality_metric,
+        "quality_target": quality_target(settings),
+        "cap": settings.fallback_bitrate if settings.cap_dynamic_bitrate else None,
+    }
+
+
+def format_bitrate(bits_per_second: int) -> str:
+    return f"{max(1, round(bits_per_second / 1000))}k"
+
+
+def bitrate_ladder(start_bitrate: str, cap_bitrate: str | None = None, source_bitrate: int | None = None) -> list[str]:
+    """
+    The candidate bitrates around start_bitrate, lowest first.
+
+    The ladder stops at the cap, if any, and at the source's own video bitrate, which
+    more bits can't improve on.
+    """
+    start = parse_bitrate(start_bitrate) or 0
+    if start <= 0:
+        return [start_bitrate]
+    high = start * LADDER_HIGH_FACTOR
+    for limit in (parse_bitrate(cap_bitrate), source_bitrate):
+        if limit:
+            high = min(high, limit)
+    bitrate = max(MIN_CANDIDATE_BITRATE, start * LADDER_LOW_FACTOR)
+    ladder = []
+    while bitrate < high:
+        ladder.append(format_bitrate(bitrate))
+        bitrate *= LADDER_STEP
+    ladder.append(format_bitrate(high))
+    return list(dict.fromkeys(ladder))
+
+
+def sample_starts(duration: float, count: int = SAMPLE_COUNT, seconds: float = SAMPLE_SECONDS) -> list[float]:
+    """Start times of count samples, centred in equal parts of the input."""
+    return [max(0.0, duration * (i + 0.5) / count - seconds / 2) for i in range(count)]
+
+
+def parse_quality_score(metric: str, stderr: str) -> float | None:
+    """Reads the overall score from the summary the ssim or psnr filter logs when it ends."""
+    pattern = _PSNR_PATTERN if metric == QUALITY_METRIC_PSNR else _SSIM_PATTERN
+    matches = pattern.findall(stderr)
+    if not matches:
+        return None
+    return float(matches[-1])
+
+
+def sample_encode_command(
+    input_file: str, stream_index: int, start: float, video_codec: str, bitrate: str, output_file: str, threads: int | None = None,
+) -> list[str]:
+    """The ffmpeg command encoding one video sample at a candidate bitrate."""
+    command = ["ffmpeg", "-v", "error", "-y"]
+    if threads:
+        command.extend(["-threads", str(threads)])
+    command.extend(["-ss", f"{start:.3f}", "-t", f"{SAMPLE_SECONDS:g}", "-i", input_file, "-map", f"0:{stream_index}", "-c:v", video_codec])
+    if threads:
+        command.extend(encoder_thread_args(video_codec, threads))
+    command.extend(["-b:v", bitrate, "-an", output_file])
+    return command
+
+
+def score_command(sample_file: str, input_file: str, stream_index: int, start: float, metric: str, threads: int | None = None) -> list[str]:
+    """The ffmpeg command scoring an encoded sample against the same span of the source."""
+    command = ["ffmpeg", "-hide_banner", "-nostats"]
+    if threads:
+        command.extend(["-threads", str(threads)])
+    command.extend([
+        "-i", sample_file,
+        "-ss", f"{start:.3f}", "-t", f"{SAMPLE_SECONDS:g}", "-i", input_file,
+        "-lavfi", f"[0:v:0][1:{stream_index}]{metric}", "-f", "null", "-",
+    ])
+    return command
+
+
+def _run(command: list[str]) -> subprocess.CompletedProcess | None:
+    try:
+        return subprocess.run(resolve_command(command), capture_output=True, text=True, creationflags=CREATE_NO_WINDOW)
+    except OSError:
+        return None
+
+
+def measure_quality(
+    plan: ConversionPlan, settings: ConversionSettings, bitrate: str, work_dir: str, threads: int | None = None,
+) -> tuple[float, float] | None:
+    """
+    Encodes and scores every sample of an input at one bitrate.
+
+    Returns:
+        The mean score of the samples and the seconds spent encoding them, or None if
+        an encode or a score failed.
+    """
+    stream_index = plan.media_info.video_stream.index
+    scores, encode_seconds = [], 0.0
+    for i, start in enumerate(sample_starts(plan.estimated_duration)):
+        sample_file = os.path.join(work_dir, f"sample_{i}.mkv")
+        started = time.monotonic()
+        encoded = _run(sample_encode_command(plan.input_file, stream_index, start, settings.video_codec, bitrate, sample_file, threads))
+        encode_seconds += time.monotonic() - started
+        if encoded is None or encoded.returncode != 0:
+            return None
+        scored = _run(score_command(sample_file, plan.input_file, stream_index, start, settings.quality_metric, threads))
+        score = parse_quality_score(settings.quality_metric, scored.stderr) if scored is not None and scored.returncode == 0 else None
+        if score is None:
+            return None
+        scores.append(score)
+    return sum(scores) / len(scores), encode_seconds
+
+
+def calibrate_bitrate(
+    plan: ConversionPlan,
+    settings: ConversionSettings,
+    cache: FingerprintIndex | None = None,
+    cancel_event: threading.Event | None = None,
+    threads: int | None = None,
+    clock: Callable[[], float] = time.monotonic,
+) -> Calibration:
+    """
+    Finds the lowest candidate bitrate whose samples meet the quality target.
+
+    Args:
+        plan: The input's plan; its target bitrate is the starting point and the fallback.
+        settings: The batch's settings, with the quality metric, target and budget.
+        cache: Where calibrations are looked up and stored by input fingerprint.
+        cancel_event: Stops the search between trials.
+        threads: The threads each sample encode may use.
+        clock: The time source for the budget.
+
+    Returns:
+        The calibration. If the input can't be calibrated (not probed, too short for the
+        budget, failed sample encodes, budget exhausted before any candidate passed),
+        it carries the plan's bitrate and the reason.
+    """
+    metric = settings.quality_metric
+    media_info = plan.media_info
+    duration = plan.estimated_duration or 0.0
+    if media_info is None or media_info.video_stream is None or not duration:
+        return Calibration(plan.target_bitrate, metric, reason="not calibrated: the input couldn't be probed")
+
+    params = calibration_params(settings, plan.target_bitrate)
+    if cache is not None:
+        try:
+            cached = cache.get_calibration(plan.input_file, params)
+        except OSError:
+            cached = None
+        if cached is not None:
+            return Calibration(cached[0], metric, cached[1], cached=True)
+
+    sampled_seconds = SAMPLE_COUNT * SAMPLE_SECONDS
+    if sampled_seconds > settings.calibration_budget * duration:
+        return Calibration(plan.target_bitrate, metric, reason=f"not calibrated: too short to sample within {settings.calibration_budget:.0%} of its encode time")
+
+    target = quality_target(settings)
+    source_bitrate = media_info.video_stream.bit_rate
+    ladder = bitrate_ladder(plan.target_bitrate, settings.fallback_bitrate if settings.cap_dynamic_bitrate else None, source_bitrate)
+    started = clock()
+    budget_seconds = None
+    trials = 0
+    low, high = 0, len(ladder) - 1
+    best = best_score = top_score = None
+    complete = True
+    with tempfile.TemporaryDirectory(prefix="calibration-") as work_dir:
+        while low <= high:
+            elapsed = clock() - started
+            if cancel_event is not None and cancel_event.is_set():
+                return Calibration(plan.target_bitrate, metric, trials=trials, seconds=elapsed, reason="not calibrated: cancelled")
+            if budget_seconds is not None and elapsed + elapsed / trials > budget_seconds:
+                complete = False
+                break
+            middle = (low + high) // 2
+            measured = measure_quality(plan, settings, ladder[middle], work_dir, threads)
+            trials += 1
+            if measured is None:
+                return Calibration(plan.target_bitrate, metric, trials=trials, seconds=clock() - started, reason="not calibrated: a sample encode failed")
+            score, encode_seconds = measured
+            if budget_seconds is None:
+                # The samples' encode speed gives the full encode time the budget is a fraction of
+                budget_seconds = settings.calibration_budget * encode_seconds / sampled_seconds * duration
+            if middle == len(ladder) - 1:
+                top_score = score
+            if score >= target:
+                best, best_score = middle, score
+                high = middle - 1
+            else:
+                low = middle + 1
+    seconds = clock() - started
+
+    if best is not None:
+        calibration = Calibration(ladder[best], metric, best_score, trials, seconds)
+    elif complete:
+        calibration = Calibration(ladder[-1], metric, top_score, trials, seconds, reason=f"{metric} target {target:g} not reached at the highest candidate")
+    else:
+        return Calibration(plan.target_bitrate, metric, trials=trials, seconds=seconds, reason="not calibrated: the calibration budget ran out")
+    if complete and cache is not None:
+        try:
+            cache.record_calibration(plan.input_file, params, calibration.bitrate, calibration.score)
+        except OSError:
+            pass
+    return calibration
+
+
+def calibrate_plan(
+    plan: ConversionPlan,
+    settings: ConversionSettings,
+    cache: FingerprintIndex | None = None,
+    cancel_event: threading.Event | None = None,
+    cpu_allocator: CpuAllocator | None = None,
+) -> tuple[ConversionPlan, Calibration]:
+    """
+    Calibrates a plan's bitrate and returns the plan with it, along with the calibration.
+
+    With a cpu_allocator, the sample encodes are limited to this input's share of the cores.
+    """
+    with metrics.stage(metrics.STAGE_CALIBRATE):
+        if cpu_allocator is None:
+            calibration = calibrate_bitrate(plan, settings, cache, cancel_event)
+        else:
+            key = f"{plan.input_file} (calibration)"
+            allocation = cpu_allocator.acquire(key)
+            try:
+                calibration = calibrate_bitrate(plan, settings, cache, cancel_event, allocation.threads)
+            finally:
+                cpu_allocator.release(key)
+    if calibration.bitrate == plan.target_bitrate:
+        return plan, calibration
+    return dataclasses.replace(
+        plan, target_bitrate=calibration.bitrate, estimated_size=estimate_output_size(plan.media_info, calibration.bitrate)
+    ), calibration
@@ -0,0 +1,131 @@
+import heapq
+import threading
+import time
+from typing import Callable, Iterable
+
+from conversion_logic import ConversionPlan
+
+ORDER_FIFO = "fifo"
+ORDER_LONGEST_FIRST = "longest-first"
+ORDER_SHORTEST_FIRST = "shortest-first"
+
+# Pixel count assumed when a file's resolution is unknown
+DEFAULT_PIXELS = 1920 * 1080
+
+
+def processing_cost(plan: ConversionPlan) -> float:
+    """
+    Estimates the relative encode cost of a plan as duration x pixels per frame.
+
+    Files with an unknown duration cost 0, so they never hold up the expensive ones.
+    """
+    if not plan.estimated_duration:
+        return 0.0
+    video_stream = plan.media_info.video_stream if plan.media_info else None
+    pixels = DEFAULT_PIXELS
+    if video_stream is not None and video_stream.width and video_stream.height:
+        pixels = video_stream.width * video_stream.height
+    return plan.estimated_duration * pixels
+
+
+# Each policy orders a list of items given a function returning an item's cost
+OrderingPolicy = Callable[[list, Callable[[object], float]], list]
+
+ORDERING_POLICIES: dict[str, OrderingPolicy] = {
+    # Submission order, so encoding can start while the input is still being scanned
+    ORDER_FIFO: lambda items, cost: list(items),
+    # Longest processing time first: the classic heuristic to minimise makespan
+    ORDER_LONGEST_FIRST: lambda items, cost: sorted(items, key=cost, reverse=True),
+    # Quick feedback: the first results arrive as early as possible
+    ORDER_SHORTEST_FIRST: lambda items, cost: sorted(items, key=cost),
+}
+
+
+def order_plans(plans: Iterable[ConversionPlan], policy: str) -> list[ConversionPlan]:
+    """
+    Orders conversion plans according to a named policy.
+
+    Args:
+        plans: The planned conversions.
+        policy: One of the ORDERING_POLICIES keys.
+
+    Returns:
+        The plans in the order they should be submitted.
+    """
+    try:
+        ordering = ORDERING_POLICIES[policy]
+    except KeyError:
+        raise ValueError(f"Unknown ordering policy: {policy}") from None
+    return ordering(list(plans), processing_cost)
+
+
+def simulate_makespan(costs: Iterable[float], workers: int) -> float:
+    """
+    Simulates list scheduling of jobs (in the given order) onto identical workers.
+
+    Returns:
+        The time the last worker finishes, in the same unit as the costs.
+    """
+    slots = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(slots, slots[0] + cost)
+    return max(slots)
+
+
+class MakespanTracker:
+    """
+    Records when each encode starts and finishes, to compare the predicted and actual makespan.
+
+    The prediction is made in cost units (duration x pixels) and converted to seconds
+    with the throughput measured over the batch, so the policies can be compared
+    on the same footing after the fact.
+    """
+
+    def __init__(self, workers: int, clock: Callable[[], float] = time.monotonic):
+        self.workers = max(1, workers)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._costs = {}
+        self._order = []
+        self._started = {}
+        self._finished = {}
+
+    def add(self, plan: ConversionPlan):
+        """Registers a plan in submission order."""
+        with self._lock:
+            self._costs[plan.input_file] = processing_cost(plan)
+            self._order.append(plan.input_file)
+
+    def start(self, input_file: str):
+        """Records when work on a file began; later calls (e.g. for its other segments) keep the first time."""
+        with self._lock:
+            self._started.setdefault(input_file, self._clock())
+
+    def finish(self, input_file: str):
+        with self._lock:
+            if input_file in self._started:
+                self._finished[input_file] = self._clock()
+
+    def report(self) -> dict | None:
+        """
+        Returns the actual makespan and the predicted makespan of each policy, in seconds,
+        or None if nothing has finished yet.
+        """
+        with self._lock:
+            finished = [f for f in self._order if f in self._finished]
+            if not finished:
+                return None
+            actual = max(self._finished.values()) - min(self._started[f] for f in finished)
+            busy = sum(self._finished[f] - self._started[f] for f in finished)
+            work = sum(self._costs[f] for f in finished)
+            costs = [self._costs[f] for f in self._order]
+
+        # Cost units processed per second by a single worker
+        throughput = work / busy if busy > 0 and work > 0 else None
+        report = {"actual_makespan": actual, "predicted_makespan": None, "policies": {}}
+        if throughput:
+            report["predicted_makespan"] = simulate_makespan(costs, self.workers) / throughput
+            for policy, ordering in ORDERING_POLICIES.items():
+                ordered = ordering(costs, lambda cost: cost)
+                report["policies"][policy] = simulate_makespan(ordered, self.workers) / throughput
+        return report
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, ConfigDict
 from enum import Enum
+from typing import Literal
 from datetime import datetime
 import uuid
 
@@ -10,6 +11,13 @@ class JobStatus(str, Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class BatchFileStatus(str, Enum):
+    """Enum for the state of one input file in a resumable batch."""
+    PENDING = "pending"
+    ENCODING = "encoding"
+    DONE = "done"
+    FAILED = "failed"
+
 class JobBase(BaseModel):
     """Base model for a job."""
     pass
@@ -30,3 +38,55 @@ class Job(JobBase):
     updated_at: datetime
 
     model_config = ConfigDict(from_attributes=True)
+
+class JobSummary(JobBase):
+    """Model for a job in listings, without its logs and result."""
+    id: uuid.UUID
+    correlation_id: str | None = None
+    status: JobStatus
+    progress: float
+    created_at: datetime
+    updated_at: datetime
+
+class JobPage(BaseModel):
+    """Model for one page of a job listing."""
+    items: list[JobSummary]
+    next_cursor: str | None = None
+
+class JobLogEntry(BaseModel):
+    """Model for one line of a job's log."""
+    seq: int
+    ts: datetime
+    level: str
+    message: str
+
+class ConversionRequest(BaseModel):
+    """Model for a bulk conversion request, mirroring the GUI options."""
+    input_directory: str
+    output_directory: str
+    video_codec: str = "hevc_nvenc"
+    audio_codec: str = "aac"
+    output_format: str = "mp4"
+    video_bitrate: str = "optimized"
+    bitrate_quality_profile: str = "Balanced Quality"
+    delete_input_files: bool = False
+    fallback_bitrate: str = "6M"
+    cap_dynamic_bitrate: bool = False
+    verbose_logging: bool = False
+    recursive: bool = True
+    concurrent_conversions: int = Field(default=2, ge=1)
+    passthrough: Literal["copy", "skip", "off"] = "copy"
+    passthrough_threshold: float = Field(default=1.0, gt=0)
+    subtitles: Literal["keep", "drop"] = "keep"
+    attachments: Literal["keep", "drop"] = "keep"
+    quality_metric: Literal["ssim", "psnr"] = "ssim"
+    quality_target: float | None = Field(default=None, gt=0)
+    calibration_budget: float = Field(default=0.1, gt=0, le=1)
+    codec_fallback: Literal["cpu", "fail"] | None = None
+
+class ConversionResponse(BaseModel):
+    """Model for the response to an accepted conversion request."""
+    job_id: uuid.UUID
+    status: str
+    file_count: int
+    files_to_process: list[str]
@@ -0,0 +1,417 @@
+"""
+Segment-parallel encoding of single long inputs.
+
+A long input keeps one worker busy for hours while the rest of the pool idles at the
+end of a batch. Inputs above a duration or size threshold are instead split at
+keyframes into segments whose video is encoded as separate tasks on the same worker
+pool, all at the bitrate planned for the whole file. The encoded segments are then
+joined losslessly with ffmpeg's concat demuxer (-c:v copy) in a final pass that also
+takes the audio, subtitle and attachment streams from the original input in one
+piece, so there are no seams in the audio at the cut points.
+
+Segments are written to a hidden directory next to the output that is removed when
+the file finishes, fails or is cancelled. After a crash, conversion_logic.partial_outputs
+finds that directory like any other partial output.
+"""
+import concurrent.futures
+import json
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from conversion_logic import (
+    ACTION_ENCODE,
+    CREATE_NO_WINDOW,
+    ConversionPlan,
+    ConversionSettings,
+    execute_ffmpeg_command,
+    finalize_output,
+    plan_streams,
+    remove_partial_output,
+    resolve_command,
+    stream_args,
+    temp_output_path,
+)
+import metrics
+from cpu_allocation import CpuAllocator, encoder_thread_args
+from ffmpeg_progress import FfmpegProgress, stream_ffmpeg_progress
+
+# Shorter segments cost more in encoder warm-up and process start-up than they gain
+MIN_SEGMENT_SECONDS = 30.0
+
+# How far past each ideal split point ffprobe reads packets, looking for a keyframe
+KEYFRAME_SEARCH_SECONDS = 20.0
+
+SEGMENT_DIR_SUFFIX = ".segments"
+
+
+def should_segment(plan: ConversionPlan, settings: ConversionSettings) -> bool:
+    """Whether a planned input is long or large enough to be encoded in segments."""
+    if plan.action != ACTION_ENCODE or plan.media_info is None or plan.media_info.video_stream is None:
+        return False
+    duration = plan.estimated_duration or 0.0
+    if settings.segment_count < 2 or duration < 2 * MIN_SEGMENT_SECONDS:
+        return False
+    long_enough = settings.segment_min_duration > 0 and duration >= settings.segment_min_duration
+    large_enough = settings.segment_min_size > 0 and (plan.media_info.size or 0) >= settings.segment_min_size
+    return long_enough or large_enough
+
+
+def probe_keyframes(
+    input_file: str,
+    stream_index: int,
+    points: list[float],
+    start_time: float = 0.0,
+    window: float = KEYFRAME_SEARCH_SECONDS,
+) -> list[float]:
+    """
+    Finds the keyframes of a video stream shortly after each of the given points.
+
+    Only the packets within window seconds after each point are read, so this costs a
+    few seeks rather than a pass over the whole file.
+
+    Args:
+        input_file: The input file.
+        stream_index: The index of the video stream.
+        points: The ideal split points, in seconds from the start of the file.
+        start_time: The file's start time, which ffprobe's packet times include.
+        window: How many seconds after each point to search.
+
+    Returns:
+        The keyframe times in seconds from the start of the file, sorted. Empty if the
+        input couldn't be probed.
+    """
+    intervals = ",".join(f"{start_time + point:.3f}%+{window:g}" for point in points)
+    command = [
+        "ffprobe",
+        "-v",
+        "quiet",
+        "-print_format",
+        "json",
+        "-select_streams",
+        str(stream_index),
+        "-read_intervals",
+        intervals,
+        "-show_entries",
+        "packet=pts_time,flags",
+        input_file,
+    ]
+    try:
+        result = subprocess.run(resolve_command(command), capture_output=True, text=True, check=True, creationflags=CREATE_NO_WINDOW)
+        packets = json.loads(result.stdout).get("packets", [])
+    except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError):
+        return []
+
+    keyframes = set()
+    for packet in packets:
+        if "K" not in packet.get("flags", ""):
+            continue
+        try:
+            keyframes.add(float(packet["pts_time"]) - start_time)
+        except (KeyError, ValueError):
+            continue
+    return sorted(keyframes)
+
+
+def split_points(keyframes: list[float], duration: float, count: int) -> list[float]:
+    """
+    Picks up to count - 1 keyframes that split an input into roughly equal segments.
+
+    Each split is the keyframe nearest to its ideal point, and no segment is shorter
+    than MIN_SEGMENT_SECONDS, so there may be fewer splits than asked for.
+
+    Returns:
+        The split points in seconds, strictly increasing.
+    """
+    points = []
+    previous = 0.0
+    for i in range(1, count):
+        target = duration * i / count
+        candidates = [k for k in keyframes if previous + MIN_SEGMENT_SECONDS <= k <= duration - MIN_SEGMENT_SECONDS]
+        if not candidates:
+            continue
+        previous = min(candidates, key=lambda k: abs(k - target))
+        points.append(previous)
+    return points
+
+
+@dataclass(frozen=True)
+class Segment:
+    """One keyframe-aligned part of a segmented input."""
+    key: str
+    index: int
+    start: float
+    duration: float
+    last: bool
+    path: str
+
+
+def _cancelled_result(output_filepath: str) -> dict:
+    return {"success": False, "output_filepath": output_filepath, "stderr": "", "error": "Conversion cancelled"}
+
+
+def _segment_result(future: concurrent.futures.Future, segment: Segment) -> dict:
+    if future.cancelled():
+        return _cancelled_result(segment.path)
+    error = future.exception()
+    if error is not None:
+        return {"success": False, "output_filepath": segment.path, "stderr": "", "error": str(error)}
+    return future.result()
+
+
+class SegmentedEncode:
+    """
+    Encodes one planned input as separately encoded segments and concatenates them.
+
+    Call prepare() to pick the split points, then submit() to run the segments on an
+    executor. Every segment is encoded with the plan's target bitrate and the batch's
+    codec, so the parts match and can be joined without re-encoding.
+    """
+
+    def __init__(self, plan: ConversionPlan, settings: ConversionSettings):
+        self.plan = plan
+        self.settings = settings
+        self.temp_path = temp_output_path(plan.output_filepath)
+        self.work_dir = self.temp_path + SEGMENT_DIR_SUFFIX
+        self.segments: list[Segment] = []
+
+    def prepare(self, count: int | None = None) -> bool:
+        """
+        Splits the input at keyframes into up to count segments (settings.segment_count by default).
+
+        Returns:
+            False if no usable keyframes were found, in which case the input should be
+            encoded whole.
+        """
+        count = count or self.settings.segment_count
+        media_info = self.plan.media_info
+        duration = self.plan.estimated_duration or 0.0
+        targets = [duration * i / count for i in range(1, count)]
+        keyframes = probe_keyframes(self.plan.input_file, media_info.video_stream.index, targets, media_info.start_time or 0.0)
+        points = split_points(keyframes, duration, count)
+        if not points:
+            return False
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        bounds = [0.0, *points, duration]
+        total = len(bounds) - 1
+        self.segments = [
+            Segment(
+                key=f"{self.plan.input_file} [part {i + 1}/{total}]",
+                index=i,
+                start=bounds[i],
+                duration=bounds[i + 1] - bounds[i],
+                last=i == total - 1,
+                path=os.path.join(self.work_dir, f"segment_{i:04d}.mkv"),
+            )
+            for i in range(total)
+        ]
+        return True
+
+    def segment_command(self, segment: Segment, threads: int | None = None) -> list[str]:
+        """The ffmpeg command encoding the main video stream of one segment."""
+        video_codec = self.settings.video_codec
+        command = ["ffmpeg"]
+        if threads:
+            command.extend(["-threads", str(threads)])
+        # Seeking before -i lands exactly on the keyframe the segment starts with
+        command.extend(["-ss", f"{segment.start:.6f}", "-i", self.plan.input_file])
+        if not segment.last:
+            command.extend(["-t", f"{segment.duration:.6f}"])
+        command.extend(["-map", f"0:{self.plan.media_info.video_stream.index}", "-c:v", video_codec])
+        if threads:
+            command.extend(encoder_thread_args(video_codec, threads))
+        command.extend(["-b:v", self.plan.target_bitrate, segment.path])
+        return command
+
+    def concat_list_path(self) -> str:
+        return os.path.join(self.work_dir, "segments.txt")
+
+    def concat_command(self) -> list[str]:
+        """
+        The ffmpeg command joining the encoded segments into the temporary output.
+
+        The video is copied from the segments (input 0); every other stream, and the
+        metadata and chapters, come from the original input (input 1) as plan_streams
+        decides for a whole-file conversion.
+        """
+        other_streams = [
+            stream_plan
+            for stream_plan in plan_streams(
+                self.plan.media_info, "copy", self.settings.audio_codec, os.path.splitext(self.plan.output_filepath)[1],
+                self.settings.subtitles, self.settings.attachments, copy_video=True,
+            )
+            if stream_plan.codec_type != "video"
+        ]
+        command = [
+            "ffmpeg", "-f", "concat", "-safe", "0", "-i", self.concat_list_path(), "-i", self.plan.input_file,
+            "-map", "0:v:0", "-c:v:0", "copy",
+        ]
+        command.extend(stream_args(other_streams, [], input_index=1, first_outputs={"v": 1}))
+        command.extend(["-map_metadata", "1", "-map_chapters", "1", self.temp_path])
+        return command
+
+    def run_segment(
+        self,
+        segment: Segment,
+        cancel_event: threading.Event | None = None,
+        on_progress: Callable[[FfmpegProgress], None] | None = None,
+        on_process_started: Callable[[subprocess.Popen], None] | None = None,
+        cpu_allocator: CpuAllocator | None = None,
+    ) -> dict:
+        """
+        Encodes one segment, as conversion_logic.run_conversion does for a whole file.
+
+        Progress updates are tagged with the segment's key instead of the input file.
+
+        Returns:
+            A dictionary with 'success', 'output_filepath' (the segment file), 'stderr',
+            'cpu_seconds' and, on failure, 'error'.
+        """
+        if cpu_allocator is None:
+            return self._run_segment(segment, cancel_event, on_progress, on_process_started)
+        allocation = cpu_allocator.acquire(segment.key)
+
+        def attach_process(process):
+            cpu_allocator.attach(segment.key, process.pid)
+            if on_process_started is not None:
+                on_process_started(process)
+
+        try:
+            return self._run_segment(segment, cancel_event, on_progress, attach_process, allocation.threads)
+        finally:
+            cpu_allocator.release(segment.key)
+
+    def _run_segment(self, segment, cancel_event, on_progress, on_process_started, threads=None):
+        started = time.monotonic()
+        with metrics.stage(metrics.STAGE_ENCODE), metrics.ACTIVE_PROCESSES.track():
+            process = execute_ffmpeg_command(self.segment_command(segment, threads), self.settings.verbose_logging, progress=True)
+            if on_process_started is not None:
+                on_process_started(process)
+            stderr = stream_ffmpeg_progress(
+                process, segment.key, segment.duration, on_progress or (lambda progress: None), self.settings.progress_interval
+            )
+
+        result = {
+            "success": False,
+            "output_filepath": segment.path,
+            "stderr": stderr,
+            "cpu_seconds": (time.monotonic() - started) * (threads or os.cpu_count() or 1),
+        }
+        if cancel_event is not None and cancel_event.is_set():
+            result["error"] = "Conversion cancelled"
+        elif process.returncode == 0:
+            result["success"] = True
+        else:
+            result["error"] = stderr
+        return result
+
+    def concat(self, on_process_started: Callable[[subprocess.Popen], None] | None = None) -> dict:
+        """Joins the encoded segments and renames the result into place (see finalize_output)."""
+        with open(self.concat_list_path(), "w", encoding="utf-8") as f:
+            for segment in self.segments:
+                escaped = segment.path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        with metrics.stage(metrics.STAGE_CONCAT), metrics.ACTIVE_PROCESSES.track():
+            process = execute_ffmpeg_command(self.concat_command(), self.settings.verbose_logging)
+            if on_process_started is not None:
+                on_process_started(process)
+            _, stderr = process.communicate()
+        result = {"success": process.returncode == 0, "output_filepath": self.plan.output_filepath, "stderr": stderr}
+        if not result["success"]:
+            result["error"] = stderr.strip() or f"ffmpeg exited with code {process.returncode}"
+        return finalize_output(result, self.temp_path)
+
+    def finish(
+        self,
+        segment_results: list[dict],
+        cancel_event: threading.Event | None = None,
+        on_process_started: Callable[[subprocess.Popen], None] | None = None,
+    ) -> dict:
+        """
+        Concatenates the segments if every one of them was encoded, and returns the file's result.
+
+        The result's 'cpu_seconds' is the sum over the segments.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            return _cancelled_result(self.plan.output_filepath)
+        failed = next((r for r in segment_results if not r["success"]), None)
+        if failed is not None:
+            return {
+                "success": False,
+                "output_filepath": self.plan.output_filepath,
+                "stderr": failed.get("stderr", ""),
+                "error": f"Segment {os.path.basename(failed['output_filepath'])} failed: {failed.get('error')}",
+            }
+        result = self.concat(on_process_started)
+        if cancel_event is not None and cancel_event.is_set() and not result["success"]:
+            result["error"] = "Conversion cancelled"
+        result["cpu_seconds"] = sum(r.get("cpu_seconds") or 0.0 for r in segment_results)
+        return result
+
+    def cleanup(self):
+        """Removes the segment directory and any temporary output."""
+        remove_partial_output(self.work_dir)
+        remove_partial_output(self.temp_path)
+
+    def submit(
+        self,
+        executor: concurrent.futures.Executor,
+        run_segment: Callable[[Segment], dict],
+        cancel_event: threading.Event | None = None,
+        on_process_started: Callable[[subprocess.Popen], None] | None = None,
+        on_finished: Callable[[dict], dict] | None = None,
+    ) -> concurrent.futures.Future:
+        """
+        Submits every segment to executor and returns a future for the whole file.
+
+        No worker ever waits for another: the segment that finishes last concatenates the
+        parts on its own thread, then the segment directory is removed whatever happened,
+        including cancellation. The returned future is already running, so like a started
+        executor task it can't be cancelled; it completes once the last segment is handled.
+
+        Args:
+            executor: The pool the segments run on.
+            run_segment: Encodes one segment, e.g. a wrapper around run_segment() that
+                also waits for a concurrency slot.
+            cancel_event: If set once the segments are done, they aren't concatenated.
+            on_process_started: Called with the concat ffmpeg process.
+            on_finished: Called with the file's result; its return value becomes the
+                future's result.
+        """
+        if not self.segments:
+            raise ValueError("prepare() found no segments to submit.")
+        file_future = concurrent.futures.Future()
+        file_future.set_running_or_notify_cancel()
+        started = time.monotonic()
+        lock = threading.Lock()
+        remaining = [len(self.segments)]
+        segment_futures = []
+
+        def on_segment_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                try:
+                    results = [_segment_result(f, segment) for f, segment in zip(segment_futures, self.segments)]
+                    result = self.finish(results, cancel_event, on_process_started)
+                finally:
+                    self.cleanup()
+                metrics.record_conversion(self.plan, result, time.monotonic() - started)
+                if on_finished is not None:
+                    result = on_finished(result)
+            except Exception as e:
+                file_future.set_exception(e)
+            else:
+                file_future.set_result(result)
+
+        segment_futures.extend(executor.submit(run_segment, segment) for segment in self.segments)
+        for future in segment_futures:
+            future.add_done_callback(on_segment_done)
+        return file_future
@@ -0,0 +1,242 @@
+import asyncio
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import database
+import job_runner
+import metrics
+import conversion_logic
+from conversion_logic import ConversionSettings
+from encoder_capabilities import CapabilityRegistry, EncoderCapabilities
+from schemas import JobStatus
+
+# Stands in for ffmpeg: reports progress on stdout like `-progress pipe:1`, writes its output and exits with the given code
+FAKE_FFMPEG = """
+import sys, time
+print("out_time_us=1000000\\nprogress=continue", flush=True)
+time.sleep(float(sys.argv[1]))
+open(sys.argv[3], "wb").write(b"converted")
+print("out_time_us=2000000\\nprogress=end", flush=True)
+sys.exit(int(sys.argv[2]))
+"""
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """Fixture replacing ffmpeg with a short Python script; returns the settings it reads."""
+    options = {"sleep": 0.05, "exit_code": 0}
+    monkeypatch.setattr(
+        job_runner, "prepare_ffmpeg_command",
+        lambda command, verbose_logging, progress=False: [sys.executable, "-c", FAKE_FFMPEG, str(options["sleep"]), str(options["exit_code"]), command[-1]],
+    )
+    return options
+
+@pytest.fixture
+def jobs_db(tmp_path, monkeypatch):
+    """Fixture pointing the jobs database at a temporary directory."""
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "data")
+    monkeypatch.setattr(database, "DB_FILE", tmp_path / "data" / "jobs.db")
+    database.initialize_database()
+
+@pytest.fixture
+def videos(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for name in ("a.mp4", "b.mkv"):
+        (input_dir / name).write_bytes(b"video")
+    return input_dir
+
+def wait_for_job(client, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/status/{job_id}").json()
+        if job["status"] in (JobStatus.COMPLETED.value, JobStatus.FAILED.value):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("Job did not finish in time")
+
+def test_convert_runs_job_to_completion(jobs_db, fake_ffmpeg, videos, tmp_path):
+    """Test that POST /convert returns 202 and the job's status, progress and result are recorded."""
+    with TestClient(api.app) as client:
+        response = client.post("/convert", json={"input_directory": str(videos), "output_directory": str(tmp_path / "out")})
+        assert response.status_code == 202
+        body = response.json()
+        assert body["file_count"] == 2
+        assert body["files_to_process"] == ["a.mp4", "b.mkv"]
+
+        job = wait_for_job(client, body["job_id"])
+
+    assert job["status"] == JobStatus.COMPLETED.value
+    assert job["progress"] == 100.0
+    assert [path.rsplit("/", 1)[-1] for path in job["result"]] == ["z_a.mp4", "z_b.mp4"]
+    assert any("Successfully converted a.mp4" in line for line in job["logs"])
+
+    with TestClient(api.app) as client:
+        assert client.get(f"/status/{job['id']}", params={"log_tail": 1}).json()["logs"] == job["logs"][-1:]
+        page = client.get(f"/jobs/{job['id']}/logs", params={"after": 1, "limit": 2}).json()
+        assert [entry["seq"] for entry in page] == [2, 3]
+        assert [entry["message"] for entry in page] == job["logs"][1:3]
+        assert client.get(f"/jobs/{uuid.uuid4()}/logs").status_code == 404
+
+def test_failed_conversion_marks_job_failed(jobs_db, fake_ffmpeg, videos, tmp_path):
+    """Test that an ffmpeg error fails the job and is logged."""
+    fake_ffmpeg["exit_code"] = 1
+    with TestClient(api.app) as client:
+        job_id = client.post("/convert", json={"input_directory": str(videos), "output_directory": str(tmp_path / "out")}).json()["job_id"]
+        job = wait_for_job(client, job_id)
+
+    assert job["status"] == JobStatus.FAILED.value
+    assert job["result"] == []
+    assert any("Error converting a.mp4" in line for line in job["logs"])
+
+def test_metrics_endpoint_reports_conversions(jobs_db, fake_ffmpeg, videos, tmp_path):
+    """Test that GET /metrics exposes stage timings and conversion counts in the Prometheus format."""
+    metrics.REGISTRY.clear()
+    with TestClient(api.app) as client:
+        job_id = client.post("/convert", json={"input_directory": str(videos), "output_directory": str(tmp_path / "out")}).json()["job_id"]
+        wait_for_job(client, job_id)
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'converter_conversions_total{result="success"} 2' in response.text
+    assert 'converter_stage_seconds_count{stage="encode"} 2' in response.text
+    assert 'converter_stage_seconds_count{stage="queue_wait"} 2' in response.text
+    assert "converter_active_processes 0" in response.text
+
+def test_list_jobs(jobs_db, fake_ffmpeg, videos, tmp_path):
+    """Test that GET /jobs pages through job summaries and filters by status."""
+    with TestClient(api.app) as client:
+        job_ids = [
+            client.post("/convert", json={"input_directory": str(videos), "output_directory": str(tmp_path / "out")}).json()["job_id"]
+            for _ in range(3)
+        ]
+        for job_id in job_ids:
+            wait_for_job(client, job_id)
+
+        first = client.get("/jobs", params={"limit": 2}).json()
+        second = client.get("/jobs", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+        assert {job["id"] for job in first["items"] + second["items"]} == set(job_ids)
+        assert second["next_cursor"] is None
+        assert "logs" not in first["items"][0]
+
+        assert client.get("/jobs", params={"status": "failed"}).json()["items"] == []
+        assert client.get("/jobs", params={"cursor": "bogus"}).status_code == 400
+
+def test_convert_rejects_missing_input_directory(jobs_db, tmp_path):
+    """Test that an invalid input directory is a 400, without creating a job."""
+    with TestClient(api.app) as client:
+        response = client.post("/convert", json={"input_directory": str(tmp_path / "missing"), "output_directory": str(tmp_path / "out")})
+    assert response.status_code == 400
+
+def test_status_of_unknown_job_is_404(jobs_db):
+    """Test that polling an unknown job returns 404."""
+    with TestClient(api.app) as client:
+        assert client.get(f"/status/{uuid.uuid4()}").status_code == 404
+
+def test_health_and_codec_checks_use_the_capability_cache(jobs_db, videos, tmp_path, monkeypatch):
+    """Test that /health serves cached capabilities and jobs asking for an unusable encoder are rejected under the fail policy."""
+    probes = []
+    def probe():
+        probes.append(1)
+        return EncoderCapabilities("ffmpeg version 7.0", frozenset({"libx265", "hevc_nvenc", "aac"}), ("cuda",))
+    monkeypatch.setattr(api, "capabilities", CapabilityRegistry(prober=probe, encoder_tester=lambda codec: "Cannot load libcuda.so.1"))
+    with TestClient(api.app) as client:
+        for _ in range(2):
+            health = client.get("/health").json()
+        assert (health["ffmpeg_version"], health["encoder_count"], health["hwaccels"]) == ("ffmpeg version 7.0", 3, ["cuda"])
+        assert len(probes) == 1
+        request = {"input_directory": str(videos), "output_directory": str(tmp_path / "out"), "video_codec": "hevc_nvenc", "codec_fallback": "fail"}
+        response = client.post("/convert", json=request)
+        assert response.status_code == 400
+        assert "hevc_nvenc is not available" in response.json()["detail"]["error"]
+
+def test_runner_caps_concurrent_processes_across_jobs(jobs_db, fake_ffmpeg, videos, tmp_path, monkeypatch):
+    """Test that MAX_CONCURRENT_JOBS bounds the ffmpeg processes of all jobs together."""
+    fake_ffmpeg["sleep"] = 0.2
+    peak = [0]
+    runners = []
+    stream = job_runner.stream_ffmpeg_progress_async
+
+    async def tracking_stream(*args, **kwargs):
+        peak[0] = max(peak[0], runners[0].active_processes)
+        return await stream(*args, **kwargs)
+
+    monkeypatch.setattr(job_runner, "stream_ffmpeg_progress_async", tracking_stream)
+    (tmp_path / "out").mkdir()
+    settings = ConversionSettings(output_dir=str(tmp_path / "out"), video_codec="libx264", audio_codec="aac", output_format="mp4", video_bitrate="2M")
+    files = [str(videos / "a.mp4"), str(videos / "b.mkv")]
+
+    async def run_jobs():
+        runner = job_runner.JobRunner(max_concurrent_jobs=3, progress_interval=0.05)
+        runners.append(runner)
+        job_ids = [uuid.uuid4() for _ in range(3)]
+        for job_id in job_ids:
+            await job_runner.run_db(database.create_job, job_id, None)
+        await asyncio.gather(*(runner.submit(job_id, files, settings, concurrent_conversions=2) for job_id in job_ids))
+        await runner.shutdown()
+        return job_ids
+
+    job_ids = asyncio.run(run_jobs())
+    assert 1 < peak[0] <= 3
+    conn = database.get_db_connection()
+    assert all(database.get_job(conn, job_id).status == JobStatus.COMPLETED for job_id in job_ids)
+    conn.close()
+
+def test_cancelling_a_job_stops_its_calibration(jobs_db, videos, tmp_path, monkeypatch):
+    """Test that shutting down the runner signals a calibration running in a worker thread to stop."""
+    calibrating, stopped = threading.Event(), threading.Event()
+
+    def slow_calibration(plan, settings, cache, cancel_event, cpu_allocator):
+        calibrating.set()
+        if cancel_event is not None and cancel_event.wait(10):
+            stopped.set()
+        raise RuntimeError("cancelled")
+
+    monkeypatch.setattr(job_runner, "calibrate_plan", slow_calibration)
+    monkeypatch.setattr(job_runner, "_plan_job", lambda video_files, settings: [
+        conversion_logic.plan_conversion(video_files[0], None, settings)
+    ])
+    settings = ConversionSettings(
+        output_dir=str(tmp_path), video_codec="libx265", audio_codec="aac", output_format="mkv",
+        video_bitrate=conversion_logic.BITRATE_TARGET_QUALITY, passthrough=conversion_logic.PASSTHROUGH_OFF,
+    )
+
+    async def run_job():
+        runner = job_runner.JobRunner(max_concurrent_jobs=1, calibration_cache=object())
+        job_id = uuid.uuid4()
+        await job_runner.run_db(database.create_job, job_id, None)
+        runner.submit(job_id, [str(videos / "a.mp4")], settings, concurrent_conversions=1)
+        assert await asyncio.to_thread(calibrating.wait, 10)
+        await runner.shutdown()
+
+    asyncio.run(run_job())
+    assert stopped.wait(5)
+
+def test_job_events_stream_over_sse_and_websocket(jobs_db, fake_ffmpeg, videos, tmp_path):
+    """Test that a job's events can be streamed, resumed and read over a WebSocket."""
+    with TestClient(api.app) as client:
+        job_id = client.post("/convert", json={"input_directory": str(videos), "output_directory": str(tmp_path / "out")}).json()["job_id"]
+        wait_for_job(client, job_id)
+
+        response = client.get(f"/jobs/{job_id}/events")
+        assert response.headers["content-type"].startswith("text/event-stream")
+        blocks = [block for block in response.text.split("\n\n") if block]
+        ids = [int(block.split("\n")[0].removeprefix("id: ")) for block in blocks]
+        assert ids == list(range(1, len(blocks) + 1))
+        assert "event: file_progress" in response.text
+        assert blocks[-1].endswith('data: {"status": "completed"}')
+
+        resumed = client.get(f"/jobs/{job_id}/events", headers={"Last-Event-ID": str(ids[-3])})
+        assert resumed.text.count("id: ") == 2
+        assert client.get(f"/jobs/{job_id}/events", headers={"Last-Event-ID": str(ids[-1])}).status_code == 204
+
+        with client.websocket_connect(f"/jobs/{job_id}/events?last_event_id={ids[-2]}") as websocket:
+            assert websocket.receive_json() == {"id": ids[-1], "event": "status", "data": {"status": "completed"}}
+
+        assert client.get(f"/jobs/{uuid.uuid4()}/events").status_code == 404
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+import conversion_logic
+import database
+from batch_manifest import BatchManifest, batch_id
+from conversion_logic import ConversionSettings
+from schemas import BatchFileStatus
+
+@pytest.fixture
+def jobs_db(tmp_path, monkeypatch):
+    """Fixture pointing the jobs database at a temporary directory."""
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "data")
+    monkeypatch.setattr(database, "DB_FILE", tmp_path / "data" / "jobs.db")
+
+@pytest.fixture
+def batch(tmp_path):
+    """Fixture providing an input folder with three videos and the settings of its batch."""
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for name in ("a.mp4", "b.mp4", "c.mp4"):
+        (input_dir / name).write_bytes(b"video")
+    (tmp_path / "out").mkdir()
+    settings = ConversionSettings(output_dir=str(tmp_path / "out"), video_codec="libx264", audio_codec="aac", output_format="mp4")
+    return input_dir, settings
+
+def test_batch_id_depends_on_output_settings_only(batch):
+    """Test that the same folders and output settings are recognised as the same batch."""
+    input_dir, settings = batch
+    same = ConversionSettings(**{**settings.__dict__, "verbose_logging": True, "delete_input": True})
+    other = ConversionSettings(**{**settings.__dict__, "video_codec": "libx265"})
+
+    assert batch_id(str(input_dir), settings) == batch_id(str(input_dir), same)
+    assert batch_id(str(input_dir), settings) != batch_id(str(input_dir), other)
+
+def test_interrupted_batch_resumes(jobs_db, batch):
+    """Test that reopening a crashed batch skips done files and cleans up partial outputs."""
+    input_dir, settings = batch
+    a, b, c = (str(input_dir / name) for name in ("a.mp4", "b.mp4", "c.mp4"))
+    out = settings.output_dir
+
+    manifest = BatchManifest(str(input_dir), settings)
+    manifest.set_status(a, BatchFileStatus.ENCODING, f"{out}/z_a.mp4")
+    open(f"{out}/z_a.mp4", "wb").write(b"converted")
+    manifest.set_status(a, BatchFileStatus.DONE)
+    manifest.set_status(b, BatchFileStatus.ENCODING, f"{out}/z_b.mp4")
+    partial = conversion_logic.temp_output_path(f"{out}/z_b.mp4")
+    open(partial, "wb").write(b"half")
+    manifest.set_status(c, BatchFileStatus.PENDING, f"{out}/z_c.mp4")
+    # Simulates a crash: nothing else is recorded
+    manifest.close()
+
+    resumed = BatchManifest(str(input_dir), settings)
+    assert resumed.is_done(a)
+    assert not resumed.is_done(b) and not resumed.is_done(c)
+    assert resumed.interrupted == 1
+    assert resumed.get(b).status == BatchFileStatus.PENDING
+    assert not os.path.exists(partial)
+    assert resumed.output_paths() == {b: f"{out}/z_b.mp4", c: f"{out}/z_c.mp4"}
+    assert resumed.counts()[BatchFileStatus.DONE] == 1
+    resumed.close()
+
+def test_output_renamed_before_the_crash_counts_as_done(jobs_db, batch):
+    """Test that an encoding file whose output is already in place is not converted again."""
+    input_dir, settings = batch
+    a = str(input_dir / "a.mp4")
+    output = f"{settings.output_dir}/z_a.mp4"
+
+    manifest = BatchManifest(str(input_dir), settings)
+    manifest.set_status(a, BatchFileStatus.ENCODING, output)
+    open(output, "wb").write(b"converted")
+    manifest.close()
+
+    resumed = BatchManifest(str(input_dir), settings)
+    assert resumed.is_done(a)
+    assert resumed.interrupted == 0
+    resumed.close()
+
+def test_deleted_output_is_converted_again(jobs_db, batch):
+    """Test that a done file whose output was removed is pending on the next run."""
+    input_dir, settings = batch
+    a = str(input_dir / "a.mp4")
+
+    manifest = BatchManifest(str(input_dir), settings)
+    manifest.set_status(a, BatchFileStatus.DONE, f"{settings.output_dir}/z_a.mp4")
+    manifest.close()
+
+    resumed = BatchManifest(str(input_dir), settings)
+    assert resumed.get(a).status == BatchFileStatus.PENDING
+    resumed.close()
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from concurrency import AdaptiveConcurrencyController, ConcurrencyLimiter, SystemSample
+
+def sample(cpu=50.0, load=0.5, memory=0.5, speed=None):
+    return SystemSample(cpu_percent=cpu, load_per_cpu=load, available_memory_fraction=memory, aggregate_speed=speed)
+
+@pytest.fixture
+def limiter():
+    """Fixture providing a limiter at 2 slots with one conversion waiting for a slot."""
+    limiter = ConcurrencyLimiter(2)
+    limiter._waiting = 1
+    return limiter
+
+def make_controller(limiter, **kwargs):
+    kwargs.setdefault("max_workers", 8)
+    return AdaptiveConcurrencyController(limiter, stable_samples=3, cooldown_samples=1, **kwargs)
+
+def test_limiter_respects_resized_limit():
+    """Test that lowering the limit blocks new slots and raising it frees them."""
+    limiter = ConcurrencyLimiter(1)
+    assert limiter.acquire()
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert not limiter.acquire(cancel_event)
+
+    limiter.set_limit(2)
+    assert limiter.acquire(cancel_event)
+    assert limiter.active == 2
+    limiter.release()
+    limiter.release()
+    assert limiter.active == 0
+
+def test_scales_up_only_after_stable_idle_samples(limiter):
+    """Test that concurrency rises once CPU has stayed low for the whole window."""
+    controller = make_controller(limiter)
+    assert controller.step(sample(cpu=30)) is None
+    assert controller.step(sample(cpu=95)) is None
+    assert controller.step(sample(cpu=30)) is None
+    assert limiter.limit == 2
+
+    controller.step(sample(cpu=30))
+    adjustment = controller.step(sample(cpu=30))
+    assert (adjustment.old_limit, adjustment.new_limit) == (2, 3)
+    assert "CPU" in adjustment.reason
+    assert controller.history == [adjustment]
+
+def test_does_not_scale_up_without_waiting_work(limiter):
+    """Test that spare CPU alone doesn't add slots nobody would use."""
+    limiter._waiting = 0
+    controller = make_controller(limiter)
+    for _ in range(5):
+        assert controller.step(sample(cpu=10)) is None
+    assert limiter.limit == 2
+
+def test_scales_down_on_memory_pressure(limiter):
+    """Test that sustained low free memory removes a slot."""
+    controller = make_controller(limiter)
+    for _ in range(2):
+        assert controller.step(sample(memory=0.05)) is None
+    adjustment = controller.step(sample(memory=0.05))
+    assert adjustment.new_limit == 1
+    assert "memory" in adjustment.reason
+
+def test_scales_down_on_high_load(limiter):
+    """Test that sustained load above the threshold removes a slot but never goes below the minimum."""
+    controller = make_controller(limiter)
+    for _ in range(3):
+        controller.step(sample(load=3.0))
+    assert limiter.limit == 1
+    for _ in range(10):
+        controller.step(sample(load=3.0))
+    assert limiter.limit == 1
+
+def test_reverts_increase_without_speed_gain(limiter):
+    """Test that a step up which doesn't improve aggregate speed is undone and capped."""
+    controller = make_controller(limiter)
+    for _ in range(3):
+        controller.step(sample(cpu=30, speed=4.0))
+    assert limiter.limit == 3
+
+    controller.step(sample(cpu=30, speed=4.0)) # Cooldown
+    for _ in range(2):
+        assert controller.step(sample(cpu=30, speed=4.1)) is None
+    adjustment = controller.step(sample(cpu=30, speed=4.1))
+    assert (adjustment.old_limit, adjustment.new_limit) == (3, 2)
+    assert "did not improve" in adjustment.reason
+
+    # The level that didn't help is not retried while the ceiling holds
+    for _ in range(8):
+        controller.step(sample(cpu=30, speed=4.1))
+    assert limiter.limit == 2
+
+def test_keeps_increase_with_speed_gain(limiter):
+    """Test that a step up which raises aggregate speed is kept and may be followed by another."""
+    controller = make_controller(limiter)
+    for _ in range(3):
+        controller.step(sample(cpu=30, speed=4.0))
+    controller.step(sample(cpu=30, speed=6.0)) # Cooldown
+    for _ in range(3):
+        controller.step(sample(cpu=30, speed=6.0))
+    assert limiter.limit == 4
+    assert all(a.new_limit > a.old_limit for a in controller.history)
@@ -0,0 +1,358 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import conversion_logic
+from conversion_logic import MediaInfo
+from probe_cache import ProbeCache
+
+FFPROBE_OUTPUT = {
+    "format": {
+        "format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+        "duration": "120.500000",
+        "bit_rate": "8000000",
+        "size": "120500000",
+    },
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "channels": 2, "tags": {"language": "eng"}},
+    ],
+}
+
+@pytest.fixture
+def fake_ffprobe(monkeypatch):
+    """Fixture that replaces ffprobe with canned JSON output."""
+    def fake_run(command, **kwargs):
+        assert command[0] == "ffprobe"
+        return subprocess.CompletedProcess(command, 0, stdout=json.dumps(FFPROBE_OUTPUT), stderr="")
+
+    monkeypatch.setattr(conversion_logic.subprocess, "run", fake_run)
+    monkeypatch.setattr(conversion_logic, "OPTIMIZED_BITRATE_MAP", {
+        "720p": {"h264": {"hevc": "1M"}},
+        "1080p": {"h264": {"hevc": "2M"}},
+    })
+    conversion_logic.reset_probe_counts()
+    yield
+    conversion_logic.reset_probe_counts()
+
+def test_probe_media_parses_format_and_streams(fake_ffprobe):
+    """Test that a single probe produces a typed, immutable MediaInfo."""
+    media_info = conversion_logic.probe_media("input.mp4")
+
+    assert isinstance(media_info, MediaInfo)
+    assert media_info.duration == pytest.approx(120.5)
+    assert media_info.bit_rate == 8000000
+    assert media_info.video_stream.height == 1080
+    assert media_info.audio_streams[0].language == "eng"
+    with pytest.raises(AttributeError):
+        media_info.duration = 1.0
+
+def test_single_probe_per_input(fake_ffprobe):
+    """Test that the per-file flow only spawns ffprobe once when MediaInfo is passed around."""
+    media_info = conversion_logic.probe_media("input.mp4")
+
+    details = conversion_logic.get_file_details(media_info)
+    resolution = conversion_logic.get_video_resolution_for_optimization(media_info)
+    bitrate = conversion_logic.get_optimized_bitrate(media_info, "hevc_nvenc", "6M")
+    command = conversion_logic.build_ffmpeg_command(
+        "input.mp4", "output.mp4", "hevc_nvenc", "aac", "optimized", "6M", False, media_info=media_info
+    )
+
+    assert details["resolution"] == "1920x1080"
+    assert details["bitrate"] == "8.00 Mbps"
+    assert resolution == {"resolution": "1080p", "codec_name": "h264"}
+    assert bitrate == "2M"
+    assert command[command.index("-b:v") + 1] == "2M"
+    assert conversion_logic.get_probe_count("input.mp4") == 1
+
+def test_helpers_still_accept_paths(fake_ffprobe):
+    """Test that passing a path keeps the old behaviour of probing on demand."""
+    assert conversion_logic.get_video_bitrate("input.mp4") == "8000000"
+    assert conversion_logic.get_probe_count("input.mp4") == 1
+
+def test_probe_failure_returns_defaults(monkeypatch):
+    """Test that a failed probe yields None and the helpers fall back to defaults."""
+    def failing_run(command, **kwargs):
+        raise FileNotFoundError("ffprobe")
+
+    monkeypatch.setattr(conversion_logic.subprocess, "run", failing_run)
+
+    assert conversion_logic.probe_media("missing.mp4") is None
+    assert conversion_logic.get_file_details("missing.mp4")["bitrate"] == "N/A"
+    assert conversion_logic.get_optimized_bitrate("missing.mp4", "hevc_nvenc", "6M") == "6M"
+
+def test_failed_probe_in_target_quality_mode_is_not_retried(monkeypatch, tmp_path):
+    """Test that planning an input whose probe failed falls back without spawning another ffprobe."""
+    def no_subprocess(command, **kwargs):
+        raise AssertionError(f"unexpected subprocess: {command}")
+
+    monkeypatch.setattr(conversion_logic.subprocess, "run", no_subprocess)
+    monkeypatch.setattr(conversion_logic.subprocess, "Popen", no_subprocess)
+    settings = conversion_logic.ConversionSettings(
+        output_dir=str(tmp_path), video_codec="libx265", audio_codec="aac", output_format="mkv",
+        video_bitrate=conversion_logic.BITRATE_TARGET_QUALITY, fallback_bitrate="5M",
+    )
+
+    plan = conversion_logic.plan_conversion("missing.mp4", None, settings, set())
+
+    assert plan.target_bitrate == "5M"
+
+def test_probe_media_reads_through_cache(fake_ffprobe, tmp_path):
+    """Test that a cached probe is reused until the file changes."""
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"0" * 16)
+    cache = ProbeCache(tmp_path / "probe_cache.db")
+    conversion_logic.set_probe_cache(cache)
+    try:
+        first = conversion_logic.probe_media(str(video))
+        second = conversion_logic.probe_media(str(video))
+        assert first == second
+        assert conversion_logic.get_probe_count(str(video)) == 1
+
+        video.write_bytes(b"0" * 32)
+        conversion_logic.probe_media(str(video))
+        assert conversion_logic.get_probe_count(str(video)) == 2
+    finally:
+        conversion_logic.set_probe_cache(None)
+        cache.close()
+
+def test_plan_conversions_probes_each_file_once(fake_ffprobe, tmp_path):
+    """Test that planning probes every input once and assigns unique output paths."""
+    settings = conversion_logic.ConversionSettings(
+        output_dir=str(tmp_path), video_codec="hevc_nvenc", audio_codec="aac", output_format="mp4",
+    )
+    video_files = ["a/clip.mp4", "b/clip.mp4", "c/other.mkv"]
+
+    plans = conversion_logic.plan_conversions(video_files, settings, probe_workers=3)
+
+    assert [plan.input_file for plan in plans] == video_files
+    assert len({plan.output_filepath for plan in plans}) == 3
+    assert all(plan.target_bitrate == "2M" for plan in plans)
+    assert plans[0].estimated_duration == pytest.approx(120.5)
+    # 2 Mbps video + 128 kbps audio over 120.5 seconds
+    assert plans[0].estimated_size == int((2_000_000 + 128_000) * 120.5 / 8)
+    assert all(conversion_logic.get_probe_count(f) == 1 for f in video_files)
+
+def test_build_command_with_planned_bitrate_does_not_probe(fake_ffprobe):
+    """Test that encode workers never probe once the bitrate is resolved."""
+    conversion_logic.build_ffmpeg_command("input.mp4", "output.mp4", "hevc_nvenc", "aac", "2M", "6M", True)
+
+    assert conversion_logic.get_probe_count() == 0
+
+@pytest.fixture
+def media_tree(tmp_path):
+    """Fixture building a nested directory tree of media and non-media files."""
+    (tmp_path / "b" / "deep").mkdir(parents=True)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "skip").mkdir()
+    (tmp_path / "top.mp4").write_bytes(b"x" * 10)
+    (tmp_path / "notes.txt").write_bytes(b"x" * 10)
+    (tmp_path / "a" / "clip.MKV").write_bytes(b"x" * 2000)
+    (tmp_path / "b" / "sample.mp4").write_bytes(b"x" * 10)
+    (tmp_path / "b" / "deep" / "movie.mov").write_bytes(b"x" * 2000)
+    (tmp_path / "skip" / "ignored.mp4").write_bytes(b"x" * 2000)
+    return tmp_path
+
+def _names(paths):
+    return [p.rsplit("/", 1)[-1] for p in paths]
+
+def test_scan_video_files_is_recursive_and_lazy(media_tree):
+    """Test that the scanner walks nested folders and yields files incrementally."""
+    files = conversion_logic.scan_video_files(str(media_tree))
+
+    assert next(files).endswith("top.mp4")
+    assert _names(files) == ["clip.MKV", "sample.mp4", "movie.mov", "ignored.mp4"]
+
+def test_scan_video_files_filters(media_tree):
+    """Test glob, size and depth filters."""
+    options = conversion_logic.ScanOptions(exclude_globs=("skip", "sample*"), min_size=1000)
+    assert _names(conversion_logic.scan_video_files(str(media_tree), options)) == ["clip.MKV", "movie.mov"]
+
+    options = conversion_logic.ScanOptions(include_globs=("b/*",), max_depth=1)
+    assert _names(conversion_logic.scan_video_files(str(media_tree), options)) == ["sample.mp4"]
+
+def test_scan_video_files_skips_nested_output_dir_and_partial_outputs(media_tree):
+    """Test that an output folder inside the input folder and temporary outputs are never scanned as inputs."""
+    output_dir = media_tree / "b" / "converted"
+    output_dir.mkdir()
+    (output_dir / "z_sample.mp4").write_bytes(b"x" * 10)
+    (media_tree / "a" / ".clip.1a2b3c4d.part.mkv").write_bytes(b"x" * 10)
+    segments = media_tree / "a" / ".long.0f0f0f0f.part.mkv.segments"
+    segments.mkdir()
+    (segments / "segment_000.mkv").write_bytes(b"x" * 10)
+
+    options = conversion_logic.ScanOptions(exclude_dirs=(str(output_dir),))
+    assert _names(conversion_logic.scan_video_files(str(media_tree), options)) == ["top.mp4", "clip.MKV", "sample.mp4", "movie.mov", "ignored.mp4"]
+    assert not conversion_logic.matches_scan_options(str(media_tree), str(output_dir / "z_sample.mp4"), options)
+    assert not conversion_logic.matches_scan_options(str(media_tree), str(segments / "segment_000.mkv"), options)
+
+def test_scan_video_files_symlink_policies(media_tree):
+    """Test that symlinks are handled per policy and directory loops terminate."""
+    (media_tree / "a" / "loop").symlink_to(media_tree, target_is_directory=True)
+    (media_tree / "link.mp4").symlink_to(media_tree / "top.mp4")
+
+    ignore = conversion_logic.ScanOptions(symlinks=conversion_logic.SYMLINKS_IGNORE)
+    assert "link.mp4" not in _names(conversion_logic.scan_video_files(str(media_tree), ignore))
+
+    files_only = conversion_logic.ScanOptions(symlinks=conversion_logic.SYMLINKS_FILES)
+    assert _names(conversion_logic.scan_video_files(str(media_tree), files_only)).count("top.mp4") == 1
+
+    follow = conversion_logic.ScanOptions(symlinks=conversion_logic.SYMLINKS_FOLLOW)
+    followed = _names(conversion_logic.scan_video_files(str(media_tree), follow))
+    assert "link.mp4" in followed
+    assert followed.count("top.mp4") == 1
+
+def test_find_video_files_stays_non_recursive(media_tree):
+    """Test that the list-based helper keeps its original top-level behaviour."""
+    assert _names(conversion_logic.find_video_files(str(media_tree))) == ["top.mp4"]
+
+def test_find_video_files_missing_directory():
+    with pytest.raises(ValueError):
+        conversion_logic.find_video_files("/does/not/exist")
+
+def test_iter_conversion_plans_consumes_input_lazily(fake_ffprobe, tmp_path):
+    """Test that plans are yielded before the whole input has been discovered."""
+    settings = conversion_logic.ConversionSettings(
+        output_dir=str(tmp_path), video_codec="hevc_nvenc", audio_codec="aac", output_format="mp4",
+    )
+    consumed = []
+
+    def discover():
+        for i in range(1000):
+            consumed.append(i)
+            yield f"clip_{i}.mp4"
+
+    plans = conversion_logic.iter_conversion_plans(discover(), settings, probe_workers=2)
+    first = next(plans)
+    plans.close()
+
+    assert first.input_file == "clip_0.mp4"
+    assert len(consumed) < 1000
+
+def test_finalize_output_renames_or_removes_the_temp_file(tmp_path):
+    """Test that outputs only appear under their real name once the conversion succeeded."""
+    output = str(tmp_path / "z_clip.mp4")
+    temp = conversion_logic.temp_output_path(output)
+    assert temp != conversion_logic.temp_output_path(output)
+    assert temp.endswith(".mp4") and os.path.basename(temp).startswith(".z_clip.")
+
+    open(temp, "wb").write(b"partial")
+    assert conversion_logic.partial_outputs(output) == [temp]
+    result = conversion_logic.finalize_output({"success": False, "output_filepath": output, "error": "boom"}, temp)
+    assert not result["success"]
+    assert not os.path.exists(temp) and not os.path.exists(output)
+
+    open(temp, "wb").write(b"done")
+    result = conversion_logic.finalize_output({"success": True, "output_filepath": output}, temp)
+    assert result["success"]
+    assert open(output, "rb").read() == b"done"
+    assert conversion_logic.partial_outputs(output) == []
+
+def test_iter_conversion_plans_reuses_assigned_outputs(fake_ffprobe, tmp_path):
+    """Test that outputs assigned by an earlier run are reused and never handed out twice."""
+    settings = conversion_logic.ConversionSettings(
+        output_dir=str(tmp_path), video_codec="hevc_nvenc", audio_codec="aac", output_format="mp4",
+    )
+    assigned = {os.path.abspath("b/clip.mp4"): str(tmp_path / "z_clip.mp4")}
+
+    plans = list(conversion_logic.iter_conversion_plans(["a/clip.mp4", "b/clip.mp4"], settings, output_paths=assigned))
+
+    assert plans[1].output_filepath == str(tmp_path / "z_clip.mp4")
+    assert plans[0].output_filepath == str(tmp_path / "z_1_clip.mp4")
+
+def _hevc_media(bit_rate):
+    return MediaInfo.from_ffprobe("in.mkv", {
+        "format": {"format_name": "matroska,webm", "duration": "600.0", "bit_rate": str(bit_rate), "size": "100000000"},
+        "streams": [
+            {"index": 0, "codec_type": "video", "codec_name": "hevc", "width": 1920, "height": 1080},
+            {"index": 1, "codec_type": "audio", "codec_name": "aac", "bit_rate": "128000"},
+        ],
+    })
+
+@pytest.mark.parametrize("bit_rate, passthrough, threshold, action", [
+    (1_628_000, "copy", 1.0, conversion_logic.ACTION_COPY),
+    (1_628_000, "skip", 1.0, conversion_logic.ACTION_SKIP),
+    (1_628_000, "off", 1.0, conversion_logic.ACTION_ENCODE),
+    (2_628_000, "copy", 1.0, conversion_logic.ACTION_ENCODE),
+    (2_628_000, "copy", 1.5, conversion_logic.ACTION_COPY),
+])
+def test_decide_conversion(bit_rate, passthrough, threshold, action):
+    """Test that inputs already in the target codec at or below the threshold aren't re-encoded."""
+    settings = conversion_logic.ConversionSettings(
+        output_dir="out", video_codec="hevc_nvenc", audio_codec="aac", output_format="mp4",
+        passthrough=passthrough, passthrough_threshold=threshold,
+    )
+    # The video bitrate is the container's minus the audio's: 1.5 or 2.5 Mbps against a 2M target
+    decision = conversion_logic.decide_conversion(_hevc_media(bit_rate), settings, "2M")
+
+    assert decision.action == action
+    assert bool(decision.reason) == (action != conversion_logic.ACTION_ENCODE)
+
+def test_other_codecs_are_always_encoded():
+    settings = conversion_logic.ConversionSettings(output_dir="out", video_codec="av1_nvenc", audio_codec="aac", output_format="mp4")
+
+    assert conversion_logic.decide_conversion(_hevc_media(1_000_000), settings, "2M").action == conversion_logic.ACTION_ENCODE
+    assert conversion_logic.decide_conversion(None, settings, "2M").action == conversion_logic.ACTION_ENCODE
+
+def test_copy_plan_remuxes_without_encoding_video(tmp_path):
+    """Test that a copy plan copies the video stream, and the audio when it already matches."""
+    settings = conversion_logic.ConversionSettings(output_dir=str(tmp_path), video_codec="hevc_nvenc", audio_codec="aac", output_format="mp4")
+    plan = conversion_logic.plan_conversion("in.mkv", _hevc_media(1_000_000), settings)
+
+    assert plan.action == conversion_logic.ACTION_COPY
+    assert conversion_logic.build_plan_command(plan, settings, threads=4) == [
+        "ffmpeg", "-i", "in.mkv", "-map", "0:0", "-map", "0:1", "-c:v:0", "copy", "-c:a:0", "copy", plan.output_filepath,
+    ]
+
+def test_passthrough_report_estimates_cpu_hours_saved():
+    report = conversion_logic.PassthroughReport()
+    media = _hevc_media(1_000_000)
+    report.add_plan(conversion_logic.ConversionPlan("a.mkv", "z_a.mp4", "2M", media, 3600.0, None, conversion_logic.ACTION_COPY))
+    report.add_plan(conversion_logic.ConversionPlan("b.mkv", "z_b.mp4", "2M", media, 1800.0, None, conversion_logic.ACTION_SKIP))
+    assert report.cpu_hours_saved() is None
+
+    # One measured encode: 600 media seconds for 1200 CPU-seconds, i.e. 2 CPU-seconds per media second
+    report.add_encode(600.0, 1200.0)
+
+    assert report.cpu_hours_saved() == pytest.approx(3.0)
+    assert report.describe() == "Passthrough: 1 remuxed, 1 skipped instead of re-encoded; ~3.00 CPU-hours saved."
+
+MULTI_STREAM_PROBE = {
+    "format": {"format_name": "matroska,webm", "duration": "60.0"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac"},
+        {"index": 2, "codec_type": "audio", "codec_name": "ac3"},
+        {"index": 3, "codec_type": "subtitle", "codec_name": "subrip"},
+        {"index": 4, "codec_type": "subtitle", "codec_name": "hdmv_pgs_subtitle"},
+        {"index": 5, "codec_type": "attachment", "codec_name": "ttf"},
+        {"index": 6, "codec_type": "video", "codec_name": "mjpeg", "disposition": {"attached_pic": 1}},
+    ],
+}
+
+def test_every_stream_is_planned_for_the_container():
+    """Test that audio is copied or transcoded per track and subtitles/attachments fit the container."""
+    media_info = MediaInfo.from_ffprobe("in.mkv", MULTI_STREAM_PROBE)
+
+    command = conversion_logic.build_ffmpeg_command(
+        "in.mkv", "out.mp4", "libx265", "aac", "2M", "6M", False, media_info=media_info, threads=2,
+    )
+    assert command[command.index("-i") + 2:command.index("-b:v")] == [
+        "-map", "0:0", "-map", "0:1", "-map", "0:2", "-map", "0:3",
+        "-c:v:0", "libx265", "-x265-params", "pools=2",
+        "-c:a:0", "copy", "-c:a:1", "aac", "-c:s:0", "mov_text",
+    ]
+
+    plans = conversion_logic.plan_streams(media_info, "libx265", "aac", "mkv")
+    assert [plan.action for plan in plans] == ["encode", "copy", "encode", "copy", "copy", "copy", "drop"]
+
+    # WebM only holds WebVTT subtitles and no attachments
+    plans = conversion_logic.plan_streams(media_info, "libvpx-vp9", "libopus", "webm")
+    assert [(plan.action, plan.codec) for plan in plans[3:6]] == [("encode", "webvtt"), ("drop", None), ("drop", None)]
+    assert plans[5].describe() == "#5 attachment (ttf) dropped: webm can't hold attachments"
+
+    plans = conversion_logic.plan_streams(media_info, "libx265", "aac", "mkv", subtitles="drop", attachments="drop")
+    assert [plan.index for plan in plans if plan.action != "drop"] == [0, 1, 2]
+    assert plans[4].describe() == "#4 subtitle (hdmv_pgs_subtitle) dropped: subtitles are dropped"
@@ -0,0 +1,86 @@
+import pytest
+
+import conversion_logic
+from cpu_allocation import CpuAllocator, CpuBudget, cgroup_cpu_quota, encoder_thread_args, split_evenly
+
+def test_cgroup_v2_quota(tmp_path):
+    """Test that a cgroup v2 cpu.max quota is read as a number of cores."""
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert cgroup_cpu_quota(str(tmp_path)) == pytest.approx(2.5)
+
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cgroup_cpu_quota(str(tmp_path)) is None
+
+def test_cgroup_v1_quota(tmp_path):
+    """Test that a cgroup v1 CFS quota is read, and -1 means unlimited."""
+    cpu_dir = tmp_path / "cpu"
+    cpu_dir.mkdir()
+    (cpu_dir / "cpu.cfs_quota_us").write_text("200000\n")
+    (cpu_dir / "cpu.cfs_period_us").write_text("100000\n")
+    assert cgroup_cpu_quota(str(tmp_path)) == pytest.approx(2.0)
+
+    (cpu_dir / "cpu.cfs_quota_us").write_text("-1\n")
+    assert cgroup_cpu_quota(str(tmp_path)) is None
+    assert cgroup_cpu_quota(str(tmp_path / "missing")) is None
+
+def test_split_evenly():
+    """Test that shares differ by at most one and are never zero."""
+    assert split_evenly(8, 3) == [3, 3, 2]
+    assert split_evenly(2, 4) == [1, 1, 1, 1]
+
+def test_allocator_splits_cores_between_expected_encodes():
+    """Test that the first encodes don't take every core while the others are starting."""
+    allocator = CpuAllocator(CpuBudget(cores=8, cpus=tuple(range(8))), expected_encodes=3)
+    assert [allocator.acquire(key).threads for key in ("a", "b", "c")] == [3, 3, 2]
+
+    allocator.release("a")
+    allocator.release("b")
+    allocator.set_expected_encodes(1)
+    assert allocator.acquire("d").threads == 4 # Shared with the still running "c"
+    allocator.release("c")
+    allocator.release("d")
+    assert allocator.acquire("e").threads == 8
+
+def test_allocator_reuses_released_shares(monkeypatch):
+    """Test that an encode starting after another finished takes the free share, not one still in use."""
+    monkeypatch.setattr("cpu_allocation.os.sched_setaffinity", lambda tid, cpus: None, raising=False)
+    allocator = CpuAllocator(CpuBudget(cores=8, cpus=tuple(range(8))), expected_encodes=3, pin_affinity=True)
+    a, b, c = (allocator.acquire(key) for key in ("a", "b", "c"))
+
+    allocator.release("a")
+    d = allocator.acquire("d")
+
+    assert (d.threads, d.cpus) == (a.threads, a.cpus)
+    assert not set(d.cpus) & set(c.cpus)
+
+def test_allocator_assigns_disjoint_cpu_sets(monkeypatch):
+    """Test that pinned encodes get disjoint CPU sets that are rebalanced when one finishes."""
+    applied = {}
+    monkeypatch.setattr("cpu_allocation.os.sched_setaffinity", lambda tid, cpus: applied.__setitem__(tid, tuple(cpus)), raising=False)
+    monkeypatch.setattr("cpu_allocation.os.listdir", lambda path: [path.split("/")[2]])
+    allocator = CpuAllocator(CpuBudget(cores=4, cpus=(0, 1, 2, 3)), expected_encodes=1, pin_affinity=True)
+
+    assert allocator.acquire("a").cpus == (0, 1, 2, 3)
+    allocator.attach("a", 100)
+    assert allocator.acquire("b").cpus == (2, 3)
+    allocator.attach("b", 200)
+    assert applied == {100: (0, 1), 200: (2, 3)}
+
+    allocator.release("a")
+    assert applied[200] == (0, 1, 2, 3)
+
+def test_encoder_thread_args():
+    """Test the per-encoder thread options."""
+    assert encoder_thread_args("libx264", 4) == ["-threads", "4"]
+    assert encoder_thread_args("libx265", 4) == ["-x265-params", "pools=4"]
+    assert encoder_thread_args("libsvtav1", 2) == ["-svtav1-params", "lp=2"]
+    assert encoder_thread_args("hevc_nvenc", 4) == []
+
+def test_build_ffmpeg_command_limits_threads():
+    """Test that decoder and encoder thread limits are placed around -i."""
+    command = conversion_logic.build_ffmpeg_command("in.mp4", "out.mp4", "libx264", "aac", "2M", "6M", False, threads=3)
+    assert command[:5] == ["ffmpeg", "-threads", "3", "-i", "in.mp4"]
+    assert command[5:9] == ["-c:v", "libx264", "-threads", "3"]
+
+    command = conversion_logic.build_ffmpeg_command("in.mp4", "out.mp4", "libx264", "aac", "2M", "6M", False)
+    assert "-threads" not in command
@@ -15,21 +15,8 @@ def test_db(monkeypatch):
     # Monkeypatch the get_db_connection to return our in-memory connection
     monkeypatch.setattr(database, 'get_db_connection', lambda: conn)
     
-    # Manually initialize the schema in the in-memory database
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS jobs (
-        id TEXT PRIMARY KEY,
-        correlation_id TEXT,
-        status TEXT NOT NULL,
-        progress REAL NOT NULL,
-        logs TEXT,
-        result TEXT,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL
-    )
-    """)
-    conn.commit()
+    # Initialize the schema in the in-memory database
+    database.create_schema(conn)
     
     yield conn
     
@@ -89,6 +76,27 @@ def test_update_job_status(test_db):
     # Check that the updated_at timestamp has changed
     assert updated_job.updated_at > original_updated_at
 
+def test_update_job_progress(test_db):
+    """Test updating a job's progress percentage."""
+    job_id = uuid.uuid4()
+    database.create_job(test_db, job_id, "test-update-progress")
+
+    database.update_job_progress(test_db, job_id, 42.5)
+
+    updated_job = database.get_job(test_db, job_id)
+    assert updated_job is not None
+    assert updated_job.progress == 42.5
+
+def test_update_job_result(test_db):
+    """Test storing a job's output files."""
+    job_id = uuid.uuid4()
+    database.create_job(test_db, job_id, "test-update-result")
+
+    database.update_job_result(test_db, job_id, ["/out/z_a.mp4", "/out/z_b.mp4"])
+
+    updated_job = database.get_job(test_db, job_id)
+    assert updated_job.result == ["/out/z_a.mp4", "/out/z_b.mp4"]
+
 def test_log_to_job(test_db):
     """Test appending log messages to a job."""
     job_id = uuid.uuid4()
@@ -117,3 +125,138 @@ def test_log_to_job_non_existent(test_db):
         database.log_to_job(test_db, uuid.uuid4(), "This should not crash.")
     except Exception as e:
         pytest.fail(f"log_to_job raised an unexpected exception: {e}")
+
+@pytest.fixture
+def file_db(tmp_path, monkeypatch):
+    """Fixture providing an initialized on-disk database, needed for multi-threaded access."""
+    monkeypatch.setattr(database, "DB_PATH", tmp_path)
+    monkeypatch.setattr(database, "DB_FILE", tmp_path / "jobs.db")
+    database.initialize_database()
+    conn = database.get_db_connection()
+    yield conn
+    conn.close()
+
+def test_initialize_database_enables_wal(file_db):
+    """Test that the database file is switched to write-ahead logging."""
+    assert file_db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_job_writer_group_commits_in_order(file_db):
+    """Test that queued updates are applied in order, in a few commits, keeping the latest progress."""
+    job_id = uuid.uuid4()
+    database.create_job(file_db, job_id, "test-writer")
+
+    writer = database.JobWriter(batch_window=0.5)
+    for i in range(100):
+        writer.update_progress(job_id, float(i))
+        writer.log(job_id, f"line {i}")
+    writer.update_status(job_id, JobStatus.COMPLETED)
+    writer.update_result(job_id, ["/out/z_a.mp4"])
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    job = database.get_job(file_db, job_id)
+    assert job.progress == 99.0
+    assert job.status == JobStatus.COMPLETED
+    assert job.result == ["/out/z_a.mp4"]
+    assert job.logs[1:] == [f"line {i}" for i in range(100)]
+    assert writer.commits <= 2
+
+def test_log_pages_and_tail(test_db):
+    """Test paging through a job's log and fetching only its tail."""
+    job_id = uuid.uuid4()
+    database.create_job(test_db, job_id, "test-log-pages")
+    for i in range(10):
+        database.log_to_job(test_db, job_id, f"line {i}", level="error" if i == 9 else "info")
+
+    first_page = database.get_job_logs(test_db, job_id, limit=4)
+    assert [entry.seq for entry in first_page] == [1, 2, 3, 4]
+    next_page = database.get_job_logs(test_db, job_id, after_seq=first_page[-1].seq, limit=100)
+    assert [entry.message for entry in next_page] == [f"line {i}" for i in range(3, 10)]
+    assert next_page[-1].level == "error"
+
+    assert database.get_job(test_db, job_id, log_tail=2).logs == ["line 8", "line 9"]
+
+def test_log_to_unknown_job_is_ignored(test_db):
+    """Test that logging to a missing job doesn't create orphaned log lines."""
+    database.log_to_job(test_db, uuid.uuid4(), "orphan")
+    assert test_db.execute("SELECT COUNT(*) FROM job_logs").fetchone()[0] == 0
+
+def test_migrates_json_logs_to_table():
+    """Test that a version 0 database's JSON log arrays move into job_logs."""
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+    CREATE TABLE jobs (
+        id TEXT PRIMARY KEY, correlation_id TEXT, status TEXT NOT NULL, progress REAL NOT NULL,
+        logs TEXT, result TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL
+    )
+    """)
+    job_id = uuid.uuid4()
+    now_iso = datetime.now(timezone.utc).isoformat()
+    conn.execute(
+        "INSERT INTO jobs VALUES (?, NULL, 'completed', 100.0, ?, NULL, ?, ?)",
+        (str(job_id), '["Job created", "Converted a.mp4"]', now_iso, now_iso),
+    )
+    conn.commit()
+
+    database.create_schema(conn)
+    database.create_schema(conn) # Migrating twice must be harmless
+
+    assert database.get_job(conn, job_id).logs == ["Job created", "Converted a.mp4"]
+    assert conn.execute("SELECT logs FROM jobs").fetchone()[0] is None
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+    database.log_to_job(conn, job_id, "Appended after migration")
+    assert database.get_job(conn, job_id, log_tail=1).logs == ["Appended after migration"]
+    conn.close()
+
+def insert_jobs(conn, count, start=datetime(2025, 1, 1, tzinfo=timezone.utc)):
+    """Inserts jobs created one minute apart, alternating status, and returns their IDs oldest first."""
+    job_ids = []
+    for i in range(count):
+        job_id = uuid.uuid4()
+        created_iso = start.replace(minute=i).isoformat()
+        status = JobStatus.COMPLETED if i % 2 else JobStatus.FAILED
+        conn.execute(
+            "INSERT INTO jobs (id, correlation_id, status, progress, created_at, updated_at) VALUES (?, ?, ?, 0.0, ?, ?)",
+            (str(job_id), f"corr-{i % 3}", status.value, created_iso, created_iso),
+        )
+        job_ids.append(job_id)
+    conn.commit()
+    return job_ids
+
+def test_list_jobs_keyset_pagination(test_db):
+    """Test that pages follow each other newest first without gaps or repeats."""
+    job_ids = insert_jobs(test_db, 7)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = database.list_jobs(test_db, limit=3, cursor=cursor)
+        seen.extend(job.id for job in page)
+        if cursor is None:
+            break
+    assert seen == list(reversed(job_ids))
+
+    with pytest.raises(ValueError):
+        database.list_jobs(test_db, cursor="not-a-cursor")
+
+def test_list_jobs_filters(test_db):
+    """Test the status, correlation ID and time-range filters."""
+    job_ids = insert_jobs(test_db, 6)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    completed, _ = database.list_jobs(test_db, status=JobStatus.COMPLETED)
+    assert [job.id for job in completed] == [job_ids[5], job_ids[3], job_ids[1]]
+
+    by_correlation, _ = database.list_jobs(test_db, correlation_id="corr-0")
+    assert [job.id for job in by_correlation] == [job_ids[3], job_ids[0]]
+
+    in_range, _ = database.list_jobs(test_db, created_after=start.replace(minute=2), created_before=start.replace(minute=4))
+    assert [job.id for job in in_range] == [job_ids[3], job_ids[2]]
+
+def test_list_jobs_uses_indexes(test_db):
+    """Test that filtered listings are index range scans rather than table scans."""
+    plan = test_db.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM jobs WHERE status = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT 5",
+        ("completed", "x", "y"),
+    ).fetchall()
+    assert "idx_jobs_status_created" in plan[0]["detail"]
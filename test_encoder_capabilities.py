@@ -0,0 +1,94 @@
+import pytest
+
+from conversion_logic import ConversionSettings
+from encoder_capabilities import FALLBACK_FAIL, CapabilityRegistry, EncoderCapabilities, parse_encoders, parse_hwaccels
+
+ENCODERS_OUTPUT = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ V....D libx265              libx265 H.265 / HEVC (codec hevc)
+ V....D hevc_nvenc           NVIDIA NVENC hevc encoder (codec hevc)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+
+class FakeFfmpeg:
+    def __init__(self, encoders=("libx264", "libx265", "hevc_nvenc", "aac"), broken=("hevc_nvenc",)):
+        self.capabilities = EncoderCapabilities("ffmpeg version 7.0", frozenset(encoders), ("cuda",))
+        self.broken = broken
+        self.probes = 0
+        self.tests = []
+        self.now = 0.0
+
+    def probe(self):
+        self.probes += 1
+        return self.capabilities
+
+    def test(self, codec):
+        self.tests.append(codec)
+        return "Cannot load libcuda.so.1" if codec in self.broken else None
+
+    def registry(self, ttl=600.0):
+        return CapabilityRegistry(ttl, self.probe, self.test, lambda: self.now)
+
+
+def settings(video_codec="hevc_nvenc", audio_codec="aac"):
+    return ConversionSettings(output_dir="out", video_codec=video_codec, audio_codec=audio_codec, output_format="mkv")
+
+
+def test_parses_encoder_and_hwaccel_listings():
+    assert parse_encoders(ENCODERS_OUTPUT) == {"libx264", "libx265", "hevc_nvenc", "aac"}
+    assert parse_hwaccels("Hardware acceleration methods:\ncuda\nvaapi\n\n") == ("cuda", "vaapi")
+
+
+def test_capabilities_and_encoder_tests_are_cached_until_the_ttl_expires():
+    ffmpeg = FakeFfmpeg()
+    registry = ffmpeg.registry(ttl=60.0)
+    for _ in range(3):
+        assert registry.get().version == "ffmpeg version 7.0"
+        assert registry.encoder_error("hevc_nvenc") == "Cannot load libcuda.so.1"
+    assert (ffmpeg.probes, ffmpeg.tests) == (1, ["hevc_nvenc"])
+
+    ffmpeg.now = 61.0
+    registry.encoder_error("hevc_nvenc")
+    assert (ffmpeg.probes, ffmpeg.tests) == (2, ["hevc_nvenc", "hevc_nvenc"])
+
+
+def test_failed_probe_is_retried_sooner_and_does_not_block_the_batch():
+    ffmpeg = FakeFfmpeg()
+    ffmpeg.capabilities = EncoderCapabilities(None, frozenset(), (), error="No such file or directory: 'ffmpeg'")
+    registry = ffmpeg.registry()
+    resolved, notes = registry.resolve_settings(settings())
+    assert resolved == settings()
+    assert "No such file or directory" in notes[0]
+    ffmpeg.now = 31.0
+    registry.get()
+    assert ffmpeg.probes == 2
+
+
+def test_unusable_hardware_encoder_falls_back_to_the_cpu_encoder_of_its_codec():
+    registry = FakeFfmpeg().registry()
+    resolved, notes = registry.resolve_settings(settings("hevc_nvenc"))
+    assert resolved.video_codec == "libx265"
+    assert "using libx265 instead" in notes[0]
+
+    # Usable encoders, CPU encoders and codec names ffmpeg picks an encoder for are kept without a test encode
+    ffmpeg = FakeFfmpeg(broken=())
+    for codec in ("hevc_nvenc", "libx264", "h264", "copy"):
+        assert ffmpeg.registry().resolve_settings(settings(codec)) == (settings(codec), [])
+    assert ffmpeg.tests == ["hevc_nvenc"]
+
+
+def test_fail_policy_and_missing_encoders_reject_the_batch():
+    registry = FakeFfmpeg().registry()
+    with pytest.raises(ValueError, match="hevc_nvenc is not available"):
+        registry.resolve_settings(settings("hevc_nvenc"), FALLBACK_FAIL)
+    with pytest.raises(ValueError, match="av1_nvenc"):
+        # No CPU AV1 encoder in this build to fall back to
+        registry.resolve_settings(settings("av1_nvenc"))
+    with pytest.raises(ValueError, match="Audio codec libopus"):
+        registry.resolve_settings(settings("libx264", "libopus"))
+    with pytest.raises(ValueError, match="Unknown codec fallback policy"):
+        registry.resolve_settings(settings(), "gpu")
@@ -0,0 +1,69 @@
+import pytest
+
+from eta import EtaEstimator, resolution_bucket
+
+@pytest.fixture
+def clock():
+    """Fixture providing a manually advanced clock."""
+    now = [0.0]
+    return now
+
+def test_resolution_bucket():
+    """Test that heights round up to standard buckets."""
+    assert resolution_bucket(1080) == "1080p"
+    assert resolution_bucket(800) == "1080p"
+    assert resolution_bucket(5000) == "4320p"
+    assert resolution_bucket(None) == "unknown"
+
+def test_eta_is_weighted_by_media_seconds(clock):
+    """Test that a long recording dominates the estimate, not the file count."""
+    estimator = EtaEstimator(concurrency=1, clock=lambda: clock[0])
+    estimator.add_file("clip.mp4", 30.0, "h264", 1080)
+    estimator.add_file("recording.mp4", 3 * 3600.0, "h264", 1080)
+
+    estimator.start_file("clip.mp4")
+    clock[0] = 15.0
+    estimator.update("clip.mp4", 30.0, speed=2.0)
+    estimator.finish_file("clip.mp4")
+
+    # 3 hours of media at the learned 2x speed
+    assert estimator.eta() == pytest.approx(3 * 3600.0 / 2.0)
+    assert estimator.remaining_media_seconds() == pytest.approx(3 * 3600.0)
+
+def test_eta_uses_live_speed_of_running_files(clock):
+    """Test that running files are estimated from their own live speed."""
+    estimator = EtaEstimator(concurrency=2, clock=lambda: clock[0])
+    estimator.add_file("fast.mp4", 100.0, "h264", 720)
+    estimator.add_file("slow.mp4", 100.0, "hevc", 2160)
+    estimator.start_file("fast.mp4")
+    estimator.start_file("slow.mp4")
+
+    estimator.update("fast.mp4", 50.0, speed=10.0)
+    estimator.update("slow.mp4", 50.0, speed=0.5)
+
+    # The slow file needs 100 more seconds, which bounds the whole batch
+    assert estimator.eta() == pytest.approx(100.0)
+
+def test_throughput_is_tracked_per_class(clock):
+    """Test that pending files use the throughput of their own codec/resolution class."""
+    estimator = EtaEstimator(concurrency=1, clock=lambda: clock[0])
+    estimator.add_file("a.mp4", 60.0, "h264", 720)
+    estimator.add_file("b.mp4", 60.0, "h264", 2160)
+    estimator.add_file("c.mp4", 60.0, "h264", 2160)
+
+    estimator.start_file("b.mp4")
+    estimator.update("b.mp4", 10.0, speed=0.5)
+    estimator.start_file("a.mp4")
+    estimator.update("a.mp4", 10.0, speed=5.0)
+
+    # Pending c.mp4 is 2160p, so it uses 0.5x rather than the faster 720p class
+    pending_2160 = 60.0 / 0.5
+    running = 50.0 / 0.5 + 50.0 / 5.0
+    assert estimator.eta() == pytest.approx(pending_2160 + running)
+
+def test_eta_is_zero_when_everything_finished(clock):
+    estimator = EtaEstimator(concurrency=1, clock=lambda: clock[0])
+    estimator.add_file("a.mp4", 10.0)
+    estimator.finish_file("a.mp4")
+
+    assert estimator.eta() == 0.0
@@ -0,0 +1,82 @@
+import subprocess
+import sys
+
+import pytest
+
+from ffmpeg_progress import ProgressParser, ProgressThrottle, FfmpegProgress, stream_ffmpeg_progress
+
+PROGRESS_BLOCK = """frame=250
+fps=49.8
+stream_0_0_q=28.0
+bitrate=2011.3kbits/s
+total_size=2621440
+out_time_us=10000000
+out_time_ms=10000000
+out_time=00:00:10.000000
+dup_frames=0
+drop_frames=0
+speed=1.99x
+progress=continue
+"""
+
+def test_parser_emits_snapshot_per_block():
+    """Test that a complete key=value block yields one progress snapshot."""
+    parser = ProgressParser("input.mp4", duration=40.0)
+
+    snapshots = [parser.feed(line) for line in PROGRESS_BLOCK.splitlines()]
+
+    assert snapshots[:-1] == [None] * (len(snapshots) - 1)
+    progress = snapshots[-1]
+    assert progress.out_time == pytest.approx(10.0)
+    assert progress.fps == pytest.approx(49.8)
+    assert progress.speed == pytest.approx(1.99)
+    assert progress.percent == pytest.approx(25.0)
+    assert not progress.done
+
+def test_parser_handles_unknown_duration_and_end():
+    """Test that percent is None without a duration and the end block is flagged."""
+    parser = ProgressParser("input.mp4", duration=None)
+    parser.feed("out_time_us=N/A")
+    parser.feed("out_time=00:01:30.500000")
+    parser.feed("speed=N/A")
+    progress = parser.feed("progress=end")
+
+    assert progress.out_time == pytest.approx(90.5)
+    assert progress.speed is None
+    assert progress.percent is None
+    assert progress.done
+
+def test_throttle_limits_rate_but_passes_final_update():
+    """Test that updates are dropped inside the interval, except the final one."""
+    now = [0.0]
+    throttle = ProgressThrottle(interval=1.0, clock=lambda: now[0])
+    update = FfmpegProgress("input.mp4", 1.0, None, None, None)
+    final = FfmpegProgress("input.mp4", 2.0, None, None, 100.0, done=True)
+
+    assert throttle.ready(update)
+    now[0] = 0.5
+    assert not throttle.ready(update)
+    assert throttle.ready(final)
+    now[0] = 1.6
+    assert throttle.ready(update)
+
+def test_stream_ffmpeg_progress_reads_pipe_and_stderr():
+    """Test streaming progress from a running process while draining stderr."""
+    script = (
+        "import sys\n"
+        "sys.stderr.write('e' * 200000)\n"
+        "for t in (1, 2, 4):\n"
+        "    print(f'out_time_us={t * 1000000}')\n"
+        "    print('progress=continue')\n"
+        "print('out_time_us=4000000')\n"
+        "print('progress=end')\n"
+    )
+    process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    updates = []
+
+    stderr = stream_ffmpeg_progress(process, "input.mp4", 4.0, updates.append, update_interval=0)
+
+    assert process.returncode == 0
+    assert len(stderr) == 200000
+    assert [u.percent for u in updates] == [25.0, 50.0, 100.0, 100.0]
+    assert updates[-1].done
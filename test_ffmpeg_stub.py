@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import conversion_logic
+import ffmpeg_stub
+from conversion_logic import ConversionSettings, PASSTHROUGH_OFF, plan_conversions, probe_media, resolve_command, run_conversion
+from ffmpeg_progress import ProgressParser
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Fixture running the stub for ffmpeg and ffprobe, with short encodes."""
+    monkeypatch.setitem(conversion_logic.FFMPEG_EXECUTABLES, "ffmpeg", ffmpeg_stub.stub_command("ffmpeg"))
+    monkeypatch.setitem(conversion_logic.FFMPEG_EXECUTABLES, "ffprobe", ffmpeg_stub.stub_command("ffprobe"))
+    monkeypatch.setenv("FFMPEG_STUB_DURATION", "30")
+    monkeypatch.setenv("FFMPEG_STUB_SPEED", "150")
+    monkeypatch.setenv("FFMPEG_STUB_STATS_PERIOD", "0.05")
+    monkeypatch.setenv("FFMPEG_STUB_FAIL", "broken")
+
+
+def test_resolve_command_splits_configured_command_lines(monkeypatch, tmp_path):
+    assert resolve_command(["ffprobe", "-v", "quiet"])[1:] == ["-v", "quiet"]
+    monkeypatch.setitem(conversion_logic.FFMPEG_EXECUTABLES, "ffmpeg", "python stub.py ffmpeg")
+    assert resolve_command(["ffmpeg", "-version"]) == ["python", "stub.py", "ffmpeg", "-version"]
+    # An existing path stays one argument even with spaces in it
+    executable = tmp_path / "my ffmpeg"
+    executable.write_text("")
+    monkeypatch.setitem(conversion_logic.FFMPEG_EXECUTABLES, "ffmpeg", str(executable))
+    assert resolve_command(["ffmpeg", "-version"]) == [str(executable), "-version"]
+    assert resolve_command(["python", "-V"]) == ["python", "-V"]
+
+
+def test_stub_probes_and_reports_progress(stub, tmp_path):
+    source = tmp_path / "in.mkv"
+    source.write_bytes(b"x" * 100)
+    media_info = probe_media(str(source), use_cache=False)
+    assert media_info.size == 100 and media_info.duration == 30.0
+    assert media_info.video_stream.codec_name == "h264"
+
+    output = tmp_path / "out.mkv"
+    command = resolve_command(["ffmpeg", "-progress", "pipe:1", "-nostats", "-i", str(source), str(output)])
+    stdout = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    parser = ProgressParser(str(source), 30.0)
+    updates = [update for update in map(parser.feed, stdout.splitlines()) if update is not None]
+    assert len(updates) > 1 and updates[-1].done and updates[-1].percent == 100.0
+    assert output.exists()
+
+    keyframes = json.loads(subprocess.run(resolve_command(["ffprobe", "-read_intervals", "10%+5", str(source)]), capture_output=True, text=True).stdout)
+    assert [packet["pts_time"] for packet in keyframes["packets"]] == ["10.000000", "12.000000", "14.000000"]
+
+
+def test_run_conversion_against_the_stub(stub, tmp_path):
+    settings = ConversionSettings(
+        output_dir=str(tmp_path / "out"), video_codec="libx265", audio_codec="aac", output_format="mkv",
+        video_bitrate="4M", passthrough=PASSTHROUGH_OFF, progress_interval=0.0,
+    )
+    (tmp_path / "out").mkdir()
+    for name in ("good.mkv", "broken.mkv"):
+        (tmp_path / name).write_bytes(b"video")
+
+    good, broken = plan_conversions([str(tmp_path / "good.mkv"), str(tmp_path / "broken.mkv")], settings)
+    assert good.probed and not broken.probed
+
+    updates = []
+    result = run_conversion(good, settings, on_progress=updates.append)
+    assert result["success"] and os.path.exists(result["output_filepath"])
+    assert updates and updates[-1].done
+
+    failed = run_conversion(broken, settings)
+    assert not failed["success"]
+    assert [path.name for path in (tmp_path / "out").iterdir()] == [os.path.basename(result["output_filepath"])]
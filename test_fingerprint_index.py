@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import fingerprint_index
+from fingerprint_index import FingerprintIndex, fingerprint_file
+
+PARAMS = {"video_codec": "libx265", "output_format": "mp4", "video_bitrate": "optimized"}
+
+@pytest.fixture
+def index(tmp_path):
+    """Fixture providing a fingerprint index backed by a temporary database."""
+    index = FingerprintIndex(tmp_path / "fingerprint_index.db")
+    yield index
+    index.close()
+
+@pytest.fixture
+def converted(tmp_path, index):
+    """Fixture recording one finished conversion; returns its input and output paths."""
+    source = tmp_path / "in" / "clip.mkv"
+    source.parent.mkdir()
+    source.write_bytes(os.urandom(300_000))
+    output = tmp_path / "z_clip.mp4"
+    output.write_bytes(b"converted")
+    index.record(str(source), PARAMS, str(output))
+    return source, output
+
+def test_fingerprint_samples_blocks(tmp_path):
+    """Test that fingerprints follow the content, including the sampled middle and end blocks."""
+    path = tmp_path / "big.bin"
+    data = bytearray(os.urandom(1_000_000))
+    path.write_bytes(data)
+    original = fingerprint_file(str(path))
+
+    data[-1] ^= 0xFF
+    path.write_bytes(data)
+    assert fingerprint_file(str(path)) != original
+
+    copy = tmp_path / "copy.bin"
+    copy.write_bytes(data)
+    assert fingerprint_file(str(copy)) == fingerprint_file(str(path))
+
+def test_lookup_survives_rename_and_move(tmp_path, index, converted):
+    """Test that a converted input is recognised under a new name in another folder."""
+    source, output = converted
+    moved = tmp_path / "elsewhere" / "renamed.mkv"
+    moved.parent.mkdir()
+    source.rename(moved)
+
+    assert index.lookup(str(moved), PARAMS) == str(output)
+    assert index.lookup(str(moved), {**PARAMS, "video_codec": "libx264"}) is None
+
+def test_copied_input_is_recognised(tmp_path, index, converted):
+    """Test that a copy (new inode and mtime) is matched by its content."""
+    source, output = converted
+    copy = tmp_path / "copy.mkv"
+    copy.write_bytes(source.read_bytes())
+
+    assert index.lookup(str(copy), PARAMS) == str(output)
+
+def test_missing_or_changed_output_is_not_reused(index, converted):
+    """Test that an output that is gone or was modified no longer counts."""
+    source, output = converted
+    output.write_bytes(b"something else entirely")
+
+    assert index.lookup(str(source), PARAMS) is None
+    assert len(index) == 0
+
+def test_unknown_size_is_rejected_without_reading(tmp_path, index, converted, monkeypatch):
+    """Test that inputs no conversion could match are never read."""
+    other = tmp_path / "other.mkv"
+    other.write_bytes(b"x" * 1234)
+    monkeypatch.setattr(fingerprint_index, "fingerprint_file", lambda path: pytest.fail("read the file"))
+
+    assert index.lookup(str(other), PARAMS) is None
+
+def test_unchanged_files_are_not_hashed_again(index, converted, monkeypatch):
+    """Test that stored fingerprints are reused while the file is unchanged."""
+    source, output = converted
+    monkeypatch.setattr(fingerprint_index, "fingerprint_file", lambda path: pytest.fail("hashed again"))
+
+    assert index.lookup(str(source), PARAMS) == str(output)
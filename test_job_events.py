@@ -0,0 +1,80 @@
+import asyncio
+import uuid
+
+from job_events import EVENT_LOG, EVENT_SNAPSHOT, EVENT_STATUS, JobEventBus
+
+JOB_ID = uuid.uuid4()
+
+async def collect(bus, last_event_id=0):
+    return [event async for event in bus.subscribe(JOB_ID, last_event_id)]
+
+def test_subscriber_receives_history_then_live_events_until_finished():
+    """Test that a subscriber gets earlier events, then live ones, and stops at the terminal status."""
+    async def scenario():
+        bus = JobEventBus()
+        bus.open(JOB_ID)
+        bus.publish(JOB_ID, EVENT_STATUS, {"status": "in_progress"})
+        consumer = asyncio.create_task(collect(bus))
+        await asyncio.sleep(0)
+        bus.publish(JOB_ID, EVENT_LOG, {"message": "Converting a.mp4"})
+        bus.publish(JOB_ID, EVENT_STATUS, {"status": "completed"})
+        return await asyncio.wait_for(consumer, 1.0)
+
+    events = asyncio.run(scenario())
+    assert [e.id for e in events] == [1, 2, 3]
+    assert events[-1].data == {"status": "completed"}
+
+def test_resume_from_last_event_id():
+    """Test that reconnecting with the last seen ID replays only newer events."""
+    async def scenario():
+        bus = JobEventBus()
+        bus.open(JOB_ID)
+        for i in range(5):
+            bus.publish(JOB_ID, EVENT_LOG, {"message": str(i)})
+        bus.publish(JOB_ID, EVENT_STATUS, {"status": "failed"})
+        return await collect(bus, last_event_id=3)
+
+    assert [e.id for e in asyncio.run(scenario())] == [4, 5, 6]
+
+def test_truncated_history_yields_snapshot():
+    """Test that a client whose position fell out of the history gets the latest state instead."""
+    async def scenario():
+        bus = JobEventBus(history_size=3)
+        bus.open(JOB_ID)
+        bus.publish(JOB_ID, EVENT_STATUS, {"status": "in_progress"})
+        for i in range(5):
+            bus.publish(JOB_ID, EVENT_LOG, {"message": str(i)})
+        bus.publish(JOB_ID, EVENT_STATUS, {"status": "completed"})
+        return await collect(bus, last_event_id=1)
+
+    events = asyncio.run(scenario())
+    assert [(e.id, e.type) for e in events] == [(7, EVENT_SNAPSHOT)]
+    assert events[0].data == {"status": "completed"}
+
+def test_slow_subscriber_catches_up_from_history():
+    """Test that a full subscriber buffer doesn't lose events that are still in the history."""
+    async def scenario():
+        bus = JobEventBus(subscriber_buffer=2)
+        bus.open(JOB_ID)
+        received = []
+        subscription = bus.subscribe(JOB_ID)
+        bus.publish(JOB_ID, EVENT_LOG, {"message": "0"})
+        received.append(await subscription.__anext__())
+        # The consumer stalls while the publisher overflows its buffer
+        for i in range(1, 10):
+            bus.publish(JOB_ID, EVENT_LOG, {"message": str(i)})
+        bus.publish(JOB_ID, EVENT_STATUS, {"status": "completed"})
+        received.extend([event async for event in subscription])
+        return received
+
+    events = asyncio.run(scenario())
+    assert [e.id for e in events] == list(range(1, 12))
+
+def test_finished_jobs_are_evicted_beyond_retention():
+    """Test that only the most recent finished jobs keep their channel."""
+    bus = JobEventBus(retained_jobs=1)
+    job_ids = [uuid.uuid4() for _ in range(3)]
+    for job_id in job_ids:
+        bus.open(job_id)
+        bus.publish(job_id, EVENT_STATUS, {"status": "completed"})
+    assert [job_id in bus for job_id in job_ids] == [False, False, True]
@@ -0,0 +1,57 @@
+import pytest
+
+import metrics
+from conversion_logic import ConversionPlan
+
+
+def test_render_uses_the_prometheus_text_format():
+    registry = metrics.Registry()
+    files = registry.counter("files_total", "Files.", ("result",))
+    running = registry.gauge("running", "Running.")
+    seconds = registry.histogram("seconds", "Seconds.", ("stage",), buckets=(1.0, 5.0))
+    files.inc(result="success")
+    files.inc(2, result="success")
+    with running.track():
+        assert running.value() == 1
+    for value in (0.5, 3.0, 10.0):
+        seconds.observe(value, stage="encode")
+
+    assert registry.render().splitlines() == [
+        "# HELP files_total Files.",
+        "# TYPE files_total counter",
+        'files_total{result="success"} 3',
+        "# HELP running Running.",
+        "# TYPE running gauge",
+        "running 0",
+        "# HELP seconds Seconds.",
+        "# TYPE seconds histogram",
+        'seconds_bucket{stage="encode",le="1"} 1',
+        'seconds_bucket{stage="encode",le="5"} 2',
+        'seconds_bucket{stage="encode",le="+Inf"} 3',
+        'seconds_sum{stage="encode"} 13.5',
+        'seconds_count{stage="encode"} 3',
+    ]
+    with pytest.raises(ValueError):
+        files.inc()
+
+
+def test_record_conversion_counts_results_and_reasons(tmp_path):
+    metrics.REGISTRY.clear()
+    source, output = tmp_path / "in.mkv", tmp_path / "out.mp4"
+    source.write_bytes(b"x" * 300)
+    output.write_bytes(b"x" * 100)
+    plan = ConversionPlan(str(source), str(output), "4M", None, 60.0, None)
+
+    metrics.record_conversion(plan, {"success": True, "output_filepath": str(output)}, 20.0)
+    metrics.record_conversion(plan, {"success": False, "error": "Conversion cancelled"}, 1.0)
+    metrics.record_conversion(plan, {"success": False, "error": "Could not start ffmpeg: not found"}, 0.0)
+    with metrics.stage(metrics.STAGE_VERIFY):
+        pass
+
+    assert metrics.CONVERSIONS.value(result="success") == 1
+    assert metrics.CONVERSIONS.value(result="cancelled") == 1
+    assert metrics.FAILURES.value(reason="spawn_failed") == 1
+    assert (metrics.INPUT_BYTES.value(), metrics.OUTPUT_BYTES.value()) == (300, 100)
+    assert metrics.ENCODE_SPEED.summary() == (1, 3.0)
+    assert metrics.STAGE_SECONDS.summary(stage="verify")[0] == 1
+    assert metrics.stage_summary().startswith("Stage timings: verify")
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from probe_cache import ProbeCache
+
+PROBE_DATA = {
+    "format": {"format_name": "matroska,webm", "duration": "10.0"},
+    "streams": [{"index": 0, "codec_type": "video", "codec_name": "hevc"}],
+}
+
+@pytest.fixture
+def cache(tmp_path):
+    """Fixture providing a probe cache backed by a temporary database."""
+    cache = ProbeCache(tmp_path / "probe_cache.db", max_entries=10)
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mkv"
+    path.write_bytes(b"x" * 64)
+    return path
+
+def test_put_and_get(cache, video):
+    """Test that stored probe data is returned for an unchanged file."""
+    cache.put(str(video), os.stat(video), PROBE_DATA)
+
+    assert cache.get(str(video), os.stat(video)) == PROBE_DATA
+    assert len(cache) == 1
+
+def test_changed_file_is_invalidated(cache, video):
+    """Test that a size or mtime change invalidates the entry."""
+    cache.put(str(video), os.stat(video), PROBE_DATA)
+    video.write_bytes(b"y" * 128)
+
+    assert cache.get(str(video), os.stat(video)) is None
+    assert len(cache) == 0
+
+def test_cache_survives_reopen(tmp_path, video):
+    """Test that entries persist across cache instances."""
+    db_file = tmp_path / "probe_cache.db"
+    first = ProbeCache(db_file)
+    first.put(str(video), os.stat(video), PROBE_DATA)
+    first.close()
+
+    second = ProbeCache(db_file)
+    assert second.get(str(video), os.stat(video)) == PROBE_DATA
+    second.close()
+
+def test_eviction_bounds_size(cache, tmp_path):
+    """Test that the cache never grows beyond max_entries."""
+    for i in range(25):
+        path = tmp_path / f"clip_{i}.mp4"
+        path.write_bytes(b"z")
+        cache.put(str(path), os.stat(path), PROBE_DATA)
+
+    assert len(cache) <= cache.max_entries
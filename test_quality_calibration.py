@@ -0,0 +1,117 @@
+import pytest
+
+import quality_calibration
+from conversion_logic import ConversionPlan, ConversionSettings, MediaInfo, conversion_params
+from fingerprint_index import FingerprintIndex
+from quality_calibration import bitrate_ladder, calibrate_bitrate, calibrate_plan, parse_quality_score
+
+PROBE = {
+    "format": {"format_name": "matroska,webm", "duration": "1200.0"},
+    "streams": [{"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080, "bit_rate": "20000000"}],
+}
+
+
+def _plan(tmp_path, duration=1200.0):
+    input_file = tmp_path / "in.mkv"
+    input_file.write_bytes(b"source video")
+    media_info = MediaInfo.from_ffprobe(str(input_file), PROBE)
+    return ConversionPlan(str(input_file), str(tmp_path / "z_in.mp4"), "4M", media_info, duration, None)
+
+
+def _settings(tmp_path, **overrides):
+    return ConversionSettings(
+        output_dir=str(tmp_path), video_codec="libx265", audio_codec="aac", output_format="mp4",
+        video_bitrate="target-quality", **overrides,
+    )
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_measure(monkeypatch):
+    """Quality rises with bitrate; each trial takes trial_seconds on the fake clock."""
+    calls = []
+    state = {"clock": FakeClock(), "trial_seconds": 1.0}
+
+    def measure(plan, settings, bitrate, work_dir, threads=None):
+        calls.append(bitrate)
+        state["clock"].now += state["trial_seconds"]
+        kbps = int(bitrate.rstrip("k"))
+        return min(1.0, 0.9 + kbps / 50_000), state["trial_seconds"] / 2
+
+    monkeypatch.setattr(quality_calibration, "measure_quality", measure)
+    state["calls"] = calls
+    return state
+
+
+def test_parse_quality_score():
+    ssim = "[Parsed_ssim_0 @ 0x5] SSIM Y:0.981 (17.2) U:0.99 (20.0) V:0.99 (20.1) All:0.984321 (18.05)"
+    psnr = "[Parsed_psnr_0 @ 0x5] PSNR y:41.2 u:44.0 v:44.3 average:42.125 min:38.0 max:50.1"
+    assert parse_quality_score("ssim", ssim) == 0.984321
+    assert parse_quality_score("psnr", psnr) == 42.125
+    assert parse_quality_score("ssim", "error") is None
+
+
+def test_bitrate_ladder_is_capped_by_the_source():
+    ladder = bitrate_ladder("4M")
+    assert ladder[0] == "1000k" and ladder[-1] == "8000k"
+    assert bitrate_ladder("4M", cap_bitrate="5M")[-1] == "5000k"
+    assert bitrate_ladder("4M", source_bitrate=3_000_000)[-1] == "3000k"
+
+
+def test_binary_search_finds_the_lowest_passing_bitrate(tmp_path, fake_measure):
+    settings = _settings(tmp_path, quality_target=0.96, calibration_budget=0.5)
+    calibration = calibrate_bitrate(_plan(tmp_path), settings, clock=fake_measure["clock"])
+
+    ladder = bitrate_ladder("4M", source_bitrate=20_000_000)
+    passing = [b for b in ladder if 0.9 + int(b.rstrip("k")) / 50_000 >= 0.96]
+    assert calibration.bitrate == passing[0]
+    assert calibration.score >= 0.96 and not calibration.reason
+    assert calibration.trials == len(fake_measure["calls"]) <= len(ladder).bit_length()
+
+
+def test_calibration_is_cached_per_fingerprint(tmp_path, fake_measure):
+    settings = _settings(tmp_path, calibration_budget=0.5)
+    cache = FingerprintIndex(tmp_path / "index.db")
+    plan, first = calibrate_plan(_plan(tmp_path), settings, cache)
+    assert plan.target_bitrate == first.bitrate and plan.estimated_size is not None
+    trials = len(fake_measure["calls"])
+
+    # The same content under another name costs no trials
+    renamed = tmp_path / "renamed.mkv"
+    (tmp_path / "in.mkv").rename(renamed)
+    renamed_plan = ConversionPlan(str(renamed), str(tmp_path / "z_renamed.mp4"), "4M", MediaInfo.from_ffprobe(str(renamed), PROBE), 1200.0, None)
+    second = calibrate_bitrate(renamed_plan, settings, cache)
+    assert second.cached and second.bitrate == first.bitrate
+    assert len(fake_measure["calls"]) == trials
+
+    # Another quality profile starts from another bitrate and searches another ladder
+    other_profile_plan = ConversionPlan(str(renamed), str(tmp_path / "z_renamed.mp4"), "6M", renamed_plan.media_info, 1200.0, None)
+    assert not calibrate_bitrate(other_profile_plan, settings, cache).cached
+    assert len(fake_measure["calls"]) > trials
+    cache.close()
+
+
+def test_calibration_stays_within_its_budget(tmp_path, fake_measure):
+    # Each trial takes 20 s while encoding the samples takes 10 s, i.e. 0.83 s per media second;
+    # 5% of the 1000 s full encode leaves room for two trials, and no candidate reaches the target
+    fake_measure["trial_seconds"] = 20.0
+    settings = _settings(tmp_path, calibration_budget=0.05, quality_target=1.01)
+    calibration = calibrate_bitrate(_plan(tmp_path), settings, clock=fake_measure["clock"])
+    assert calibration.trials == 2
+    assert calibration.bitrate == "4M" and "budget" in calibration.reason
+
+    short = calibrate_bitrate(_plan(tmp_path, duration=60.0), settings)
+    assert short.trials == 0 and "too short" in short.reason
+
+
+def test_quality_settings_only_key_target_quality_conversions(tmp_path):
+    optimized = ConversionSettings(output_dir=str(tmp_path), video_codec="libx265", audio_codec="aac", output_format="mp4")
+    assert "quality_metric" not in conversion_params(optimized)
+    assert conversion_params(_settings(tmp_path))["quality_metric"] == "ssim"
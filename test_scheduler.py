@@ -0,0 +1,54 @@
+import pytest
+
+from conversion_logic import ConversionPlan, MediaInfo, StreamInfo
+import scheduler
+
+def make_plan(name, duration, width=1920, height=1080):
+    media_info = MediaInfo(
+        path=name, format_name="mp4", duration=duration, bit_rate=None, size=None,
+        streams=(StreamInfo(index=0, codec_type="video", codec_name="h264", width=width, height=height),),
+    )
+    return ConversionPlan(name, f"z_{name}", "6M", media_info, duration, None)
+
+def test_longest_first_orders_by_duration_times_pixels():
+    """Test that LPT weighs duration by resolution."""
+    plans = [make_plan("short.mp4", 60), make_plan("uhd.mp4", 600, 3840, 2160), make_plan("long.mp4", 1200)]
+
+    ordered = scheduler.order_plans(plans, scheduler.ORDER_LONGEST_FIRST)
+
+    assert [p.input_file for p in ordered] == ["uhd.mp4", "long.mp4", "short.mp4"]
+    assert [p.input_file for p in scheduler.order_plans(plans, scheduler.ORDER_SHORTEST_FIRST)][0] == "short.mp4"
+    assert scheduler.order_plans(plans, scheduler.ORDER_FIFO) == plans
+
+def test_unknown_policy_raises():
+    with pytest.raises(ValueError):
+        scheduler.order_plans([], "random")
+
+def test_longest_first_reduces_simulated_makespan():
+    """Test that one giant file at the end no longer idles the other workers."""
+    costs = [1.0] * 31 + [10.0]
+
+    assert scheduler.simulate_makespan(costs, 4) == pytest.approx(17.0)
+    assert scheduler.simulate_makespan(sorted(costs, reverse=True), 4) == pytest.approx(11.0)
+
+def test_makespan_tracker_reports_actual_and_predicted():
+    """Test that the tracker converts predicted cost into seconds with the measured throughput."""
+    now = [0.0]
+    tracker = scheduler.MakespanTracker(workers=2, clock=lambda: now[0])
+    plans = [make_plan("a.mp4", 10), make_plan("b.mp4", 10), make_plan("c.mp4", 20)]
+    for plan in plans:
+        tracker.add(plan)
+
+    tracker.start("a.mp4")
+    tracker.start("b.mp4")
+    now[0] = 5.0
+    tracker.finish("a.mp4")
+    tracker.finish("b.mp4")
+    tracker.start("c.mp4")
+    now[0] = 15.0
+    tracker.finish("c.mp4")
+
+    report = tracker.report()
+    assert report["actual_makespan"] == pytest.approx(15.0)
+    assert report["predicted_makespan"] == pytest.approx(15.0)
+    assert report["policies"][scheduler.ORDER_LONGEST_FIRST] == pytest.approx(10.0)
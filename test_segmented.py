@@ -0,0 +1,127 @@
+import concurrent.futures
+import os
+import threading
+
+import pytest
+
+import segmented
+from conversion_logic import ConversionPlan, ConversionSettings, MediaInfo, partial_outputs, remove_partial_output
+from segmented import MIN_SEGMENT_SECONDS, SegmentedEncode, should_segment, split_points
+
+LONG_PROBE = {
+    "format": {"format_name": "matroska,webm", "duration": "600.0", "size": str(8 * 1024 ** 3), "start_time": "0.000000"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080},
+        {"index": 1, "codec_type": "audio", "codec_name": "ac3"},
+        {"index": 2, "codec_type": "subtitle", "codec_name": "subrip"},
+    ],
+}
+
+
+def _plan(tmp_path, media_info=None, duration=600.0):
+    media_info = media_info or MediaInfo.from_ffprobe(str(tmp_path / "long.mkv"), LONG_PROBE)
+    return ConversionPlan(str(tmp_path / "long.mkv"), str(tmp_path / "z_long.mp4"), "3M", media_info, duration, None)
+
+
+def _settings(tmp_path, **overrides):
+    return ConversionSettings(output_dir=str(tmp_path), video_codec="libx265", audio_codec="aac", output_format="mp4", **overrides)
+
+
+def test_split_points_pick_the_nearest_keyframes():
+    keyframes = [float(t) for t in range(0, 600, 7)]
+    assert split_points(keyframes, 600.0, 4) == [147.0, 301.0, 448.0]
+
+    # Sparse keyframes give fewer, never too short segments
+    points = split_points([10.0, 40.0, 200.0, 590.0], 600.0, 4)
+    assert points == [200.0]
+    assert all(b - a >= MIN_SEGMENT_SECONDS for a, b in zip([0.0, *points], [*points, 600.0]))
+    assert split_points([], 600.0, 4) == []
+
+
+def test_should_segment_thresholds(tmp_path):
+    plan = _plan(tmp_path)
+    assert not should_segment(plan, _settings(tmp_path))
+    assert should_segment(plan, _settings(tmp_path, segment_min_duration=300))
+    assert not should_segment(plan, _settings(tmp_path, segment_min_duration=900))
+    assert should_segment(plan, _settings(tmp_path, segment_min_size=4 * 1024 ** 3))
+    assert not should_segment(plan, _settings(tmp_path, segment_min_duration=300, segment_count=1))
+    assert not should_segment(_plan(tmp_path, duration=45.0), _settings(tmp_path, segment_min_duration=10))
+
+
+@pytest.fixture
+def encode(tmp_path, monkeypatch):
+    monkeypatch.setattr(segmented, "probe_keyframes", lambda *args, **kwargs: [float(t) for t in range(0, 600, 2)])
+    encode = SegmentedEncode(_plan(tmp_path), _settings(tmp_path, segment_min_duration=300, segment_count=3))
+    assert encode.prepare()
+    return encode
+
+
+def test_segments_share_the_plan_bitrate_and_concat_copies_video(encode):
+    assert [(s.start, s.duration) for s in encode.segments] == [(0.0, 200.0), (200.0, 200.0), (400.0, 200.0)]
+    first, last = encode.segment_command(encode.segments[0], threads=2), encode.segment_command(encode.segments[2])
+    assert first[:3] == ["ffmpeg", "-threads", "2"]
+    assert first[first.index("-t") + 1] == "200.000000"
+    assert "-t" not in last and last[last.index("-ss") + 1] == "400.000000"
+    for command in (first, last):
+        assert command[command.index("-map") + 1] == "0:0"
+        assert command[command.index("-b:v") + 1] == "3M"
+
+    command = encode.concat_command()
+    assert command[command.index("-map"):command.index("-map_metadata")] == [
+        "-map", "0:v:0", "-c:v:0", "copy",
+        "-map", "1:1", "-map", "1:2", "-c:a:0", "aac", "-c:s:0", "mov_text",
+    ]
+    assert command[-1] == encode.temp_path
+
+
+def _submit(encode, run_segment, cancel_event=None):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        return encode.submit(executor, run_segment, cancel_event).result(timeout=5)
+
+
+def _fake_segment(segment):
+    with open(segment.path, "wb") as f:
+        f.write(b"segment")
+    return {"success": True, "output_filepath": segment.path, "stderr": "", "cpu_seconds": 10.0}
+
+
+def test_segments_are_concatenated_and_cleaned_up(encode, monkeypatch):
+    def fake_concat(on_process_started=None):
+        assert sorted(os.listdir(encode.work_dir)) == ["segment_0000.mkv", "segment_0001.mkv", "segment_0002.mkv"]
+        with open(encode.temp_path, "wb") as f:
+            f.write(b"joined")
+        return segmented.finalize_output({"success": True, "output_filepath": encode.plan.output_filepath, "stderr": ""}, encode.temp_path)
+
+    monkeypatch.setattr(encode, "concat", fake_concat)
+    result = _submit(encode, _fake_segment)
+
+    assert result["success"] and result["cpu_seconds"] == 30.0
+    assert open(encode.plan.output_filepath, "rb").read() == b"joined"
+    assert not os.path.exists(encode.work_dir)
+
+
+def test_failed_or_cancelled_segments_are_not_concatenated(encode, monkeypatch):
+    monkeypatch.setattr(encode, "concat", lambda on_process_started=None: pytest.fail("must not concatenate"))
+
+    def failing_segment(segment):
+        if segment.index == 1:
+            raise RuntimeError("encoder crashed")
+        return _fake_segment(segment)
+
+    result = _submit(encode, failing_segment)
+    assert not result["success"] and "encoder crashed" in result["error"]
+    assert not os.path.exists(encode.work_dir)
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    os.makedirs(encode.work_dir)
+    result = _submit(encode, _fake_segment, cancel_event)
+    assert result["error"] == "Conversion cancelled"
+    assert not os.path.exists(encode.work_dir) and not os.path.exists(encode.plan.output_filepath)
+
+
+def test_leftover_segment_directories_are_partial_outputs(encode):
+    open(os.path.join(encode.work_dir, "segment_0000.mkv"), "wb").close()
+    assert partial_outputs(encode.plan.output_filepath) == [encode.work_dir]
+    remove_partial_output(encode.work_dir)
+    assert not os.path.exists(encode.work_dir)
@@ -0,0 +1,20 @@
+from benchmarks.throughput_benchmark import compare_results
+
+
+def _run(**metrics):
+    case = {"name": "libx264/1280x720/10s/c2", "files_per_s": 1.0, "media_seconds_per_s": 10.0,
+            "probe_ms_per_file": 40.0, "peak_rss_mb": 60.0, "peak_child_rss_mb": 200.0}
+    return {"cases": [{**case, **metrics}]}
+
+
+def test_compare_flags_regressions_in_either_direction():
+    baseline = _run()
+    assert compare_results(baseline, _run(files_per_s=0.95, peak_rss_mb=64.0)) == ([], [])
+
+    regressions, missing = compare_results(baseline, _run(media_seconds_per_s=8.0, peak_child_rss_mb=260.0))
+    assert [(r["metric"], r["change"]) for r in regressions] == [("media_seconds_per_s", -0.2), ("peak_child_rss_mb", 0.3)]
+    assert not missing
+
+    # Faster and smaller is never a regression
+    assert compare_results(baseline, _run(files_per_s=2.0, probe_ms_per_file=10.0)) == ([], [])
+    assert compare_results(baseline, {"cases": []}) == ([], ["libx264/1280x720/10s/c2"])
@@ -0,0 +1,194 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import conversion_logic
+import ffmpeg_stub
+from conversion_logic import ConversionSettings, ScanOptions, conversion_params
+from fingerprint_index import FingerprintIndex
+from watch_folder import InotifyWatcher, PollingWatcher, StabilityTracker, WatchFolderDaemon
+
+@pytest.fixture
+def clock():
+    """Fixture providing a manually advanced clock."""
+    return [0.0]
+
+def test_file_is_ready_only_after_it_stops_growing(tmp_path, clock):
+    """Test that a growing file is held back until it has settled."""
+    video = tmp_path / "ingest.mp4"
+    video.write_bytes(b"x" * 10)
+    tracker = StabilityTracker(settle_seconds=5, clock=lambda: clock[0])
+
+    tracker.observe(str(video))
+    assert tracker.ready_files() == []
+
+    clock[0] = 4
+    video.write_bytes(b"x" * 20) # Still being copied
+    assert tracker.ready_files() == []
+
+    clock[0] = 8
+    assert tracker.ready_files() == []
+    clock[0] = 10
+    assert tracker.ready_files() == [str(video)]
+
+def test_file_is_never_queued_twice(tmp_path, clock):
+    """Test that an unchanged file observed again is not reported a second time."""
+    video = tmp_path / "ingest.mp4"
+    video.write_bytes(b"x")
+    tracker = StabilityTracker(settle_seconds=0, clock=lambda: clock[0])
+
+    tracker.observe(str(video))
+    tracker.ready_files()
+    assert tracker.ready_files() == [str(video)]
+
+    tracker.observe(str(video))
+    tracker.ready_files()
+    assert tracker.ready_files() == []
+    assert tracker.pending_count() == 0
+
+def test_deleted_candidate_is_dropped(tmp_path, clock):
+    video = tmp_path / "ingest.mp4"
+    video.write_bytes(b"x")
+    tracker = StabilityTracker(settle_seconds=0, clock=lambda: clock[0])
+
+    tracker.observe(str(video))
+    video.unlink()
+
+    assert tracker.ready_files() == []
+    assert tracker.pending_count() == 0
+
+def test_prune_forgets_removed_and_changed_files(tmp_path, clock):
+    kept, removed, changed = (tmp_path / name for name in ("kept.mp4", "removed.mp4", "changed.mp4"))
+    for path in (kept, removed, changed):
+        path.write_bytes(b"x")
+    tracker = StabilityTracker(settle_seconds=0, clock=lambda: clock[0])
+    for path in (kept, removed, changed):
+        tracker.observe(str(path))
+    tracker.ready_files()
+    assert len(tracker.ready_files()) == 3
+
+    removed.unlink()
+    changed.write_bytes(b"longer")
+    tracker.prune()
+
+    assert tracker._queued == {(str(kept), kept.stat().st_size, kept.stat().st_mtime_ns)}
+
+def test_restarted_daemon_skips_converted_inputs_and_frees_output_names(tmp_path, monkeypatch):
+    """Test that inputs indexed by an earlier run aren't converted again and reserved output names are released."""
+    (tmp_path / "out").mkdir()
+    done, new = tmp_path / "done.mp4", tmp_path / "new.mp4"
+    done.write_bytes(b"converted before")
+    new.write_bytes(b"new")
+    settings = ConversionSettings(output_dir=str(tmp_path / "out"), video_codec="libx265", audio_codec="aac", output_format="mkv")
+    index = FingerprintIndex(tmp_path / "index.db")
+    (tmp_path / "out" / "z_done.mkv").write_bytes(b"output")
+    index.record(str(done), conversion_params(settings), str(tmp_path / "out" / "z_done.mkv"))
+    converted = []
+    monkeypatch.setattr("watch_folder.probe_media", lambda path: None)
+    monkeypatch.setattr("watch_folder.run_conversion", lambda plan, *args, **kwargs: converted.append(plan.input_file) or {"success": False})
+    daemon = WatchFolderDaemon(str(tmp_path), settings, use_inotify=False, fingerprint_index=index)
+
+    assert daemon._convert(str(done))["skipped"]
+    daemon._convert(str(new))
+
+    assert converted == [str(new)]
+    assert daemon._reserved_outputs == set()
+
+def test_polling_watcher_finds_existing_files(tmp_path):
+    (tmp_path / "a.mp4").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+    watcher = PollingWatcher(str(tmp_path), ScanOptions(), poll_interval=60)
+
+    assert watcher.poll(timeout=0) == {str(tmp_path / "a.mp4")}
+    assert watcher.poll(timeout=0) == set()
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux-only")
+def test_inotify_watcher_reports_new_files_in_new_subfolders(tmp_path):
+    """Test that files created after startup, including in new folders, are reported."""
+    (tmp_path / "existing.mkv").write_bytes(b"x")
+    watcher = InotifyWatcher(str(tmp_path), ScanOptions())
+    try:
+        assert watcher.poll(timeout=0) == {str(tmp_path / "existing.mkv")}
+
+        (tmp_path / "new.mp4").write_bytes(b"x")
+        (tmp_path / "ignored.txt").write_bytes(b"x")
+        assert watcher.poll(timeout=1) == {str(tmp_path / "new.mp4")}
+
+        (tmp_path / "show").mkdir()
+        watcher.poll(timeout=1)
+        (tmp_path / "show" / "episode.mkv").write_bytes(b"x")
+        assert str(tmp_path / "show" / "episode.mkv") in watcher.poll(timeout=1)
+    finally:
+        watcher.close()
+
+def test_interrupt_cancels_running_conversions_instead_of_waiting(tmp_path, monkeypatch):
+    """Test that Ctrl+C sets the stop event for running conversions and drops queued ones."""
+    (tmp_path / "a.mp4").write_bytes(b"x")
+    (tmp_path / "b.mp4").write_bytes(b"x")
+    settings = ConversionSettings(output_dir=str(tmp_path / "out"), video_codec="libx265", audio_codec="aac", output_format="mkv")
+    daemon = WatchFolderDaemon(
+        str(tmp_path), settings, concurrent_conversions=1, settle_seconds=0, use_inotify=False,
+        fingerprint_index=FingerprintIndex(tmp_path / "index.db"),
+    )
+    started, converted = threading.Event(), []
+
+    def convert(video_file):
+        started.set()
+        # Stands in for a conversion that ends once the daemon stops
+        assert daemon.stop_event.wait(10)
+        converted.append(video_file)
+        return {"success": False, "skipped": True}
+
+    real_poll = PollingWatcher.poll
+    def poll(watcher, timeout):
+        if started.is_set():
+            raise KeyboardInterrupt
+        return real_poll(watcher, 0)
+
+    monkeypatch.setattr(daemon, "_convert", convert)
+    monkeypatch.setattr(PollingWatcher, "poll", poll)
+    monkeypatch.setattr("watch_folder.load_optimized_bitrate_map", lambda profile: None)
+    began = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        daemon.run()
+
+    assert time.monotonic() - began < 5
+    assert daemon.stop_event.is_set()
+    assert len(converted) == 1
+
+def test_stop_terminates_running_ffmpeg(tmp_path, monkeypatch):
+    """Test that stop() ends a real conversion (against the stub ffmpeg) long before its encode would finish."""
+    monkeypatch.setitem(conversion_logic.FFMPEG_EXECUTABLES, "ffmpeg", ffmpeg_stub.stub_command("ffmpeg"))
+    monkeypatch.setitem(conversion_logic.FFMPEG_EXECUTABLES, "ffprobe", ffmpeg_stub.stub_command("ffprobe"))
+    # A 60 second encode
+    monkeypatch.setenv("FFMPEG_STUB_DURATION", "600")
+    monkeypatch.setenv("FFMPEG_STUB_SPEED", "10")
+    monkeypatch.setenv("FFMPEG_STUB_STATS_PERIOD", "0.05")
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    (input_dir / "a.mkv").write_bytes(b"x")
+    settings = ConversionSettings(
+        output_dir=str(output_dir), video_codec="libx265", audio_codec="aac", output_format="mkv", video_bitrate="4M",
+        passthrough=conversion_logic.PASSTHROUGH_OFF,
+    )
+    daemon = WatchFolderDaemon(
+        str(input_dir), settings, concurrent_conversions=1, settle_seconds=0, poll_interval=0.05, use_inotify=False,
+        fingerprint_index=FingerprintIndex(tmp_path / "index.db"),
+    )
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    deadline = time.monotonic() + 15
+    while not daemon._processes and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert daemon._processes, "the conversion never started"
+
+    began = time.monotonic()
+    daemon.stop()
+    thread.join(timeout=20)
+
+    assert not thread.is_alive()
+    assert time.monotonic() - began < 10
+    assert list(output_dir.iterdir()) == []
@@ -0,0 +1,477 @@
+"""
+Headless watch-folder mode: converts files as they land in an ingest folder.
+
+New files are detected with inotify on Linux, or by periodically re-scanning the
+folder where inotify is unavailable (other platforms, network shares). A file is only
+queued once its size and mtime have stopped changing for a settle period, and every
+file is queued at most once. Converted inputs are recorded in the fingerprint index, so
+files still in the folder when the daemon restarts are not converted again.
+
+Usage:
+    python watch_folder.py INPUT_DIR OUTPUT_DIR [--video-codec libx265] [--concurrency 2] ...
+"""
+import argparse
+import dataclasses
+import concurrent.futures
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable
+
+import structlog
+
+from conversion_logic import (
+    ACTION_ENCODE,
+    ACTION_SKIP,
+    ATTACHMENTS_DROP,
+    ATTACHMENTS_KEEP,
+    BITRATE_TARGET_QUALITY,
+    DEFAULT_CALIBRATION_BUDGET,
+    DEFAULT_PASSTHROUGH_THRESHOLD,
+    PASSTHROUGH_COPY,
+    PASSTHROUGH_OFF,
+    PASSTHROUGH_SKIP,
+    QUALITY_METRIC_PSNR,
+    QUALITY_METRIC_SSIM,
+    SUBTITLES_DROP,
+    SUBTITLES_KEEP,
+    ConversionSettings,
+    ScanOptions,
+    conversion_params,
+    load_optimized_bitrate_map,
+    matches_scan_options,
+    plan_conversion,
+    probe_media,
+    run_conversion,
+    scan_video_files,
+)
+from cpu_allocation import CpuAllocator
+from encoder_capabilities import FALLBACK_CPU, FALLBACK_POLICIES, CapabilityRegistry
+from fingerprint_index import FingerprintIndex
+from logging_config import configure_logging
+from quality_calibration import calibrate_plan
+
+log = structlog.get_logger()
+
+DEFAULT_SETTLE_SECONDS = 10.0
+DEFAULT_POLL_INTERVAL = 5.0
+# Even with inotify, re-scan occasionally to catch anything the kernel didn't report
+DEFAULT_RESCAN_INTERVAL = 300.0
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class StabilityTracker:
+    """
+    Tracks candidate files until their size and mtime stop changing, and de-duplicates them.
+
+    A file is identified by its path, size and mtime, so the same file is never reported
+    ready twice, while a file that is later replaced with new content is picked up again.
+    """
+
+    def __init__(self, settle_seconds: float = DEFAULT_SETTLE_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.settle_seconds = settle_seconds
+        self._clock = clock
+        self._pending = {}
+        self._queued = set()
+
+    def observe(self, path: str):
+        """Registers a new or changed candidate file."""
+        if path not in self._pending:
+            self._pending[path] = (None, self._clock())
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def ready_files(self) -> list[str]:
+        """Returns the candidates that have been stable for the settle period, marking them queued."""
+        now = self._clock()
+        ready = []
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path] # Deleted or moved away before it settled
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if (path, *current) in self._queued:
+                del self._pending[path]
+                continue
+            if current != signature:
+                self._pending[path] = (current, now)
+                continue
+            if now - since >= self.settle_seconds:
+                del self._pending[path]
+                self._queued.add((path, *current))
+                ready.append(path)
+        return ready
+
+    def prune(self):
+        """Forgets queued files that were removed or changed since, so only files still in the folder are remembered."""
+        for entry in list(self._queued):
+            path, size, mtime_ns = entry
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._queued.discard(entry)
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self._queued.discard(entry)
+
+
+class PollingWatcher:
+    """Detects candidate files by re-scanning the folder every poll_interval seconds."""
+
+    def __init__(self, directory: str, scan_options: ScanOptions, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.scan_options = scan_options
+        self.poll_interval = poll_interval
+        self._next_scan = 0.0
+
+    def poll(self, timeout: float) -> set[str]:
+        now = time.monotonic()
+        if now < self._next_scan:
+            time.sleep(min(timeout, self._next_scan - now))
+            return set()
+        self._next_scan = now + self.poll_interval
+        return set(scan_video_files(self.directory, self.scan_options))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects candidate files with Linux inotify, watching every subdirectory.
+
+    Raises OSError if inotify is unavailable, so callers can fall back to PollingWatcher.
+    """
+
+    def __init__(self, directory: str, scan_options: ScanOptions):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.directory = os.path.abspath(directory)
+        self.scan_options = scan_options
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self._initial = self._add_tree(self.directory)
+
+    def _add_watch(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self._watches[wd] = path
+
+    def _add_tree(self, root: str) -> set[str]:
+        # Watch the directory first, then scan it, so nothing created in between is missed
+        self._add_watch(root)
+        if self.scan_options.recursive:
+            for dirpath, dirnames, _ in os.walk(root, followlinks=False):
+                for dirname in dirnames:
+                    self._add_watch(os.path.join(dirpath, dirname))
+        # Filters are relative to the watched folder, not to a newly created subdirectory
+        return {
+            path for path in scan_video_files(root, self.scan_options)
+            if matches_scan_options(self.directory, path, self.scan_options)
+        }
+
+    def poll(self, timeout: float) -> set[str]:
+        candidates, self._initial = self._initial, set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return candidates
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return candidates
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events; fall back to a full scan
+                candidates |= set(scan_video_files(self.directory, self.scan_options))
+                continue
+            parent = self._watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.scan_options.recursive:
+                    try:
+                        candidates |= self._add_tree(path)
+                    except OSError:
+                        pass # Removed again before we could watch it
+            elif matches_scan_options(self.directory, path, self.scan_options):
+                candidates.add(path)
+        return candidates
+
+    def close(self):
+        os.close(self._fd)
+
+
+class WatchFolderDaemon:
+    """
+    Continuously converts stable new files from input_dir through a bounded worker pool.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        settings: ConversionSettings,
+        scan_options: ScanOptions | None = None,
+        concurrent_conversions: int = 2,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        rescan_interval: float = DEFAULT_RESCAN_INTERVAL,
+        use_inotify: bool = True,
+        pin_cpus: bool = False,
+        fingerprint_index: FingerprintIndex | None = None,
+    ):
+        self.input_dir = os.path.abspath(input_dir)
+        self.settings = settings
+        # The output folder may be inside the watched one; its files are never inputs
+        scan_options = scan_options or ScanOptions()
+        self.scan_options = dataclasses.replace(scan_options, exclude_dirs=(*scan_options.exclude_dirs, settings.output_dir))
+        self.concurrent_conversions = concurrent_conversions
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.use_inotify = use_inotify
+        self.tracker = StabilityTracker(settle_seconds)
+        self.cpu_allocator = CpuAllocator(expected_encodes=concurrent_conversions, pin_affinity=pin_cpus)
+        # Finished conversions, so inputs converted before a restart are skipped
+        self.fingerprint_index = fingerprint_index if fingerprint_index is not None else FingerprintIndex()
+        self.calibration_cache = self.fingerprint_index if settings.video_bitrate == BITRATE_TARGET_QUALITY else None
+        self.stop_event = threading.Event()
+        self._output_dir = os.path.abspath(settings.output_dir)
+        self._reserved_outputs = set()
+        self._active = set()
+        # The running ffmpeg processes by input, terminated by stop()
+        self._processes = {}
+        self._active_lock = threading.Lock()
+
+    def _create_watcher(self):
+        if self.use_inotify:
+            try:
+                watcher = InotifyWatcher(self.input_dir, self.scan_options)
+                log.info("Watching folder with inotify", input_dir=self.input_dir)
+                return watcher
+            except OSError as e:
+                log.warning("inotify unavailable, falling back to polling", error=str(e))
+        log.info("Watching folder by polling", input_dir=self.input_dir, poll_interval=self.poll_interval)
+        return PollingWatcher(self.input_dir, self.scan_options, self.poll_interval)
+
+    def _is_output(self, path: str) -> bool:
+        # Never re-ingest our own outputs when the output folder is inside the watched folder
+        try:
+            return os.path.commonpath([self._output_dir, os.path.abspath(path)]) == self._output_dir
+        except ValueError:
+            return False # Different drives on Windows
+
+    def _convert(self, video_file: str) -> dict:
+        existing_output = self.fingerprint_index.lookup(video_file, conversion_params(self.settings))
+        if existing_output is not None:
+            log.info("Skipping file", input_file=video_file, reason="already converted", output_file=existing_output)
+            return {"success": False, "skipped": True, "output_filepath": None}
+        media_info = probe_media(video_file)
+        with self._active_lock:
+            plan = plan_conversion(video_file, media_info, self.settings, self._reserved_outputs)
+        try:
+            return self._convert_plan(plan)
+        finally:
+            # From here on the output exists on disk or the name is free again
+            with self._active_lock:
+                self._reserved_outputs.discard(plan.output_filepath)
+
+    def _convert_plan(self, plan) -> dict:
+        video_file = plan.input_file
+        if plan.action == ACTION_SKIP:
+            log.info("Skipping file", input_file=video_file, reason=plan.reason)
+            return {"success": False, "skipped": True, "output_filepath": None}
+        if plan.action == ACTION_ENCODE and self.settings.video_bitrate == BITRATE_TARGET_QUALITY:
+            plan, calibration = calibrate_plan(plan, self.settings, self.calibration_cache, self.stop_event, self.cpu_allocator)
+            log.info("Calibrated bitrate", input_file=video_file, calibration=calibration.describe())
+        log.info("Converting file", input_file=video_file, output_file=plan.output_filepath, bitrate=plan.target_bitrate, action=plan.action)
+        try:
+            return run_conversion(
+                plan, self.settings, self.stop_event, cpu_allocator=self.cpu_allocator,
+                on_process_started=lambda process: self._track_process(video_file, process),
+            )
+        finally:
+            with self._active_lock:
+                self._processes.pop(video_file, None)
+
+    def _track_process(self, video_file: str, process):
+        with self._active_lock:
+            if not self.stop_event.is_set():
+                self._processes[video_file] = process
+                return
+        # stop() already ran and won't see this process
+        process.terminate()
+
+    def _on_done(self, video_file: str, future: concurrent.futures.Future):
+        with self._active_lock:
+            self._active.discard(video_file)
+        try:
+            result = future.result()
+        except concurrent.futures.CancelledError:
+            return
+        except Exception as e:
+            log.error("Conversion raised an exception", input_file=video_file, error=str(e))
+            return
+        if result.get("skipped"):
+            return
+        if not result["success"]:
+            log.error("Conversion failed", input_file=video_file, error=result.get("error"))
+            return
+        log.info("Conversion succeeded", input_file=video_file, output_file=result["output_filepath"])
+        try:
+            # Recorded before the input may be deleted, so a restarted daemon recognises it
+            self.fingerprint_index.record(video_file, conversion_params(self.settings), result["output_filepath"])
+        except OSError as e:
+            log.warning("Could not index converted file", input_file=video_file, error=str(e))
+        if self.settings.delete_input:
+            try:
+                os.remove(video_file)
+                log.info("Deleted input file", input_file=video_file)
+            except OSError as e:
+                log.error("Error deleting input file", input_file=video_file, error=str(e))
+
+    def run(self):
+        """Watches and converts until stop() is called."""
+        load_optimized_bitrate_map(self.settings.quality_profile)
+        log.info("CPU budget", cpu_budget=self.cpu_allocator.budget.describe(), pin_cpus=self.cpu_allocator.pin_affinity)
+        watcher = self._create_watcher()
+        next_rescan = time.monotonic() + self.rescan_interval
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrent_conversions)
+        try:
+            while not self.stop_event.is_set():
+                candidates = watcher.poll(timeout=1.0)
+                if time.monotonic() >= next_rescan:
+                    candidates |= set(scan_video_files(self.input_dir, self.scan_options))
+                    self.tracker.prune()
+                    next_rescan = time.monotonic() + self.rescan_interval
+                for path in candidates:
+                    if not self._is_output(path):
+                        self.tracker.observe(path)
+
+                for video_file in self.tracker.ready_files():
+                    with self._active_lock:
+                        if video_file in self._active:
+                            continue
+                        self._active.add(video_file)
+                    log.info("Queued stable file", input_file=video_file)
+                    future = executor.submit(self._convert, video_file)
+                    future.add_done_callback(lambda f, video_file=video_file: self._on_done(video_file, f))
+        finally:
+            # On stop() or Ctrl+C, terminate the running conversions and drop queued ones before waiting for the workers
+            self.stop()
+            executor.shutdown(wait=True, cancel_futures=True)
+            watcher.close()
+
+    def stop(self):
+        """Stops watching and terminates the running ffmpeg processes; their conversions end as cancelled."""
+        with self._active_lock:
+            self.stop_event.set()
+            processes = list(self._processes.values())
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuously convert new files dropped into a folder.")
+    parser.add_argument("input_dir", help="The folder to watch.")
+    parser.add_argument("output_dir", help="The folder converted files are written to.")
+    parser.add_argument("--video-codec", default="hevc_nvenc")
+    parser.add_argument("--audio-codec", default="aac")
+    parser.add_argument("--output-format", default="mp4")
+    parser.add_argument("--video-bitrate", default="optimized", help='"optimized", "dynamic", "target-quality" or a fixed bitrate such as "6M".')
+    parser.add_argument("--quality-metric", choices=(QUALITY_METRIC_SSIM, QUALITY_METRIC_PSNR), default=QUALITY_METRIC_SSIM,
+                        help="The metric target-quality mode calibrates against.")
+    parser.add_argument("--quality-target", type=float, default=None, help="The score to reach; defaults to 0.96 SSIM or 40 dB PSNR.")
+    parser.add_argument("--calibration-budget", type=float, default=DEFAULT_CALIBRATION_BUDGET,
+                        help="The fraction of a file's encode time its calibration may take.")
+    parser.add_argument("--quality-profile", default="Balanced Quality")
+    parser.add_argument("--fallback-bitrate", default="6M")
+    parser.add_argument("--cap-dynamic-bitrate", action="store_true")
+    parser.add_argument("--delete-input", action="store_true", help="Delete inputs after a successful conversion.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of concurrent conversions.")
+    parser.add_argument("--settle-seconds", type=float, default=DEFAULT_SETTLE_SECONDS, help="How long a file must stop growing before it is queued.")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Re-scan interval when polling.")
+    parser.add_argument("--no-inotify", action="store_true", help="Always poll, e.g. for network shares.")
+    parser.add_argument("--no-recursive", action="store_true", help="Only watch the top-level folder.")
+    parser.add_argument("--passthrough", choices=(PASSTHROUGH_COPY, PASSTHROUGH_SKIP, PASSTHROUGH_OFF), default=PASSTHROUGH_COPY,
+                        help="What to do with inputs already in the target codec at or below the target bitrate.")
+    parser.add_argument("--passthrough-threshold", type=float, default=DEFAULT_PASSTHROUGH_THRESHOLD,
+                        help="Inputs up to this multiple of the target bitrate count as already at target.")
+    parser.add_argument("--drop-subtitles", action="store_true", help="Leave subtitle streams out of the outputs.")
+    parser.add_argument("--drop-attachments", action="store_true", help="Leave attachments such as fonts out of the outputs.")
+    parser.add_argument("--pin-cpus", action="store_true", help="Pin each conversion to its own set of CPU cores.")
+    parser.add_argument("--codec-fallback", choices=FALLBACK_POLICIES, default=FALLBACK_CPU,
+                        help="If the video encoder can't be used: switch to a CPU encoder of the same codec, or fail.")
+    args = parser.parse_args()
+
+    configure_logging()
+    settings = ConversionSettings(
+        output_dir=args.output_dir,
+        video_codec=args.video_codec,
+        audio_codec=args.audio_codec,
+        output_format=args.output_format,
+        video_bitrate=args.video_bitrate,
+        fallback_bitrate=args.fallback_bitrate,
+        cap_dynamic_bitrate=args.cap_dynamic_bitrate,
+        quality_profile=args.quality_profile,
+        delete_input=args.delete_input,
+        passthrough=args.passthrough,
+        passthrough_threshold=args.passthrough_threshold,
+        subtitles=SUBTITLES_DROP if args.drop_subtitles else SUBTITLES_KEEP,
+        attachments=ATTACHMENTS_DROP if args.drop_attachments else ATTACHMENTS_KEEP,
+        quality_metric=args.quality_metric,
+        quality_target=args.quality_target,
+        calibration_budget=args.calibration_budget,
+    )
+    try:
+        settings, notes = CapabilityRegistry().resolve_settings(settings, args.codec_fallback)
+    except ValueError as e:
+        parser.error(str(e))
+    for note in notes:
+        log.warning("Codec check", note=note)
+    os.makedirs(args.output_dir, exist_ok=True)
+    daemon = WatchFolderDaemon(
+        args.input_dir,
+        settings,
+        ScanOptions(recursive=not args.no_recursive),
+        concurrent_conversions=args.concurrency,
+        settle_seconds=args.settle_seconds,
+        poll_interval=args.poll_interval,
+        use_inotify=not args.no_inotify,
+        pin_cpus=args.pin_cpus,
+    )
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        log.info("Stopped; running conversions were cancelled")
+
+
+if __name__ == "__main__":
+    main()